@@ -1,71 +1,428 @@
+import argparse
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
+from pandas.api.types import union_categoricals
+from sklearn.model_selection import train_test_split, RandomizedSearchCV
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error
-import re
+from pricing_engines import ENGINES, build_estimator
+from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 import joblib
 
-df = pd.read_csv("畢業專題田野調查.csv", encoding="utf-8-sig")
+# ----------------- 訓練資料設定 -----------------
+DATA_PATH = "畢業專題田野調查.csv"
+RESULT_PATH = "dynamic_pricing_result.csv"
+MODEL_PATH = "random_forest_model.pkl"
+CHUNK_SIZE = 200_000
+HISTORY_FILE = "training_history.jsonl"
+
+# 超參數搜尋空間
+PARAM_SPACE = {
+    'n_estimators': [100, 200, 400],
+    'max_depth': [None, 10, 20, 30],
+    'min_samples_leaf': [1, 2, 4],
+    'max_features': [1.0, 0.5, 'sqrt'],
+}
+
+CATEGORICAL_COLS = ['商品大類', '停車狀況', '人流量', '天氣']
+# 讀檔時固定型別，每個 chunk 的 schema 才會一致
+RAW_DTYPES = {
+    '時間': 'string',
+    '剩餘保存期限': 'float64',
+    '當下溫度': 'float64',
+    '貨架上庫存量': 'float64',
+    '原價': 'float64',
+    '折扣(off)': 'float64',
+    '商品品項': 'string',
+    **{c: 'string' for c in CATEGORICAL_COLS},
+}
+USE_COLS = list(RAW_DTYPES)
+
+
+# ----------------- 各階段耗時 / 記憶體 -----------------
+class StageReport:
+    """記錄每個階段的執行時間與 Python 配置的記憶體峰值（tracemalloc）"""
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.rows = []
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+            self.rows.append((name, elapsed, peak))
 
-def compute_remaining_hours(row):
-    hours = row['剩餘保存期限'] * 24
-    time_str = str(row['時間'])
-    match = re.search(r'(\d{1,2}):\d{2}-(\d{1,2}):\d{2}', time_str)
-    if match:
-        end_hour = int(match.group(2))
+    def print(self):
+        print(f"{'階段':<16}{'耗時(s)':>10}{'記憶體峰值(MB)':>18}")
+        for name, elapsed, peak in self.rows:
+            peak_mb = f"{peak / 1024 / 1024:.1f}" if peak is not None else "-"
+            print(f"{name:<16}{elapsed:>10.2f}{peak_mb:>18}")
+
+    def to_dict(self):
+        return {
+            name: {"seconds": round(elapsed, 3), "peak_mb": round(peak / 1024 / 1024, 1) if peak is not None else None}
+            for name, elapsed, peak in self.rows
+        }
+
+
+# ----------------- 讀取與特徵 -----------------
+def iter_raw_chunks(path, chunksize=CHUNK_SIZE):
+    """分批讀取田野調查資料；支援 CSV 與 Parquet（欄式儲存，需安裝 pyarrow）"""
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(path)
+        columns = [c for c in USE_COLS if c in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas().astype({c: t for c, t in RAW_DTYPES.items() if c in columns})
     else:
-        end_hour = 0  # 防呆
+        yield from pd.read_csv(
+            path, encoding="utf-8-sig", usecols=lambda c: c in RAW_DTYPES,
+            dtype=RAW_DTYPES, chunksize=chunksize
+        )
 
+
+def compute_remaining_hours(df):
+    """剩餘保存期限（天）換算成小時，再加上調查時段結束後到當天結束的時數"""
+    end_hour = df['時間'].str.extract(r'(\d{1,2}):\d{2}-(\d{1,2}):\d{2}')[1]
+    end_hour = pd.to_numeric(end_hour, errors='coerce').fillna(0)  # 防呆
     remaining_today = 24 - end_hour
-    total_hours = hours + remaining_today
-    return total_hours
+    return df['剩餘保存期限'] * 24 + remaining_today
+
+
+def prepare_chunk(chunk):
+    """單一 chunk：算出剩餘小時與目標值，轉成精簡型別"""
+    out = pd.DataFrame(index=chunk.index)
+    out['商品品項'] = chunk['商品品項']
+    out['剩餘保存期限_小時'] = compute_remaining_hours(chunk).fillna(0).astype('float32')
+    # 樹模型內部以 float32 比較特徵，縮成 float32 不影響結果
+    for col in ['原價', '當下溫度', '貨架上庫存量']:
+        out[col] = chunk[col].fillna(0).astype('float32')
+
+    # 目標值維持 float64
+    price = chunk['原價'].fillna(0)
+    sale = price * (1 - chunk['折扣(off)'].fillna(0) / 100)
+    out['折扣實際'] = 1 - sale / price
+
+    for col in CATEGORICAL_COLS:
+        out[col] = chunk[col].astype('category')
+    return out
+
+
+def combine_chunks(chunks):
+    """合併 chunk；類別欄位取各 chunk 類別的聯集（排序後與 get_dummies 欄位順序相同）"""
+    if not chunks:
+        raise ValueError("沒有讀到任何資料")
+    categoricals = {
+        col: union_categoricals([c[col] for c in chunks], sort_categories=True)
+        for col in CATEGORICAL_COLS
+    }
+    df = pd.concat([c.drop(columns=CATEGORICAL_COLS) for c in chunks], ignore_index=True)
+    for col, values in categoricals.items():
+        df[col] = values
+    return df
+
+
+def load_dataset(path, chunksize=CHUNK_SIZE):
+    chunks = [prepare_chunk(chunk) for chunk in iter_raw_chunks(path, chunksize)]
+    return combine_chunks(chunks)
+
+
+def build_features(df):
+    df = pd.get_dummies(df, columns=CATEGORICAL_COLS, dtype=np.uint8)
+    feature_cols = ['剩餘保存期限_小時', '原價', '當下溫度', '貨架上庫存量'] \
+                   + [c for c in df.columns if c.startswith('商品大類_')] \
+                   + [c for c in df.columns if c.startswith('停車狀況_')] \
+                   + [c for c in df.columns if c.startswith('人流量_')] \
+                   + [c for c in df.columns if c.startswith('天氣_')]
+    return df, feature_cols
+
+
+# ----------------- 評估與報告 -----------------
+def evaluate(model, X_test, y_test):
+    y_pred = model.predict(X_test)
+    return {
+        "mse": float(mean_squared_error(y_test, y_pred)),
+        "mae": float(mean_absolute_error(y_test, y_pred)),
+        "r2": float(r2_score(y_test, y_pred)),
+    }
+
+
+def write_report(model_path, command, report, metrics, model, n_rows, extra=None):
+    """
+    在模型旁寫一份 <模型檔>.report.json，並在同目錄的 training_history.jsonl 追加一行，
+    方便追蹤每次訓練的成本與準確度
+    """
+    data = {
+        "command": command,
+        "model": os.path.basename(model_path),
+        "trained_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "rows": n_rows,
+        "cpu_count": os.cpu_count(),
+        "params": {k: v for k, v in model.get_params().items() if k != "warm_start"},
+        "metrics": metrics,
+        "stages": report.to_dict(),
+        "total_seconds": round(sum(r[1] for r in report.rows), 3),
+        **(extra or {}),
+    }
+    with open(model_path + ".report.json", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+    history = os.path.join(os.path.dirname(os.path.abspath(model_path)), HISTORY_FILE)
+    with open(history, "a", encoding="utf-8") as f:
+        f.write(json.dumps(data, ensure_ascii=False, default=str) + "\n")
+    print("訓練報告：", model_path + ".report.json")
 
-df['剩餘保存期限_小時'] = df.apply(compute_remaining_hours, axis=1)
 
-print(df[['時間', '剩餘保存期限', '剩餘保存期限_小時']].head())
+# ----------------- 指令 -----------------
+def load_training_data(args, report):
+    with report.stage("讀取資料"):
+        df = load_dataset(args.data, args.chunksize)
+    print(df[['剩餘保存期限_小時']].head())
+    print(f"共 {len(df)} 筆，記憶體 {df.memory_usage(deep=True).sum() / 1024 / 1024:.1f} MB")
 
+    with report.stage("one-hot"):
+        df, feature_cols = build_features(df)
+    return df, feature_cols
 
-df = pd.get_dummies(df, columns=['商品大類', '停車狀況', '人流量', '天氣'])
-df.fillna(0, inplace=True)
-cols = [c for c in df.columns if '_' in c]
-#df[cols] = df[cols].fillna(0).astype(int)
-df['售價'] = df['原價']*(1-df['折扣(off)']/100)
-df['折扣實際'] = 1 - df['售價'] / df['原價']
 
-# 特徵欄位
-feature_cols = ['剩餘保存期限_小時','原價','當下溫度','貨架上庫存量'] \
-               + [c for c in df.columns if c.startswith('商品大類_')] \
-               + [c for c in df.columns if c.startswith('停車狀況_')] \
-               + [c for c in df.columns if c.startswith('人流量_')] \
-               + [c for c in df.columns if c.startswith('天氣_')]
+def train(args):
+    report = StageReport(trace_memory=not args.no_trace_memory)
+    df, feature_cols = load_training_data(args, report)
+    X = df[feature_cols]
+    y = df['折扣實際']
 
-X = df[feature_cols]
-y = df['折扣實際']
+    with report.stage("訓練"):
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
+        # 建立模型（forest 以 n_jobs=-1 使用所有核心）
+        model = build_estimator(args.engine, n_estimators=args.n_estimators, n_jobs=args.n_jobs)
+        model.fit(X_train, y_train)
 
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    with report.stage("評估"):
+        # 誤差值
+        metrics = evaluate(model, X_test, y_test)
+        print("MSE:", metrics["mse"])
 
-# 建立模型
-model = RandomForestRegressor(n_estimators=100, random_state=42)
-model.fit(X_train, y_train)
+    if args.results:
+        with report.stage("輸出結果"):
+            out = df[['商品品項', '剩餘保存期限_小時', '原價']].copy()
+            out['折扣預測'] = model.predict(X)
+            out['售價預測'] = out['原價'] * (1 - out['折扣預測'])
+            print(out[['商品品項', '剩餘保存期限_小時', '折扣預測', '售價預測']])
+            out.to_csv(args.results, index=False, encoding="utf-8-sig", chunksize=args.chunksize)
+            print("已存檔：", args.results)
 
-# 誤差值
-y_pred = model.predict(X_test)
-print("MSE:", mean_squared_error(y_test, y_pred))
+    with report.stage("儲存模型"):
+        joblib.dump(model, args.model_out)
+        print("模型已儲存：", args.model_out)
 
+    report.print()
+    write_report(args.model_out, "train", report, metrics, model, len(df), {"engine": args.engine})
+    return model
 
-df['折扣預測'] = model.predict(X[feature_cols])
-df['售價預測'] = df['原價'] * (1 - df['折扣預測'])
 
+def search(args):
+    """交叉驗證的超參數搜尋，候選組合 × fold 分散到 process pool 平行執行"""
+    report = StageReport(trace_memory=not args.no_trace_memory)
+    df, feature_cols = load_training_data(args, report)
+    X_train, X_test, y_train, y_test = train_test_split(
+        df[feature_cols], df['折扣實際'], test_size=0.2, random_state=42
+    )
 
-print(df[['商品品項','剩餘保存期限_小時','折扣預測','售價預測']])
+    with report.stage("超參數搜尋"):
+        # 平行化放在搜尋層（每個候選 × fold 一個工作），單一森林不再開多執行緒
+        searcher = RandomizedSearchCV(
+            RandomForestRegressor(random_state=42, n_jobs=1),
+            PARAM_SPACE,
+            n_iter=args.n_iter,
+            cv=args.cv,
+            scoring="neg_mean_squared_error",
+            n_jobs=args.n_jobs,
+            random_state=42,
+            refit=True,
+        )
+        searcher.fit(X_train, y_train)
+    model = searcher.best_estimator_
+    print("最佳參數：", searcher.best_params_)
+    print("CV MSE：", -searcher.best_score_)
 
+    with report.stage("評估"):
+        metrics = evaluate(model, X_test, y_test)
+        print("MSE:", metrics["mse"])
+
+    with report.stage("儲存模型"):
+        joblib.dump(model, args.model_out)
+        print("模型已儲存：", args.model_out)
+
+    report.print()
+    cv = searcher.cv_results_
+    candidates = sorted(
+        (
+            {"params": cv["params"][i], "cv_mse": float(-cv["mean_test_score"][i]),
+             "fit_seconds": float(cv["mean_fit_time"][i])}
+            for i in range(len(cv["params"]))
+        ),
+        key=lambda c: c["cv_mse"],
+    )
+    write_report(args.model_out, "search", report, metrics, model, len(df), {
+        "cv_folds": args.cv,
+        "best_params": searcher.best_params_,
+        "best_cv_mse": float(-searcher.best_score_),
+        "candidates": candidates,
+    })
+    return model
+
+
+def extend(args):
+    """
+    以 warm_start 在既有森林上追加樹：新樹只用新資料訓練，舊樹保留
+    新資料的 one-hot 欄位會對齊到既有模型的 feature_names_in_
+    """
+    report = StageReport(trace_memory=not args.no_trace_memory)
+    with report.stage("載入模型"):
+        model = joblib.load(args.base_model)
+    df, _ = load_training_data(args, report)
+    feature_cols = list(model.feature_names_in_)
+    unknown = [c for c in df.columns if '_' in c and c not in feature_cols and c != '剩餘保存期限_小時']
+    if unknown:
+        print("⚠️ 既有模型沒有這些類別欄位，將忽略：", unknown)
+    X = df.reindex(columns=feature_cols, fill_value=0)
+    y = df['折扣實際']
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    before = evaluate(model, X_test, y_test)
+    with report.stage("追加訓練"):
+        model.set_params(warm_start=True, n_estimators=model.n_estimators + args.add_trees, n_jobs=args.n_jobs)
+        model.fit(X_train, y_train)
+        model.set_params(warm_start=False)
+
+    with report.stage("評估"):
+        metrics = evaluate(model, X_test, y_test)
+        print(f"MSE（新資料）：追加前 {before['mse']:.6f} → 追加後 {metrics['mse']:.6f}")
+
+    with report.stage("儲存模型"):
+        joblib.dump(model, args.model_out)
+        print(f"模型已儲存：{args.model_out}（共 {len(model.estimators_)} 棵樹）")
+
+    report.print()
+    write_report(args.model_out, "extend", report, metrics, model, len(df), {
+        "base_model": args.base_model,
+        "added_trees": args.add_trees,
+        "metrics_before": before,
+    })
+    return model
+
+
+def export(args):
+    """
+    把 joblib 森林轉成精簡陣列格式（<模型>.forest/），供 model_server 以 mmap 載入
+    並用訓練資料比對兩者的預測，確認誤差在容許範圍內
+    """
+    from compact_forest import export_forest
+
+    report = StageReport(trace_memory=not args.no_trace_memory)
+    out = args.out or os.path.splitext(args.model)[0] + ".forest"
+    with report.stage("載入模型"):
+        model = joblib.load(args.model)
+    with report.stage("匯出"):
+        compact = export_forest(model, out)
+    print(f"已匯出 {compact.n_estimators} 棵樹、{compact.n_nodes} 個節點：{out}")
+
+    if args.data and os.path.exists(args.data):
+        with report.stage("比對預測"):
+            df, _ = build_features(load_dataset(args.data, args.chunksize))
+            X = df.reindex(columns=list(model.feature_names_in_), fill_value=0)
+            diff = np.abs(model.predict(X) - compact.predict(X)).max()
+        print(f"與 sklearn 預測最大差異：{diff:.3g}（{len(X)} 筆）")
+        if diff > args.tolerance:
+            raise SystemExit(f"差異超過容許值 {args.tolerance}")
+    report.print()
+
+
+def convert(args):
+    """CSV 轉成 Parquet（逐 chunk 寫入，不需一次載入整份資料）"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    report = StageReport(trace_memory=not args.no_trace_memory)
+    out = args.out or os.path.splitext(args.data)[0] + ".parquet"
+    rows = 0
+    with report.stage("轉檔"):
+        writer = None
+        try:
+            for chunk in iter_raw_chunks(args.data, args.chunksize):
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(out, table.schema, compression="zstd")
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+    print(f"已轉檔 {rows} 筆：{out}")
+    report.print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="動態定價模型訓練")
+    parser.add_argument("--data", default=DATA_PATH, help="田野調查資料（.csv 或 .parquet）")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--no-trace-memory", action="store_true", help="不追蹤記憶體峰值（較快）")
+
+    parser.add_argument("--n-jobs", type=int, default=-1, help="平行數，-1 = 所有核心")
+    sub = parser.add_subparsers(dest="command")
+
+    p_train = sub.add_parser("train", help="訓練模型（預設）")
+    p_train.add_argument("--model-out", default=MODEL_PATH)
+    p_train.add_argument("--results", default=RESULT_PATH, help="預測結果輸出，空字串表示不輸出")
+    p_train.add_argument("--n-estimators", type=int, default=100)
+    p_train.add_argument("--engine", choices=ENGINES, default="forest", help="模型種類（見 pricing_engines）")
+
+    p_search = sub.add_parser("search", help="交叉驗證超參數搜尋")
+    p_search.add_argument("--model-out", default=MODEL_PATH)
+    p_search.add_argument("--n-iter", type=int, default=20, help="隨機抽樣的參數組合數")
+    p_search.add_argument("--cv", type=int, default=5)
+
+    p_extend = sub.add_parser("extend", help="以新資料在既有森林上追加樹（warm_start）")
+    p_extend.add_argument("--base-model", default=MODEL_PATH)
+    p_extend.add_argument("--model-out", default=MODEL_PATH)
+    p_extend.add_argument("--add-trees", type=int, default=20)
+
+    p_export = sub.add_parser("export", help="匯出精簡陣列格式（.forest）")
+    p_export.add_argument("--model", default=MODEL_PATH)
+    p_export.add_argument("--out", default=None, help="預設為 <模型檔名>.forest")
+    p_export.add_argument("--tolerance", type=float, default=1e-9)
+
+    p_convert = sub.add_parser("convert", help="CSV 轉 Parquet")
+    p_convert.add_argument("--out", default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == "convert":
+        convert(args)
+    elif args.command == "export":
+        export(args)
+    elif args.command == "search":
+        search(args)
+    elif args.command == "extend":
+        extend(args)
+    else:
+        if args.command is None:
+            args.model_out, args.results, args.n_estimators, args.engine = MODEL_PATH, RESULT_PATH, 100, "forest"
+        train(args)
 
-output_path = "dynamic_pricing_result.csv"
-df.to_csv(output_path, index=False, encoding="utf-8-sig")
-print("已存檔：dynamic_pricing_result.csv")
 
-# 儲存模型
-model_path = "random_forest_model.pkl"
-joblib.dump(model, model_path)
-print("模型已儲存：", model_path)
+if __name__ == "__main__":
+    main()
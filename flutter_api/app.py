@@ -1,213 +1,281 @@
-from flask import Flask, request, jsonify
-from flask_mysqldb import MySQL
+from flask import Flask, request, jsonify, Response, send_from_directory, stream_with_context
 from flask_cors import CORS
-from db_config import db_config
 from flask_jwt_extended import (
     JWTManager, create_access_token, jwt_required, get_jwt_identity
 )
-from paddleocr import PaddleOCR
-import re, traceback
+import traceback
 from datetime import datetime, date
-from ml_model import predict_price, prepare_features, feature_cols
-import threading, time
+from ml_model import registry, engine_stats, contexts, start_price_table
+from model_server import ModelUnavailable
+from ocr_service import detect_product_type, normalize_date
+from ocr_jobs import OcrJobQueue, QueueFull
+from ocr_cache import OcrResultCache, content_hash, store_upload, move_cache_file
+from repricing import fetch_products_to_price, fetch_priced_products, page_upper_bound
+from context_provider import CONTEXT_SOURCE, TableSource
+from sharded_repricing import ShardedRepricer
+from status_sweeper import StatusSweeper
+from db import Database, PoolTimeout
+from recommend_cache import RecommendCache
+from recommend_index import RecommendIndex
+import db as queries
+from schema import migrate, name_search_clause
+import diagnostics
+import time
+import json
+import base64
+import hashlib
 import os
-import traceback
 import pandas as pd
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 
-# MySQL 設定
-app.config['MYSQL_HOST'] = db_config['host']
-app.config['MYSQL_USER'] = db_config['user']
-app.config['MYSQL_PASSWORD'] = db_config['password']
-app.config['MYSQL_DB'] = db_config['database']
-
 # JWT 設定
 app.config['JWT_SECRET_KEY'] = 'TanJiDynamicPricing2025finalproject'
 jwt = JWTManager(app)
 
 
-mysql = MySQL(app)
-ocr = PaddleOCR(lang='ch', use_textline_orientation=False, ocr_version='PP-OCRv4')
-
+# MySQL 連線池（見 db.py），設定取自 db_config
+db = Database()
+# 賣場情境改由 market_context 表提供
+if CONTEXT_SOURCE == "table":
+    contexts.set_source(TableSource(db))
+# OCR 由 worker process pool 執行（見 ocr_jobs.py）
+ocr_jobs = OcrJobQueue()
+# 推薦：記憶體內索引（重新定價時更新），不可用時走 SQL + 結果快取；以下的寫入事件都會更新 / 失效
+recommend_index = RecommendIndex(db)
+recommend_cache = RecommendCache()
 
-from opencc import OpenCC
-cc = OpenCC('s2t')
-# 關鍵字分類
-MEAT_KEYWORDS = ["豬", "牛", "雞", "羊", "腿", "排", "骨", "燒烤片", "火烤片", "肉片", "火鍋片", "絞肉"]
-SEAFOOD_KEYWORDS = ["魚", "蝦", "魷", "鮭", "花枝", "章魚", "鯛", "干貝", "蛤", "牡蠣", "螺", "白管", "海帶"]
-VEG_KEYWORDS = ["菜", "瓜", "果", "蔬", "蘋果", "香蕉", "橘子", "葡萄", "山藥", "豆芽", "筍", "菇", "椒", "番茄", "洋蔥", "芭樂", "蔥", "櫻桃", "秋葵", "梨", "柑", "柚"]
-BAKERY_KEYWORDS = ["吐司", "麵包", "蛋糕", "可頌", "甜甜圈", "佛卡夏", "貝果", "鬆餅", "德國結", "蛋塔", "法式", "餅"]
-BEAN_KEYWORDS = ["豆腐", "豆干", "豆皮", "百頁", "豆包", "素"]
-READY_TO_EAT_KEYWORDS = ["三明治", "便當", "沙拉", "餃子皮", "火鍋料", "水果盤"]
 
+def on_repriced(market, priced):
+    recommend_index.upsert_frame(priced)
+    recommend_cache.invalidate(market)
 
 
-def extract_prices(texts):
-    normal_candidates = []
+def on_status_change():
+    recommend_index.invalidate()
+    recommend_cache.invalidate()
 
-    for line in texts:
-        
-        matches = re.findall(r"(\d+(?:\.\d+)?)\s*元", line)
 
-        for m in matches:
-            if "元/" in line:
-                continue
+# 重新定價依賣場分片，由另一組 worker process 執行（見 sharded_repricing.py）
+repricer = ShardedRepricer(on_write=on_repriced)
+# 過期狀態定時掃描
+status_sweeper = StatusSweeper(db, on_change=on_status_change)
 
-            normal_candidates.append(int(float(m)))
 
-    price = max(normal_candidates) if normal_candidates else None
-    pro_price = min(normal_candidates) if normal_candidates else None
+# ---------------------- OCR API ----------------------
+UPLOAD_DIR = os.path.join(os.getcwd(), "uploads")
+if not os.path.exists(UPLOAD_DIR):
+    os.makedirs(UPLOAD_DIR)
 
-    return price, pro_price
+# 以圖片 hash 為 key 的 OCR 結果快取
+# 放在 cache/，不能放在 /uploads 會直接提供下載的 UPLOAD_DIR 裡（舊版放在那裡的搬過來）
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+os.makedirs(CACHE_DIR, exist_ok=True)
+OCR_CACHE_PATH = os.path.join(CACHE_DIR, "ocr_cache.sqlite3")
+move_cache_file(os.path.join(UPLOAD_DIR, "ocr_cache.sqlite3"), OCR_CACHE_PATH)
+ocr_cache = OcrResultCache(OCR_CACHE_PATH)
 
+OCR_SYNC_TIMEOUT = int(os.environ.get("OCR_SYNC_TIMEOUT", 120))
 
 
-def extract_product_info(texts):
-    info = {"ProName": None, "ExpireDate": None, "Price": None, "ProPrice": None}
-    max_length = 0 
-    full_text = "\n".join(texts)
-    # 商品名稱
-    for line in texts:
-        if any(k in line for k in MEAT_KEYWORDS + SEAFOOD_KEYWORDS + VEG_KEYWORDS +
-                                BAKERY_KEYWORDS + BEAN_KEYWORDS + READY_TO_EAT_KEYWORDS):
-            if len(line) > max_length:
-                info["ProName"] = line
-                max_length = len(line)
+def build_product_record(info, market, db_path):
+    """OCR 抽取結果 -> 要寫入 product 的欄位"""
+    # 格式化日期
+    expire_date, status = normalize_date(info.get("ExpireDate"))
 
-    # 有效日期
-    date_match = re.search(r"(\d{4}\.\d{1,2}\.\d{1,2})", full_text)
-    if date_match:
-        info["ExpireDate"] = date_match.group(1)
+    # 判斷類別
+    product_type = detect_product_type(info["ProName"])
 
-    # 原價 / 即期價
-    price, pro_price = extract_prices(texts)
-    info["Price"] = price
-    info["ProPrice"] = pro_price
+    return {
+        **info,
+        "ExpireDate": expire_date,
+        "Status": status,
+        "ProductType": product_type,
+        "Market": market,
+        "ImagePath": db_path
+    }
 
-    return info
 
+def save_ocr_result(texts, info, market, user_id, db_path):
+    """OCR 結果寫入 product（與 history），回傳給前端的商品資訊"""
+    print("===== OCR 辨識結果 =====")
+    print(texts)
+    print("===== 抽取後的商品資訊 =====")
+    print(info)
 
-def detect_product_type(name: str) -> str:
-    if not name:
-        return "未知"
-    if any(k in name for k in MEAT_KEYWORDS):
-        return "肉類"
-    if any(k in name for k in SEAFOOD_KEYWORDS):
-        return "魚類"
-    if any(k in name for k in VEG_KEYWORDS):
-        return "蔬果類"
-    if any(k in name for k in BAKERY_KEYWORDS):
-        return "麵包甜點類"
-    if any(k in name for k in BEAN_KEYWORDS):
-        return "豆製品類"
-    if any(k in name for k in READY_TO_EAT_KEYWORDS):
-        return "熟食/其他"
-    return "其他"
+    record = build_product_record(info, market, db_path)
 
+    with db.transaction() as cur:
+        product_id = queries.insert_product(cur, record)
+        print("插入 product 成功, ProductID:", product_id)
 
-def normalize_date(expire_str):
-    """轉換日期字串為 YYYY-MM-DD, 並判斷狀態"""
-    if not expire_str:
-        return None, "未知"
-    try:
-        clean_str = expire_str.replace(".", "-")
-        exp = datetime.strptime(clean_str, "%Y-%m-%d").date()
-        status = "未過期" if exp >= date.today() else "已過期"
-        return exp.strftime("%Y-%m-%d"), status
-    except Exception as e:
-        print("日期解析失敗:", expire_str, e)
-        return None, "未知"
+        # 寫入 history
+        print("登入 user_id:", user_id)
+        if user_id:
+            queries.add_history(cur, user_id, product_id)
+            print("已新增 history 紀錄")
+    recommend_cache.invalidate(market)
+
+    return {**record, "ProductID": product_id}
+
+
+def save_ocr_batch(outputs, filenames, market, user_id, db_paths):
+    """
+    批次 OCR 結果以一個多列 INSERT 寫入 product 與 history
+    回傳每張圖片的結果或錯誤
+    """
+    results = []
+    records = []
+    for i, (texts, info, error) in enumerate(outputs):
+        if error:
+            results.append({"index": i, "filename": filenames[i], "error": error})
+            continue
+        record = build_product_record(info, market, db_paths[i])
+        records.append(record)
+        results.append({"index": i, "filename": filenames[i]})
+
+    if records:
+        with db.transaction() as cur:
+            for record, product_id in zip(records, queries.insert_products(cur, records)):
+                record["ProductID"] = product_id
+            if user_id:
+                queries.add_histories(cur, user_id, [r["ProductID"] for r in records])
+        recommend_cache.invalidate(market)
+        print(f"批次新增 {len(records)} 筆 product")
+
+    # 同一張圖可能重複上傳（ImagePath 相同），依順序對應
+    succeeded = iter(records)
+    for item in results:
+        if "error" not in item:
+            item.update(next(succeeded))
+
+    return {
+        "results": results,
+        "succeeded": len(records),
+        "failed": len(results) - len(records)
+    }
+
+
+def _read_upload(file):
+    """上傳檔讀進記憶體，回傳 (data, digest, db_path)；OCR 直接吃 bytes，不必等寫檔"""
+    data = file.read()
+    digest = content_hash(data)
+    # 以內容 hash 命名（見 ocr_cache.store_upload）
+    return data, digest, f"/uploads/{digest}.jpg"
+
+
+def _cache_and_save(digest, on_done):
+    """OCR 完成後先寫入快取，再交給 on_done"""
+    def handler(texts, info):
+        ocr_cache.put(digest, texts, info)
+        return on_done(texts, info)
+    return handler
+
+
+def _job_response(job, sync, timeout):
+    """/ocr 與 /ocr/batch 共用：非同步回傳 job 狀態，同步則等待結果"""
+    if not sync:
+        if job.done.is_set():
+            return jsonify(job.to_dict()), 200
+        return jsonify(job.to_dict()), 202, {"Location": f"/ocr/jobs/{job.id}"}
+
+    if not job.wait(timeout):
+        return jsonify({**job.to_dict(), "error": "OCR 逾時，請稍後以 job_id 查詢"}), 504
+    if job.error:
+        print("OCR 寫入失敗:", job.error)
+        return jsonify({"error": job.error}), 500
+    return jsonify(job.result), 200
 
-# ---------------------- OCR API ----------------------
-import os
-from flask import send_from_directory
-
-UPLOAD_DIR = os.path.join(os.getcwd(), "uploads")
-if not os.path.exists(UPLOAD_DIR):
-    os.makedirs(UPLOAD_DIR)
 
 @app.route("/ocr", methods=["POST"])
 @jwt_required(optional=True)
 def ocr_api():
+    """
+    預設為非同步：立即回傳 202 與 job_id，結果以 GET /ocr/jobs/<job_id> 查詢
+    帶 sync=1 則等待辨識完成，直接回傳商品資訊（舊行為）
+    同一張圖片辨識過就直接用快取的結果
+    """
     file = request.files.get("image")
+    if file is None:
+        return jsonify({"error": "缺少 image"}), 400
     market = request.form.get("market", "未知賣場")
     user_id = get_jwt_identity()
+    sync = request.values.get("sync", "0").lower() in ("1", "true", "yes")
 
-    filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
-    filepath = os.path.join(UPLOAD_DIR, filename)
-    file.save(filepath)
-
-    db_path = f"/uploads/{filename}"
-
-
-    # OCR 辨識
-    result = ocr.predict(filepath)
-    texts = []
-    for item in result:
-        texts.extend(item['rec_texts'])
+    data, digest, db_path = _read_upload(file)
+    save = lambda texts, info: save_ocr_result(texts, info, market, user_id, db_path)
 
-    # 轉繁體
-    texts = [cc.convert(t) for t in texts]
+    try:
+        cached = ocr_cache.get(digest)
+        if cached:
+            print("OCR 快取命中:", digest)
+            job = ocr_jobs.completed(lambda: save(*cached))
+        else:
+            job = ocr_jobs.submit(data, _cache_and_save(digest, save))
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    # OCR 已開始，原圖另外存檔供前端顯示
+    store_upload(UPLOAD_DIR, data, digest)
 
-    print("===== OCR 辨識結果 =====")
-    print(texts)
+    return _job_response(job, sync, OCR_SYNC_TIMEOUT)
 
-    info = extract_product_info(texts)
-    print("===== 抽取後的商品資訊 =====")
-    print(info)
 
-    # 格式化日期
-    expire_date, status = normalize_date(info.get("ExpireDate"))
+@app.route("/ocr/batch", methods=["POST"])
+@jwt_required(optional=True)
+def ocr_batch_api():
+    """
+    一次上傳多張圖片（欄位名稱 images），分組批次辨識後一次寫入 DB
+    回傳方式與 /ocr 相同：預設 202 + job_id，sync=1 則等待結果
+    快取命中的圖片不再送 OCR
+    """
+    files = request.files.getlist("images")
+    if not files:
+        return jsonify({"error": "缺少 images"}), 400
+    market = request.form.get("market", "未知賣場")
+    user_id = get_jwt_identity()
+    sync = request.values.get("sync", "0").lower() in ("1", "true", "yes")
+
+    filenames = [f.filename for f in files]
+    uploads = [_read_upload(f) for f in files]
+    db_paths = [d for _, _, d in uploads]
+
+    outputs = [None] * len(uploads)
+    misses = []
+    for i, (_, digest, _) in enumerate(uploads):
+        cached = ocr_cache.get(digest)
+        if cached:
+            outputs[i] = (cached[0], cached[1], None)
+        else:
+            misses.append(i)
 
-    # 判斷類別
-    product_type = detect_product_type(info["ProName"])
+    def save(miss_outputs):
+        for i, output in zip(misses, miss_outputs):
+            texts, info, error = output
+            if not error:
+                ocr_cache.put(uploads[i][1], texts, info)
+            outputs[i] = output
+        return save_ocr_batch(outputs, filenames, market, user_id, db_paths)
 
     try:
-        cur = mysql.connection.cursor()
-        sql = """
-            INSERT INTO product (ProName, ExpireDate, Price, ProPrice, Market, Status, ProductType, ImagePath)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        cur.execute(sql, (
-            info["ProName"],
-            expire_date,
-            info["Price"],
-            info["ProPrice"],
-            market,
-            status,
-            product_type,
-            db_path
-        ))
-        product_id = cur.lastrowid
-        print("插入 product 成功, ProductID:", product_id)
+        if misses:
+            job = ocr_jobs.submit_batch([uploads[i][0] for i in misses], save)
+        else:
+            job = ocr_jobs.completed(lambda: save([]))
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    for data, digest, _ in uploads:
+        store_upload(UPLOAD_DIR, data, digest)
 
-        # 寫入 history
-        print("登入 user_id:", user_id)
-        if user_id:
-            cur.execute(
-                "INSERT INTO history (userID, productID, created_at) VALUES (%s, %s, NOW())",
-                (user_id, product_id)
-            )
-            print("已新增 history 紀錄")
+    return _job_response(job, sync, OCR_SYNC_TIMEOUT * len(files))
 
-        mysql.connection.commit()
-        cur.close()
 
-        return jsonify({
-            **info,
-            "ExpireDate": expire_date,
-            "Status": status,
-            "ProductType": product_type,
-            "ProductID": product_id,
-            "Market": market,
-            "ImagePath": db_path
-        }), 200
-
-    except Exception as e:
-        print("插入失敗:", traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+@app.route("/ocr/jobs/<string:job_id>", methods=["GET"])
+def ocr_job_status(job_id):
+    job = ocr_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "找不到此 job"}), 404
+    return jsonify(job.to_dict()), 200
     
 # ---------------------- 圖片存取 API ----------------------
 
@@ -216,32 +284,189 @@ def uploaded_file(filename):
     return send_from_directory(UPLOAD_DIR, filename)
 
 # ---------------------- AI 預測價格 API ----------------------
+def parse_markets(values):
+    """?market=A&market=B 或 ?market=A,B -> ['A', 'B']"""
+    markets = []
+    for value in values:
+        markets.extend(m.strip() for m in str(value).split(",") if m.strip())
+    return list(dict.fromkeys(markets))
+
+
+def run_repricing(full=False, product_id=None, markets=None):
+    """依賣場分片重新定價並寫回 DB，回傳 (定價結果, 各分片報告)"""
+    with db.cursor() as cur:
+        df = fetch_products_to_price(cur, full=full, product_id=product_id, markets=markets)
+    diagnostics.info("%s定價：%d 筆需重新計算", '完整' if full else '增量', len(df))
+    return repricer.run(df, db=db, update_db=True)
+
+
+# /predict_price 依 ProductID 分頁，每頁各自交給 repricer 依賣場分片；
+# 一頁需要重算的筆數達到 REPRICE_INLINE_ROWS 且不只一個賣場時才會用到 process pool，
+# 所以預設頁大小要大於 REPRICE_INLINE_ROWS（?limit 較小的分頁請求一律在本 process 計算）
+PREDICT_PAGE_SIZE = int(os.environ.get("PREDICT_PAGE_SIZE", 5000))
+PREDICT_MAX_LIMIT = int(os.environ.get("PREDICT_MAX_LIMIT", 5000))
+if PREDICT_PAGE_SIZE < repricer.inline_rows:
+    diagnostics.warning("PREDICT_PAGE_SIZE=%d 小於 REPRICE_INLINE_ROWS=%d，/predict_price 的分頁不會用到 process pool",
+                        PREDICT_PAGE_SIZE, repricer.inline_rows)
+
+
+def price_records(df):
+    """DataFrame -> list of dict（NaN 轉 None）"""
+    return df.astype(object).where(pd.notna(df), None).to_dict(orient="records")
+
+
+def price_page(full, after_id, limit, markets):
+    """
+    定價一頁：ProductID > after_id 的前 limit 筆未過期商品
+    增量模式只重算這一頁裡需要重算的，再從 DB 讀回整頁結果
+    回傳 (結果 DataFrame, 這頁最後的 ProductID；沒有資料時為 None)
+    """
+    with db.cursor() as cur:
+        upper = page_upper_bound(cur, after_id, limit, markets)
+        if upper is None:
+            return None, None
+        df = fetch_products_to_price(cur, full=full, markets=markets, id_range=(after_id, upper))
+
+    priced, _ = repricer.run(df, db=db, update_db=True)
+    if not full:
+        with db.cursor() as cur:
+            priced = fetch_priced_products(cur, markets=markets, id_range=(after_id, upper))
+    return priced, upper
+
+
+def iter_price_pages(full, after_id, markets, first_page):
+    """逐頁產生 list of dict；first_page 為已經算好的第一頁"""
+    page, upper = first_page
+    while upper is not None:
+        yield price_records(page)
+        page, upper = price_page(full, upper, PREDICT_PAGE_SIZE, markets)
+
+
 @app.route("/predict_price", methods=["GET"])
 def predict_price_api():
+    """
+    預設為增量模式：只重算新增 / 被修改 / 保存期限跨 bucket 的商品，其餘直接回傳 DB 中的結果
+    ?full=1 強制完整重算所有未過期商品
+    ?productId=N 只處理該商品：需要重算（或 full=1）時只重算這一筆，不會連帶重算其他商品
+    ?market=A,B 只處理這些賣場
+    ?after_id=N&limit=M keyset 分頁（依 ProductID），下一頁的 after_id 放在 X-Next-After-Id header；
+        沒有這個 header 才是最後一頁（回應筆數可能少於 limit，不能用筆數判斷）
+    ?stream=1（或 Accept: application/x-ndjson）以 NDJSON 逐筆輸出，每算完一頁就送出
+    沒有分頁參數時仍回傳完整的 JSON 陣列，但內容逐頁產生、逐頁送出，記憶體只保留一頁
+    依賣場分片是在每一頁之內（頁依 ProductID 切，一頁可能包含多個賣場）：
+    一頁需要重算的筆數低於 REPRICE_INLINE_ROWS 或只有一個賣場時在本 process 計算；
+    整個商品目錄的重算交給 POST /reprice（一次對所有需要重算的商品分片）或分頁
+    """
+    try:
+        full = request.args.get("full", "0").lower() in ("1", "true", "yes")
+        product_id = request.args.get("productId", type=int)
+        markets = parse_markets(request.args.getlist("market"))
+        after_id = request.args.get("after_id", 0, type=int)
+        limit = request.args.get("limit", type=int)
+        stream = request.args.get("stream", "0").lower() in ("1", "true", "yes") \
+            or "application/x-ndjson" in request.headers.get("Accept", "")
+
+        if product_id is not None:
+            df, _ = run_repricing(full=full, product_id=product_id, markets=markets)
+            if not full:
+                with db.cursor() as cur:
+                    df = fetch_priced_products(cur, product_id=product_id, markets=markets)
+            return jsonify(price_records(df)), 200
+
+        if limit is not None:
+            limit = max(1, min(limit, PREDICT_MAX_LIMIT))
+            page, upper = price_page(full, after_id, limit, markets)
+            records = price_records(page) if page is not None else []
+            response = jsonify(records)
+            # 這頁可能因為分片失敗、或重新讀取前商品已過期而少於 limit 筆，仍要給下一頁的 cursor；
+            # 沒有下一頁由 page_upper_bound 查不到資料（upper 為 None）判斷
+            if upper is not None:
+                response.headers["X-Next-After-Id"] = str(upper)
+            return response, 200
+
+        # 第一頁先算好，出錯時還能回 500
+        first_page = price_page(full, after_id, PREDICT_PAGE_SIZE, markets)
+        pages = iter_price_pages(full, after_id, markets, first_page)
+
+        if stream:
+            def ndjson():
+                for records in pages:
+                    yield "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records)
+            return Response(stream_with_context(ndjson()), mimetype="application/x-ndjson")
+
+        def json_array():
+            yield "["
+            first = True
+            for records in pages:
+                for r in records:
+                    yield ("" if first else ",") + json.dumps(r, ensure_ascii=False, default=str)
+                    first = False
+            yield "]"
+        return Response(stream_with_context(json_array()), mimetype="application/json")
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/reprice", methods=["POST"])
+def reprice_api():
+    """
+    觸發重新定價（不回傳商品清單），回傳各賣場分片的筆數與耗時
+    body: {"markets": ["A", "B"] 或 "A,B"（省略 = 全部）, "full": false}
+    """
+    data = request.get_json(silent=True) or {}
+    markets = data.get("markets") or []
+    if isinstance(markets, str):
+        markets = [markets]
     try:
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT ProductID, ProName, ProPrice, Price, ExpireDate, Status, ProductType FROM product")
-        rows = cur.fetchall()
-        df = pd.DataFrame(rows, columns=['ProductID','ProName','ProPrice','price','ExpireDate','Status','商品大類'])        
-        before = len(df)
-        df = df[df['Status'] != '已過期']
-        after = len(df)
-        print(f"已過濾掉 {before - after} 筆已過期商品，剩下 {after} 筆需重新計算")
-
-        df = predict_price(df, update_db=True, mysql=mysql)
-        
-        cur.close()
-        return jsonify(df.to_dict(orient="records")), 200
+        start = time.perf_counter()
+        _, reports = run_repricing(full=bool(data.get("full")), markets=parse_markets(markets))
+        return jsonify({
+            "elapsed_s": round(time.perf_counter() - start, 4),
+            "shards": [r.to_dict() for r in reports],
+        }), 200
     except Exception as e:
-        import traceback
         print(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+# ---------------------- 效能指標 ----------------------
+@app.route("/metrics", methods=["GET"])
+def metrics_api():
+    snapshot = diagnostics.snapshot()
+    snapshot["status_sweep"] = status_sweeper.last
+    snapshot["db_pool"] = db.stats()
+    snapshot["recommend_cache"] = recommend_cache.stats()
+    snapshot["recommend_index"] = recommend_index.stats()
+    return jsonify(snapshot), 200
+
+# ---------------------- 模型版本 ----------------------
+@app.route("/model", methods=["GET"])
+def model_status():
+    return jsonify(engine_stats()), 200
+
+
+@app.route("/model/reload", methods=["POST"])
+def model_reload():
+    """重新載入模型：可帶 version 指定版本，否則依 MODEL_DIR/CURRENT"""
+    data = request.get_json(silent=True) or {}
+    try:
+        handle = registry.reload(data.get("version"))
+    except ModelUnavailable as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({"message": "模型已上線", "version": handle.version}), 200
+
+# ---------------------- 資料庫錯誤 ----------------------
+def db_error(e, label):
+    """route 共用的錯誤回應：連線池借不到連線回 503，其餘 500"""
+    print(f"{label}:", traceback.format_exc())
+    status = 503 if isinstance(e, PoolTimeout) else 500
+    return jsonify({"error": str(e)}), status
+
 # ---------------------- 更新商品 API ----------------------
 @app.route("/product/<int:product_id>", methods=["PUT"])
 def update_product(product_id):
     data = request.get_json()
-    fields = {k: v for k, v in data.items() if k in ["ProName", "ExpireDate", "Price", "ProPrice", "Market", "Status", "ProductType", "ImagePath"]}
+    fields = {k: v for k, v in data.items() if k in queries.PRODUCT_UPDATE_FIELDS}
 
     # 更新日期就重新計算 Status
     if "ExpireDate" in fields:
@@ -256,39 +481,33 @@ def update_product(product_id):
     if not fields:
         return jsonify({"error": "沒有可更新的欄位"}), 400
 
-    set_clause = ", ".join([f"{k}=%s" for k in fields.keys()])
-    values = list(fields.values()) + [product_id]
-
     try:
-        cur = mysql.connection.cursor()
-        sql = f"UPDATE product SET {set_clause} WHERE productID=%s"
-        cur.execute(sql, values)
-        mysql.connection.commit()
-        cur.close()
+        # 同時標記為需要重新定價
+        with db.transaction() as cur:
+            queries.update_product(cur, product_id, fields)
+        # 賣場可能被改掉，整個清空
+        recommend_cache.invalidate()
+        recommend_index.refresh([product_id])
         print(f"已更新 Product {product_id}, 更新欄位: {fields}")
         return jsonify({"message": "更新成功", "fields": fields}), 200
     except Exception as e:
-        print("更新失敗:", traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+        return db_error(e, "更新失敗")
 
 # ---------------------- 刪除商品 API ----------------------
 @app.route('/product/<int:product_id>', methods=['DELETE'])
 def delete_product(product_id):
     try:
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT ProductID FROM product WHERE ProductID=%s", (product_id,))
-        row = cur.fetchone()
-        if not row:
+        # 直接刪除，以影響筆數判斷商品是否存在
+        with db.transaction() as cur:
+            deleted = queries.delete_product(cur, product_id)
+        if deleted:
+            recommend_cache.invalidate()
+            recommend_index.remove(product_id)
+        if not deleted:
             return jsonify({"error": "商品不存在"}), 404
-
-        cur.execute("DELETE FROM product WHERE ProductID=%s", (product_id,))
-        mysql.connection.commit()
-        cur.close()
-
         return jsonify({"message": f"已刪除 ProductID={product_id}"}), 200
     except Exception as e:
-        print("刪除商品失敗:", traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+        return db_error(e, "刪除商品失敗")
     
 # ---------------------- 註冊 ----------------------
 @app.route('/register', methods=['POST'])
@@ -300,17 +519,12 @@ def register():
     password = data.get('password')
 
     try:
-        cur = mysql.connection.cursor()
-        cur.execute(
-            "INSERT INTO users (name, phone, email, password) VALUES (%s, %s, %s, %s)",
-            (name, phone, email, password)
-        )
-        mysql.connection.commit()
-        cur.close()
+        with db.transaction() as cur:
+            queries.create_user(cur, name, phone, email, password)
         return jsonify({'message': '註冊成功'}), 200
     except Exception as e:
         print(traceback.format_exc())
-        return jsonify({'message': '註冊失敗', 'error': str(e)}), 500
+        return jsonify({'message': '註冊失敗', 'error': str(e)}), 503 if isinstance(e, PoolTimeout) else 500
 
 # ---------------------- 登入 ----------------------
 @app.route('/login', methods=['POST'])
@@ -320,24 +534,16 @@ def login():
     password = data['password']
 
     try:
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT id, name, phone, email FROM users WHERE email=%s AND password=%s", (email, password))
-        user = cur.fetchone()
-        cur.close()
-
-        if user:
-            user_data = {
-                'id': user[0],
-                'name': user[1],
-                'phone': user[2],
-                'email': user[3]
-            }
+        with db.cursor() as cur:
+            user_data = queries.find_user_by_login(cur, email, password)
+
+        if user_data:
             token = create_access_token(identity=str(user_data['id']))
             return jsonify({'message': '登入成功', 'user': user_data, 'token': token}), 200
         else:
             return jsonify({'message': '帳號或密碼錯誤'}), 401
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return db_error(e, "登入失敗")
 
 # ---------------------- 取得會員資料 ----------------------
 @app.route('/user/<int:user_id>', methods=['GET'])
@@ -348,23 +554,15 @@ def get_user(user_id):
         return jsonify({'message': '沒有權限查看此資料'}), 403
 
     try:
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT id, name, phone, email FROM users WHERE id=%s", (user_id,))
-        user = cur.fetchone()
-        cur.close()
-
-        if user:
-            user_data = {
-                'id': user[0],
-                'name': user[1],
-                'phone': user[2],
-                'email': user[3],
-            }
+        with db.cursor() as cur:
+            user_data = queries.get_user(cur, user_id)
+
+        if user_data:
             return jsonify(user_data), 200
         else:
             return jsonify({'message': '找不到該會員'}), 404
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return db_error(e, "取得會員資料失敗")
 
 # ---------------------- 更新會員資料 ----------------------
 @app.route('/user/<int:user_id>', methods=['PUT'])
@@ -375,40 +573,56 @@ def update_user(user_id):
         return jsonify({'message': '沒有權限更新此資料'}), 403
 
     data = request.get_json()
-    fields = {k: v for k, v in data.items() if k in ['name', 'email', 'phone', 'password']}
+    fields = {k: v for k, v in data.items() if k in queries.USER_UPDATE_FIELDS}
 
     if not fields:
         return jsonify({'message': '沒有可更新的欄位'}), 400
 
-    set_clause = ", ".join([f"{key}=%s" for key in fields.keys()])
-    values = list(fields.values())
-    values.append(user_id)
-
     try:
-        cur = mysql.connection.cursor()
-        sql = f"UPDATE users SET {set_clause} WHERE id=%s"
-        cur.execute(sql, values)
-        mysql.connection.commit()
-
-        # 抓更新後的資料
-        cur.execute("SELECT id, name, phone, email FROM users WHERE id=%s", (user_id,))
-        updated_user = cur.fetchone()
-        cur.close()
-
-        user_data = {
-            'id': updated_user[0],
-            'name': updated_user[1],
-            'phone': updated_user[2],
-            'email': updated_user[3],
-        }
+        with db.transaction() as cur:
+            queries.update_user(cur, user_id, fields)
+            # 抓更新後的資料
+            user_data = queries.get_user(cur, user_id)
 
         return jsonify({'message': '更新成功', 'user': user_data}), 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return db_error(e, "更新會員資料失敗")
 
 # ---------------------- 抓歷史資料 ----------------------
+HISTORY_MAX_LIMIT = int(os.environ.get("HISTORY_MAX_LIMIT", 500))
+
+
+def encode_history_cursor(key):
+    """(created_at, history id) -> 不透明的分頁 cursor 字串"""
+    created_at, history_id = key
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{history_id}".encode()).decode().rstrip("=")
+
+
+def decode_history_cursor(value):
+    raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+    created_at, history_id = raw.split("|")
+    return datetime.fromisoformat(created_at), int(history_id)
+
+
+def history_etag(user_id, params, version):
+    """
+    這頁的 (history id, 商品 Rev) + 查詢參數 -> ETag（version 見 db.user_history）
+    其他使用者的商品、或這頁商品以外的寫入都不會讓 ETag 失效
+    """
+    state = [user_id, version, sorted(params.items())]
+    return hashlib.sha1(repr(state).encode()).hexdigest()
+
+
 @app.route('/get_products/<string:user_id>', methods=['GET'])
 def get_products(user_id):
+    """
+    ?search= 商品名稱、?date=YYYY-MM-DD 只取當天
+    ?limit=N 分頁（依 created_at、history id 由新到舊），下一頁以回應的 next_cursor 帶 ?cursor=
+    ?fields=ProductID,ProName,... 只回傳這些欄位
+    回應帶 ETag；If-None-Match 相符（這頁的紀錄與商品都沒變）時回 304，不回傳內容
+    ETag 由這頁查詢本身的列算出，304 只需要這一個分頁查詢
+    沒有 limit 時回傳全部（舊行為）
+    """
     try:
         search = request.args.get("search", None)   
         date_str = request.args.get("date", None)   
@@ -417,52 +631,57 @@ def get_products(user_id):
         if user_id == "0" or user_id.lower() == "guest":
             return jsonify({'products': []}), 200
 
-        query = """
-            SELECT p.productid, p.producttype, p.proname, p.proprice,   
-                   h.created_at, p.expiredate, p.status, p.market, p.ImagePath, h.id, p.AiPrice as history_id
-            FROM history h
-            JOIN product p ON h.productid = p.productid
-            WHERE h.userid = %s
-        """
-        params = [user_id]
-
-        
-        if search:
-            query += " AND p.proname LIKE %s"
-            params.append(f"%{search}%")
+        # 全文索引（ngram），關鍵字太短時退回 LIKE
+        name_clause = name_search_clause(search) if search and search.strip() else None
 
+        day = None
         if date_str:
-            query += " AND DATE(h.created_at) = %s"
-            params.append(date_str)
-
-        query += " ORDER BY h.created_at DESC"
-
-        cur = mysql.connection.cursor()
-        cur.execute(query, tuple(params))
-        products = cur.fetchall()
-        cur.close()
-
-        product_list = []
-        for p in products:
-            product_list.append({
-                'ProductID': p[0],
-                'ProductType': p[1],
-                'ProName': p[2],
-                'ProPrice': p[3],
-                'ScanDate': p[4].strftime('%Y-%m-%d') if p[4] else None,
-                'ExpireDate': p[5].strftime('%Y-%m-%d') if p[5] else None,
-                'Status': p[6],
-                'Market': p[7],
-                'ImagePath': p[8],
-                'HistoryID': p[9],
-                'AiPrice': p[10],   
-            })
-
-        return jsonify({'products': product_list}), 200
+            try:
+                day = datetime.strptime(date_str, "%Y-%m-%d")
+            except ValueError:
+                return jsonify({'error': '日期格式應為 YYYY-MM-DD'}), 400
+
+        limit = request.args.get("limit", type=int)
+        if limit is not None:
+            limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+
+        after = None
+        if request.args.get("cursor"):
+            try:
+                after = decode_history_cursor(request.args["cursor"])
+            except (ValueError, UnicodeDecodeError):
+                return jsonify({'error': 'cursor 格式錯誤'}), 400
+
+        fields = None
+        if request.args.get("fields"):
+            fields = list(dict.fromkeys(f.strip() for f in request.args["fields"].split(",") if f.strip()))
+            unknown = [f for f in fields if f not in queries.HISTORY_FIELDS]
+            if unknown:
+                return jsonify({'error': f'未知的欄位: {", ".join(unknown)}'}), 400
+
+        with db.cursor() as cur:
+            product_list, last, version = queries.user_history(
+                cur, user_id, fields=fields, name_clause=name_clause, day=day, after=after, limit=limit
+            )
+
+        etag = history_etag(user_id, request.args.to_dict(), version)
+        if etag in request.if_none_match:
+            diagnostics.incr('get_products.not_modified')
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        body = {'products': product_list}
+        if limit is not None:
+            body['next_cursor'] = encode_history_cursor(last) if last and len(product_list) == limit else None
+        response = jsonify(body)
+        response.set_etag(etag)
+        # 允許快取但每次都要帶 If-None-Match 回來確認
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response, 200
 
     except Exception as e:
-        print(traceback.format_exc())
-        return jsonify({'error': str(e)}), 500
+        return db_error(e, "讀取歷史紀錄失敗")
 
     
 # ---------------------- 刪除歷史紀錄 ----------------------
@@ -470,21 +689,26 @@ def get_products(user_id):
 @jwt_required(optional=True)
 def delete_history(history_id):
     try:
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT id FROM history WHERE id=%s", (history_id,))
-        row = cur.fetchone()
-        if not row:
+        with db.transaction() as cur:
+            deleted = queries.delete_history(cur, history_id)
+        if not deleted:
             return jsonify({"error": f"History ID {history_id} 不存在"}), 404
-
-        cur.execute("DELETE FROM history WHERE id=%s", (history_id,))
-        mysql.connection.commit()
-        cur.close()
         print(f"已刪除 history_id={history_id}")
         return jsonify({"message": f"刪除成功 (ID={history_id})"}), 200
 
     except Exception as e:
-        print("刪除失敗:", traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+        return db_error(e, "刪除失敗")
+
+
+def bind_history(user_id, product_id):
+    """商品綁定到使用者的歷史紀錄，回傳 (HistoryID, 是否新建立)"""
+    with db.transaction() as cur:
+        history_id = queries.find_history(cur, user_id, product_id)
+        if history_id is not None:
+            return history_id, False
+        history_id = queries.add_history(cur, user_id, product_id)
+    print(f"已將 ProductID={product_id} 綁定到 UserID={user_id}, HistoryID={history_id}")
+    return history_id, True
 
 # ---------------------- 儲存訪客歷史紀錄 ----------------------
 @app.route('/save_guest_history', methods=['POST'])
@@ -498,117 +722,68 @@ def save_guest_history():
         return jsonify({"error": "缺少 productID"}), 400
 
     try:
-        cur = mysql.connection.cursor()
-        
-        cur.execute(
-            "SELECT id FROM history WHERE userID=%s AND productID=%s",
-            (user_id, product_id)
-        )
-        if cur.fetchone():
-            cur.close()
+        history_id, created = bind_history(user_id, product_id)
+        if not created:
             return jsonify({"message": "紀錄已存在"}), 200
-
-        cur.execute(
-            "INSERT INTO history (userID, productID, created_at) VALUES (%s, %s, NOW())",
-            (user_id, product_id)
-        )
-        history_id = cur.lastrowid
-        mysql.connection.commit()
-        cur.close()
-
-        print(f"已將 ProductID={product_id} 綁定到 UserID={user_id}, HistoryID={history_id}")
         return jsonify({
             "message": "歷史紀錄儲存成功",
             "HistoryID": history_id
         }), 200
 
     except Exception as e:
-        print("儲存訪客歷史紀錄失敗:", traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+        return db_error(e, "儲存訪客歷史紀錄失敗")
 
 # ---------------------- 推薦商品 ----------------------
 
 @app.route('/recommend_products/<int:product_id>', methods=['GET'])
 def recommend_products(product_id):
-    cur = mysql.connection.cursor()
-    cur.execute(
-        "SELECT Market, ProductType, ExpireDate, Reason FROM product WHERE ProductID=%s",
-        (product_id,)
-    )
-    base = cur.fetchone()
-    if not base:
-        cur.close()
-        return jsonify({"error": "找不到商品"}), 404
-
-    market, ptype, exp, reason = base
-
-    if reason == "合理":
-        query = """
-            SELECT *
-            FROM product
-            WHERE Market=%s 
-            AND ExpireDate <= %s
-            AND Reason='合理'
-            AND Status='未過期'
-            AND ProductType != %s
-            ORDER BY ExpireDate ASC, ProPrice ASC
-            LIMIT 6
-        """
-        cur.execute(query, (market, exp, ptype))
-    else:
-        query = """
-            SELECT *
-            FROM product
-            WHERE Market=%s 
-            AND ExpireDate <= %s
-            AND ProductType=%s 
-            AND Reason='合理' 
-            AND Status='未過期'
-            ORDER BY ExpireDate DESC, ProPrice ASC
-            LIMIT 6
-        """
-        cur.execute(query, (market, exp, ptype))
-
-    rows = cur.fetchall()
-    column_names = [desc[0] for desc in cur.description]
-    cur.close()
-
-    products = []
-    for row in rows:
-        product = dict(zip(column_names, row))
-        if isinstance(product.get('ExpireDate'), (datetime, date)):
-            product['ExpireDate'] = product['ExpireDate'].strftime("%Y-%m-%d")
-        products.append(product)
+    """
+    先查記憶體內的推薦索引（見 recommend_index.py）；
+    索引不可用或商品不在索引內（例如已過期）時走 SQL，結果以 (Market, ProductType, ExpireDate, Reason) 快取
+    """
+    generation = recommend_cache.generation
+    try:
+        base = recommend_index.brief(product_id) or recommend_cache.get(("base", product_id))
+        if base is None:
+            with db.cursor() as cur:
+                base = queries.product_brief(cur, product_id)
+            if not base:
+                return jsonify({"error": "找不到商品"}), 404
+            base = tuple(base)
+            recommend_cache.put(("base", product_id), base[0], base, generation)
+
+        market, ptype, exp, reason = base
+        same_type = reason != "合理"
+        products = recommend_index.recommend(market, ptype, exp, same_type)
+        if products is not None:
+            return jsonify(products), 200
+
+        key = ("list",) + base
+        products = recommend_cache.get(key)
+        if products is None:
+            with db.cursor() as cur:
+                products = queries.recommend_products(cur, market, ptype, exp, same_type=same_type)
+            for product in products:
+                if isinstance(product.get('ExpireDate'), (datetime, date)):
+                    product['ExpireDate'] = product['ExpireDate'].strftime("%Y-%m-%d")
+            recommend_cache.put(key, market, products, generation)
+    except Exception as e:
+        return db_error(e, "推薦商品失敗")
 
     return jsonify(products), 200
 
-#---------------------啟動過期商品檢查----------------------
-def update_product_status_once():
-    """啟動時掃描所有商品的 ExpireDate，更新 Status 為 '已過期' 或 '未過期'"""
-    with app.app_context():
-        try:
-            print("啟動時自動檢查商品過期狀態...")
-            cur = mysql.connection.cursor()
-            cur.execute("SELECT ProductID, ExpireDate FROM product")
-            rows = cur.fetchall()
-
-            updated_count = 0
-            for pid, exp_str in rows:
-                if not exp_str:
-                    continue
-                try:
-                    exp = exp_str if isinstance(exp_str, date) else datetime.strptime(str(exp_str), "%Y-%m-%d").date()
-                    status = "未過期" if exp >= date.today() else "已過期"
-                    cur.execute("UPDATE product SET Status=%s WHERE ProductID=%s", (status, pid))
-                    updated_count += 1
-                except Exception as e:
-                    print(f"更新 ProductID={pid} 狀態失敗:", e)
-
-            mysql.connection.commit()
-            cur.close()
-            print(f"商品狀態更新完成，共 {updated_count} 筆")
-        except Exception as e:
-            print("自動更新狀態失敗:", e)
+#---------------------過期商品定時掃描----------------------
+# 由背景執行緒定時執行（見 status_sweeper.py）；每個 worker 在第一個請求時啟動自己的排程，
+# GET_LOCK 確保同時只有一個在掃
+@app.before_request
+def start_status_sweeper():
+    status_sweeper.start()
+
+
+# 折扣表的背景建表（見 price_table.py，PRICE_TABLE=1 時才有）
+@app.before_request
+def start_price_table_builder():
+    start_price_table()
 
 # ---------------------- 訪客登入後儲存 ----------------------
 
@@ -623,45 +798,25 @@ def save_scan_record():
         return jsonify({"error": "缺少 productId"}), 400
 
     try:
-        cur = mysql.connection.cursor()
-        
-        cur.execute(
-            "SELECT id FROM history WHERE userID=%s AND productID=%s",
-            (user_id, product_id)
-        )
-        if cur.fetchone():
-            cur.close()
+        history_id, created = bind_history(user_id, product_id)
+        if not created:
             return jsonify({"message": "紀錄已存在"}), 200
-
-        cur.execute(
-            "INSERT INTO history (userID, productID, created_at) VALUES (%s, %s, NOW())",
-            (user_id, product_id)
-        )
-        history_id = cur.lastrowid
-        mysql.connection.commit()
-        cur.close()
-
-        print(f"已將 ProductID={product_id} 綁定到 UserID={user_id}, HistoryID={history_id}")
         return jsonify({
             "message": "歷史紀錄儲存成功",
             "HistoryID": history_id
         }), 201  
 
     except Exception as e:
-        print("儲存掃描紀錄失敗:", traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+        return db_error(e, "儲存掃描紀錄失敗")
 
 
 
 # ---------------------- 啟動 ----------------------
 if __name__ == "__main__":
     if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
-        update_product_status_once()
+        with db.connection() as conn:
+            migrate(conn)
+        status_sweeper.start()
 
 
     app.run(host='0.0.0.0', port=5000, debug=True)
-
-
-
-
-
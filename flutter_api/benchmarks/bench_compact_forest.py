@@ -0,0 +1,104 @@
+"""
+精簡森林格式效能測試：joblib 載入的 sklearn 森林 vs compact_forest（mmap 陣列 + NumPy 推論）
+
+用法（在 flutter_api/ 下執行）:
+    python benchmarks/bench_compact_forest.py --model random_forest_model.pkl --rows 1,100,10000,100000
+
+比較項目：載入時間、artifact 大小、各批次大小的推論延遲，以及兩者預測的最大差異。
+routed 為 .forest 與 .pkl 並存時 model_server 的實際路徑：COMPACT_MAX_ROWS 筆以內用 compact，其餘用 sklearn，
+每個批次大小都應不慢於兩者中較快的一個。
+輸入特徵依模型欄位隨機產生（剩餘小時 0~240、原價 20~400、其餘 one-hot / 情境欄位）。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import joblib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compact_forest import CompactForest, export_forest  # noqa: E402
+from ml_model import one_hot_schema  # noqa: E402
+from model_server import COMPACT_MAX_ROWS, ModelHandle  # noqa: E402
+
+
+def make_features(feature_cols, n, seed=0):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(0, index=range(n), columns=feature_cols, dtype=np.float64)
+    numeric = {
+        '剩餘保存期限_小時': lambda: rng.uniform(0, 240, n),
+        '原價': lambda: rng.integers(20, 400, n),
+        '當下溫度': lambda: rng.integers(20, 33, n),
+        '貨架上庫存量': lambda: rng.integers(5, 20, n),
+    }
+    for col, gen in numeric.items():
+        if col in X.columns:
+            X[col] = gen()
+    for names, _ in one_hot_schema(feature_cols).values():
+        pick = rng.integers(0, len(names), n)
+        for i, name in enumerate(names):
+            X[name] = (pick == i).astype(np.float64)
+    return X
+
+
+def dir_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='random_forest_model.pkl')
+    parser.add_argument('--rows', default='1,100,10000,100000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        forest_path = os.path.join(tmp, 'model.forest')
+        export_forest(joblib.load(args.model), forest_path)
+
+        load_sk, model = best_of(lambda: joblib.load(args.model), args.repeat)
+        load_cf, compact = best_of(lambda: CompactForest.load(forest_path), args.repeat)
+        print(f"{'':>10}{'載入(ms)':>12}{'大小(KB)':>12}")
+        print(f"{'sklearn':>10}{load_sk * 1000:>12.2f}{dir_size(args.model) / 1024:>12.0f}")
+        print(f"{'compact':>10}{load_cf * 1000:>12.2f}{dir_size(forest_path) / 1024:>12.0f}")
+        print(f"   載入加速: {load_sk / load_cf:.1f}x")
+        print()
+
+        feature_cols = list(model.feature_names_in_)
+        routed = ModelHandle("bench", compact, feature_cols, batch_loader=lambda: model)
+        print(f"COMPACT_MAX_ROWS={COMPACT_MAX_ROWS}")
+        print(f"{'rows':>8}{'sklearn µs/row':>16}{'compact µs/row':>16}{'routed µs/row':>16}"
+              f"{'speedup':>10}{'max diff':>12}")
+        for n in [int(r) for r in args.rows.split(',')]:
+            X = make_features(feature_cols, n)
+            # sklearn 預設 n_jobs=None（單核），與線上推論相同
+            sk_t, expected = best_of(lambda: model.predict(X), args.repeat)
+            cf_t, actual = best_of(lambda: compact.predict(X), args.repeat)
+            rt_t, _ = best_of(lambda: routed.predict(X), args.repeat)
+            diff = np.abs(expected - actual).max()
+            assert diff < 1e-9, f"預測差異過大: {diff}"
+            # speedup：routed 相對於只用 sklearn
+            print(f"{n:>8}{sk_t / n * 1e6:>16.2f}{cf_t / n * 1e6:>16.2f}{rt_t / n * 1e6:>16.2f}"
+                  f"{sk_t / rt_t:>9.1f}x{diff:>12.2g}")
+
+
+if __name__ == '__main__':
+    main()
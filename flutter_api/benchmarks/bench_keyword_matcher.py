@@ -0,0 +1,90 @@
+"""
+關鍵字分類效能測試：逐一 any(k in line ...) vs Aho-Corasick 自動機
+
+用法（在 flutter_api/ 下執行）:
+    python benchmarks/bench_keyword_matcher.py --keywords 3000 --lines 20000
+
+除了現有關鍵字外，每個分類再補上隨機產生的關鍵字，模擬完整商品清單的字典規模，
+並確認兩種做法的分類結果完全相同。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ocr_service  # noqa: E402
+from keyword_matcher import KeywordMatcher  # noqa: E402
+
+CATEGORIES = [
+    ("肉類", ocr_service.MEAT_KEYWORDS),
+    ("魚類", ocr_service.SEAFOOD_KEYWORDS),
+    ("蔬果類", ocr_service.VEG_KEYWORDS),
+    ("麵包甜點類", ocr_service.BAKERY_KEYWORDS),
+    ("豆製品類", ocr_service.BEAN_KEYWORDS),
+    ("熟食/其他", ocr_service.READY_TO_EAT_KEYWORDS),
+]
+
+
+def random_word(rng, lo=2, hi=4):
+    # 常用中日韓統一表意文字區段
+    return "".join(chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(rng.randint(lo, hi)))
+
+
+def legacy_classify(line, categories):
+    for label, keywords in categories:
+        if any(k in line for k in keywords):
+            return label
+    return "其他"
+
+
+def legacy_matches_any(line, categories):
+    return any(k in line for k in sum((kw for _, kw in categories), []))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keywords", type=int, default=3000, help="每個分類額外的關鍵字數")
+    parser.add_argument("--lines", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    categories = [(label, kw + [random_word(rng) for _ in range(args.keywords)]) for label, kw in CATEGORIES]
+    all_keywords = [k for _, kw in categories for k in kw]
+
+    lines = []
+    for _ in range(args.lines):
+        parts = [random_word(rng, 1, 6) for _ in range(rng.randint(1, 3))]
+        if rng.random() < 0.5:
+            parts.insert(rng.randint(0, len(parts)), rng.choice(all_keywords))
+        lines.append("".join(parts) + f" {rng.randint(10, 500)}元")
+
+    start = time.perf_counter()
+    matcher = KeywordMatcher(categories)
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy = [legacy_classify(line, categories) for line in lines]
+    legacy_any = [legacy_matches_any(line, categories) for line in lines]
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast = [matcher.classify(line, "其他") for line in lines]
+    fast_any = [matcher.matches_any(line) for line in lines]
+    fast_s = time.perf_counter() - start
+
+    assert legacy == fast, "classify 結果不一致"
+    assert legacy_any == fast_any, "matches_any 結果不一致"
+
+    n = len(lines)
+    print(f"關鍵字總數: {len(all_keywords)}  行數: {n}  結果一致: OK")
+    print(f"自動機建置: {build_s * 1000:.1f} ms")
+    print(f"    legacy: {legacy_s:7.3f} s  {legacy_s / n * 1e6:8.1f} µs/line")
+    print(f"   matcher: {fast_s:7.3f} s  {fast_s / n * 1e6:8.1f} µs/line")
+    print(f"   speedup: {legacy_s / fast_s:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
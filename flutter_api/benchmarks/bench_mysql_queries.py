@@ -0,0 +1,181 @@
+"""
+MySQL 查詢延遲測試：在本機 MySQL 建一個測試資料庫、灌入大量資料，比較舊寫法與索引 / 新寫法
+
+用法（在 flutter_api/ 下執行，需要 mysqlclient 與本機 MySQL 8）:
+    python benchmarks/bench_mysql_queries.py --database dp_bench --history 1000000 --products 200000
+    python benchmarks/bench_mysql_queries.py --database dp_bench --skip-seed   # 沿用已灌好的資料
+
+連線帳密取自 db_config（database 改用 --database，避免動到正式資料）。
+流程：建庫 -> 只建基本資料表（migration 1~2）-> 灌資料 -> 量測無索引時的延遲
+      -> 套用其餘 migration（索引、全文檢索）-> 再量測一次，並印出 EXPLAIN 的存取方式。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import MySQLdb
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import schema  # noqa: E402
+from db_config import db_config  # noqa: E402
+
+MARKETS = ['全聯中正店', '全聯信義店', '家樂福桂林店', '家樂福重慶店', '美廉社民生店', '頂好南京店']
+TYPES = ['肉類', '魚類', '蔬果類', '麵包甜點類', '豆製品類', '熟食/其他', '其他']
+WORDS = ['豬肉', '雞腿', '牛肉片', '鮭魚', '鯛魚片', '高麗菜', '蘋果', '香蕉', '吐司', '蛋糕',
+         '豆腐', '豆漿', '便當', '壽司', '飯糰', '沙拉', '優格', '鮮奶', '排骨', '絞肉']
+BATCH = 10_000
+
+
+def connect(database=None):
+    return MySQLdb.connect(
+        host=db_config['host'], user=db_config['user'], password=db_config['password'],
+        database=database, charset="utf8mb4", autocommit=False,
+    )
+
+
+def run_migrations(conn, upto):
+    """只套用版本 <= upto 的 migration"""
+    saved = schema.MIGRATIONS
+    schema.MIGRATIONS = [m for m in saved if m[0] <= upto]
+    try:
+        schema.migrate(conn)
+    finally:
+        schema.MIGRATIONS = saved
+
+
+def seed(conn, n_products, n_history, n_users, seed_value=0):
+    rng = random.Random(seed_value)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    cur = conn.cursor()
+
+    rows = []
+    for i in range(n_products):
+        name = rng.choice(WORDS) + rng.choice(['', '(大)', '(小)', '家庭號', '特選']) + rng.choice(WORDS[:5] + [''])
+        expire = (today + timedelta(days=rng.randint(-5, 10))).date()
+        price = rng.randint(20, 500)
+        rows.append((
+            name, expire, price, int(price * rng.uniform(0.5, 1)), rng.choice(MARKETS),
+            '未過期' if expire >= today.date() else '已過期', rng.choice(TYPES), None,
+            int(price * rng.uniform(0.5, 1)), rng.choice(['合理', '合理', '不合理']),
+        ))
+        if len(rows) == BATCH:
+            cur.executemany(
+                "INSERT INTO product (ProName, ExpireDate, Price, ProPrice, Market, Status, ProductType, "
+                "ImagePath, AiPrice, Reason) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", rows)
+            conn.commit()
+            rows = []
+    if rows:
+        cur.executemany(
+            "INSERT INTO product (ProName, ExpireDate, Price, ProPrice, Market, Status, ProductType, "
+            "ImagePath, AiPrice, Reason) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", rows)
+        conn.commit()
+
+    rows = []
+    for i in range(n_history):
+        # 使用者分佈偏斜：少數重度使用者有大量紀錄
+        user = min(int(rng.paretovariate(1.2)), n_users)
+        created = today - timedelta(days=rng.randint(0, 365), seconds=rng.randint(0, 86399))
+        rows.append((user, rng.randint(1, n_products), created))
+        if len(rows) == BATCH:
+            cur.executemany("INSERT INTO history (userID, productID, created_at) VALUES (%s, %s, %s)", rows)
+            conn.commit()
+            rows = []
+            print(f"\r  history {i + 1}/{n_history}", end="", flush=True)
+    if rows:
+        cur.executemany("INSERT INTO history (userID, productID, created_at) VALUES (%s, %s, %s)", rows)
+        conn.commit()
+    print()
+    cur.close()
+
+
+def queries():
+    day = (datetime.now() - timedelta(days=3)).replace(hour=0, minute=0, second=0, microsecond=0)
+    select = ("SELECT p.productid, p.producttype, p.proname, p.proprice, h.created_at, p.expiredate, "
+              "p.status, p.market, p.ImagePath, h.id, p.AiPrice FROM history h "
+              "JOIN product p ON h.productid = p.productid WHERE h.userid = %s")
+    match_clause, match_value = schema.name_search_clause("豬肉")
+    return [
+        ("歷史（全部）", select + " ORDER BY h.created_at DESC", (1,)),
+        ("歷史 DATE()=", select + " AND DATE(h.created_at) = %s ORDER BY h.created_at DESC",
+         (1, day.strftime("%Y-%m-%d"))),
+        ("歷史 區間", select + " AND h.created_at >= %s AND h.created_at < %s ORDER BY h.created_at DESC",
+         (1, day, day + timedelta(days=1))),
+        ("歷史 LIKE", select + " AND p.proname LIKE %s ORDER BY h.created_at DESC", (1, "%豬肉%")),
+        ("歷史 MATCH", select + f" AND {match_clause} ORDER BY h.created_at DESC", (1, match_value)),
+        ("推薦 同類", "SELECT * FROM product WHERE Market=%s AND ExpireDate <= %s AND ProductType=%s "
+                    "AND Reason='合理' AND Status='未過期' ORDER BY ExpireDate DESC, ProPrice ASC LIMIT 6",
+         (MARKETS[0], datetime.now().date() + timedelta(days=5), TYPES[0])),
+        ("推薦 異類", "SELECT * FROM product WHERE Market=%s AND ExpireDate <= %s AND Reason='合理' "
+                    "AND Status='未過期' AND ProductType != %s ORDER BY ExpireDate ASC, ProPrice ASC LIMIT 6",
+         (MARKETS[0], datetime.now().date() + timedelta(days=5), TYPES[0])),
+        ("掃描重複檢查", "SELECT id FROM history WHERE userID=%s AND productID=%s", (2, 12345)),
+        ("過期掃描", "SELECT COUNT(*) FROM product WHERE ExpireDate < CURDATE() "
+                  "AND (Status IS NULL OR Status <> '已過期')", ()),
+    ]
+
+
+def measure(conn, repeat, label):
+    cur = conn.cursor()
+    print(f"\n== {label} ==")
+    print(f"{'查詢':<14}{'中位數(ms)':>12}{'筆數':>8}  存取方式（EXPLAIN type/key）")
+    for name, sql, params in queries():
+        if "MATCH(" in sql and label.startswith("無索引"):
+            # 還沒有全文索引，MATCH 無法執行
+            continue
+        times = []
+        count = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cur.execute(sql, params)
+            count = len(cur.fetchall())
+            times.append(time.perf_counter() - start)
+        cur.execute("EXPLAIN " + sql, params)
+        cols = [d[0] for d in cur.description]
+        plan = ", ".join(f"{r[cols.index('table')]}:{r[cols.index('type')]}/{r[cols.index('key')]}"
+                         for r in cur.fetchall())
+        times.sort()
+        print(f"{name:<14}{times[len(times) // 2] * 1000:>12.2f}{count:>8}  {plan}")
+    cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default='dp_bench')
+    parser.add_argument('--history', type=int, default=1_000_000)
+    parser.add_argument('--products', type=int, default=200_000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-seed', action='store_true')
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        server = connect()
+        cur = server.cursor()
+        cur.execute(f"DROP DATABASE IF EXISTS `{args.database}`")
+        cur.execute(f"CREATE DATABASE `{args.database}` DEFAULT CHARSET utf8mb4")
+        cur.close()
+        server.close()
+
+    conn = connect(args.database)
+    try:
+        if not args.skip_seed:
+            run_migrations(conn, upto=2)
+            start = time.perf_counter()
+            seed(conn, args.products, args.history, args.users)
+            print(f"灌入 {args.products} 商品 / {args.history} 歷史紀錄：{time.perf_counter() - start:.1f}s")
+            measure(conn, args.repeat, "無索引（migration 1~2）")
+
+        start = time.perf_counter()
+        schema.migrate(conn)
+        print(f"\n建立索引：{time.perf_counter() - start:.1f}s")
+        measure(conn, args.repeat, f"索引後（migration 1~{schema.LATEST_VERSION}）")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+OCR 前處理效能測試：原圖 vs 各種前處理設定的辨識延遲與抽取正確率
+
+用法（在 flutter_api/ 下執行，需要安裝 paddleocr）:
+    python benchmarks/bench_ocr_preprocess.py --images ../assets --labels labels.json
+
+labels.json 格式（檔名 -> extract_product_info 預期結果，可只填部分欄位）:
+    {"milk.jpg": {"ProName": "...", "ExpireDate": "2025.10.01", "Price": 45, "ProPrice": 36}}
+沒有 labels 時，以原圖的抽取結果作為正確答案，比較前處理後是否一致。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_preprocess  # noqa: E402
+import ocr_service  # noqa: E402
+
+FIELDS = ["ProName", "ExpireDate", "Price", "ProPrice"]
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+CONFIGS = [
+    {"name": "原圖", "raw": True},
+    {"name": "長邊1600", "long_edge": 1600, "grayscale": False, "crop": "none"},
+    {"name": "長邊1600+灰階", "long_edge": 1600, "grayscale": True, "crop": "none"},
+    {"name": "長邊1280+灰階", "long_edge": 1280, "grayscale": True, "crop": "none"},
+    {"name": "長邊960+灰階", "long_edge": 960, "grayscale": True, "crop": "none"},
+    {"name": "自動裁切+長邊1280+灰階", "long_edge": 1280, "grayscale": True, "crop": "auto"},
+]
+
+
+def list_images(path):
+    if os.path.isfile(path):
+        return [path]
+    return sorted(
+        os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTS)
+    )
+
+
+def run(ocr, data, config):
+    start = time.perf_counter()
+    if config.get("raw"):
+        image = image_preprocess.decode(data)
+    else:
+        image = image_preprocess.preprocess(
+            data, long_edge=config["long_edge"], grayscale=config["grayscale"], crop=config["crop"]
+        )
+    result = ocr.predict(image)
+    texts = []
+    for item in result:
+        texts.extend(ocr_service.cc.convert(t) for t in item["rec_texts"])
+    info = ocr_service.extract_product_info(texts)
+    return time.perf_counter() - start, info
+
+
+def score(info, expected):
+    fields = [f for f in FIELDS if f in expected]
+    if not fields:
+        return None
+    return sum(info.get(f) == expected[f] for f in fields) / len(fields)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", default=os.path.join("..", "assets"))
+    parser.add_argument("--labels", default=None)
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    images = list_images(args.images)
+    if not images:
+        sys.exit(f"找不到圖片: {args.images}")
+    labels = {}
+    if args.labels:
+        with open(args.labels, encoding="utf-8") as f:
+            labels = json.load(f)
+
+    ocr = ocr_service.get_ocr()
+    blobs = {}
+    for path in images:
+        with open(path, "rb") as f:
+            blobs[os.path.basename(path)] = f.read()
+
+    # 暖機，避免第一次推論的初始化時間算進去
+    run(ocr, next(iter(blobs.values())), CONFIGS[0])
+
+    reference = {}
+    print(f"{'設定':<28}{'平均延遲(ms)':>14}{'正確率':>10}")
+    for config in CONFIGS:
+        latencies, scores = [], []
+        for name, data in blobs.items():
+            best = float("inf")
+            for _ in range(args.repeat):
+                elapsed, info = run(ocr, data, config)
+                best = min(best, elapsed)
+            latencies.append(best)
+            if config.get("raw"):
+                reference[name] = info
+            expected = labels.get(name, reference.get(name, {}))
+            s = score(info, expected)
+            if s is not None:
+                scores.append(s)
+        avg_ms = sum(latencies) / len(latencies) * 1000
+        acc = f"{sum(scores) / len(scores):.0%}" if scores else "-"
+        print(f"{config['name']:<28}{avg_ms:>14.1f}{acc:>10}")
+
+
+if __name__ == "__main__":
+    main()
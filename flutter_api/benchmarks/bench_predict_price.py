@@ -0,0 +1,104 @@
+"""
+定價路徑（ml_model.price_frame）效能測試：舊版 vs 目前版本，每 100k 筆的時間與記憶體峰值
+
+用法（在 flutter_api/ 下執行）:
+    python benchmarks/bench_predict_price.py --rows 100000 --repeat 3
+
+舊版實作保留在本檔（_legacy_price_frame）：整份 deep copy、推論後再 pd.to_numeric 一次 ProPrice / price、
+Reason 以 df.apply(axis=1) 逐列判斷。兩個版本用同一個 ModelHandle（預設規則引擎，--engine model 用上線模型）、
+同一批資料，先比對 AiPrice / Reason 完全一致，再量測。
+時間不開 tracemalloc 量測；記憶體峰值另外以 tracemalloc 跑一次（numpy / pandas 的配置都會被追蹤），
+為呼叫期間相對於呼叫前的增量。
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ml_model  # noqa: E402
+from bench_prepare_features import make_products  # noqa: E402
+from repricing import reprice_after  # noqa: E402
+
+
+def _legacy_price_frame(df, handle):
+    feature_cols = handle.feature_cols
+    df = df.copy()
+    df_full = ml_model.prepare_features(df, feature_cols=feature_cols)
+    X = df_full[feature_cols]
+    df['AI折扣'] = np.round(handle.predict(X), 2)
+
+    df['ProPrice'] = pd.to_numeric(df['ProPrice'], errors='coerce').fillna(0).astype(float)
+    df['price'] = pd.to_numeric(df['price'], errors='coerce').fillna(0).astype(float)
+    df['AiPrice'] = (df['price'] * (1 - df['AI折扣'])).round(0).astype(float)
+    df['Reason'] = df.apply(
+        lambda r: "合理" if np.isclose(r['AiPrice'], r['ProPrice'], atol=1) or r['AiPrice'] >= r['ProPrice']
+        else "不合理",
+        axis=1
+    )
+    df['RepriceAfter'] = reprice_after(df_full['剩餘保存期限_小時'])
+    return df
+
+
+def _current_price_frame(df, handle):
+    return ml_model.price_frame(df, handle=handle)
+
+
+def measure(fn, df, handle, repeat):
+    """時間取 repeat 次的最小值（不開 tracemalloc）；記憶體峰值另外跑一次量測"""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn(df, handle)
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    out = fn(df, handle)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    del out
+    return min(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--engine', choices=['rules', 'model'], default='rules')
+    args = parser.parse_args()
+
+    # 折扣表會讓兩邊的推論路徑不同，這裡只比較推論以外的部分
+    ml_model.price_table = None
+    handle = ml_model.rules_handle() if args.engine == 'rules' else ml_model.registry.current()
+    df = make_products(args.rows)
+
+    legacy = _legacy_price_frame(df, handle)
+    current = _current_price_frame(df, handle)
+    same_price = np.array_equal(legacy['AiPrice'].to_numpy(), current['AiPrice'].to_numpy())
+    same_reason = (legacy['Reason'].astype(str).to_numpy() == current['Reason'].astype(str).to_numpy()).all()
+    print(f"AiPrice 一致: {same_price}  Reason 一致: {same_reason}  "
+          f"（合理 {int((current['Reason'] == '合理').sum())} / {args.rows}）")
+
+    scale = 100_000 / args.rows
+    results = {}
+    for name, fn in [('舊版', _legacy_price_frame), ('目前', _current_price_frame)]:
+        elapsed, peak = measure(fn, df, handle, args.repeat)
+        results[name] = (elapsed, peak)
+        print(f"{name}: {elapsed * scale:.3f}s / 100k 筆，記憶體峰值 {peak * scale / 2**20:.1f} MiB / 100k 筆")
+
+    (t0, m0), (t1, m1) = results['舊版'], results['目前']
+    print(f"時間 {t0 / t1:.1f}x，記憶體峰值 {m0 / m1:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
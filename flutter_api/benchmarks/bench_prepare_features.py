@@ -0,0 +1,165 @@
+"""
+prepare_features 效能測試：舊版逐列實作 vs 向量化實作
+
+用法（在 flutter_api/ 下執行）:
+    python benchmarks/bench_prepare_features.py --rows 100000
+
+舊版實作保留在本檔（_legacy_prepare_features），唯一的改動是情境欄位
+（人流量 / 天氣 / 停車狀況 / 當下溫度 / 貨架上庫存量）改由輸入帶入，
+這樣兩個版本吃到同樣的隨機值，才能逐欄比對特徵是否完全一致。
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ml_model  # noqa: E402
+
+CATEGORIES = ['肉類', '魚類', '蔬果類', '麵包甜點類', '豆製品類', '熟食/其他', '其他']
+
+
+def make_products(n, seed=0):
+    rng = np.random.default_rng(seed)
+    today = pd.Timestamp.now(tz='Asia/Taipei').normalize().tz_localize(None)
+    expire = today + pd.to_timedelta(rng.integers(-2, 10, size=n), unit='D')
+    # 一部分帶時間、一部分缺值
+    expire = expire + pd.to_timedelta(rng.choice([0, 0, 0, 15], size=n), unit='h')
+    expire = pd.Series(expire).astype(object)
+    expire[rng.random(n) < 0.02] = None
+    return pd.DataFrame({
+        'ProductID': np.arange(n),
+        'ProName': [f'商品{i}' for i in range(n)],
+        'ProPrice': rng.integers(20, 300, size=n),
+        'price': rng.integers(30, 400, size=n).astype(object),
+        'ExpireDate': expire,
+        'Status': '未過期',
+        '商品大類': rng.choice(CATEGORIES, size=n),
+        '人流量': rng.choice(['少', '一般', '多'], size=n),
+        '天氣': rng.choice(['晴天', '陰天', '雨天'], size=n),
+        '停車狀況': rng.choice(['少', '一般', '多'], size=n),
+        '當下溫度': rng.integers(20, 33, size=n),
+        '貨架上庫存量': rng.integers(5, 20, size=n),
+    })
+
+
+def _legacy_prepare_features(df, now_utc):
+    feature_cols = ml_model.get_feature_cols()
+    df = df.copy()
+
+    df['ProName'] = df.get('ProName', '未知商品')
+    df['price'] = pd.to_numeric(df.get('price', 0), errors='coerce').fillna(0).astype(float)
+    df['ProPrice'] = pd.to_numeric(df.get('ProPrice', 0), errors='coerce').fillna(0).astype(float)
+
+    df['原價'] = df['price']
+
+    local_tz = 'Asia/Taipei'
+
+    expire = pd.to_datetime(df.get('ExpireDate'), errors='coerce')
+    expire = expire.apply(
+        lambda x: x + pd.Timedelta(hours=23, minutes=59, seconds=59)
+        if pd.notna(x) and x.hour == 0 and x.minute == 0 and x.second == 0
+        else x
+    )
+
+    def localize_to_taipei(ts):
+        if pd.isna(ts):
+            return pd.NaT
+        try:
+            if ts.tzinfo is None:
+                return ts.tz_localize(local_tz, ambiguous='NaT', nonexistent='NaT')
+            return ts.tz_convert(local_tz)
+        except Exception:
+            return pd.NaT
+
+    expire = expire.apply(localize_to_taipei)
+
+    mask_nat = expire.isna()
+    if mask_nat.any():
+        fallback = pd.to_datetime(df.loc[mask_nat, 'ExpireDate'], errors='coerce')
+        fallback = fallback.dt.tz_localize(local_tz, ambiguous='NaT', nonexistent='NaT')
+        expire = expire.combine_first(fallback)
+
+    expire = expire.dt.tz_convert('UTC')
+
+    delta_hours = (expire - now_utc).dt.total_seconds() / 3600
+    df['剩餘保存期限_小時'] = delta_hours.clip(lower=0).fillna(0)
+
+    def format_remaining_time(expire_ts, now_ts):
+        if pd.isna(expire_ts):
+            return "未知"
+        delta = expire_ts - now_ts
+        if delta.total_seconds() <= 0:
+            return "已過期"
+        days = delta.days
+        hours, remainder = divmod(delta.seconds, 3600)
+        minutes, seconds = divmod(remainder, 60)
+        return f"{days}天 {hours}小時 {minutes}分 {seconds}秒"
+
+    df['剩餘時間_可讀'] = expire.apply(lambda x: format_remaining_time(x, now_utc))
+
+    if '商品大類' not in df.columns:
+        if 'ProductType' in df.columns:
+            df['商品大類'] = df['ProductType']
+        else:
+            df['商品大類'] = '其他'
+
+    df = pd.get_dummies(df, columns=['人流量', '天氣', '停車狀況', '商品大類'], dtype=int)
+    df.columns = df.columns.str.replace(r'\s+', '', regex=True)
+
+    for col in feature_cols:
+        if col not in df.columns:
+            df[col] = 0
+
+    df = df.copy()
+    for c in df.columns:
+        if df[c].dtype == 'bool':
+            df[c] = df[c].astype(int)
+
+    return df
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_products(args.rows)
+    now_utc = pd.Timestamp.now(tz='UTC')
+    cols = ml_model.get_feature_cols()
+
+    legacy_t, legacy = timed(lambda: _legacy_prepare_features(df, now_utc), args.repeat)
+    new_t, new = timed(lambda: ml_model.prepare_features(df, now=now_utc), args.repeat)
+
+    pd.testing.assert_frame_equal(
+        legacy[cols].reset_index(drop=True), new[cols].reset_index(drop=True), check_dtype=False
+    )
+    pd.testing.assert_series_equal(legacy['剩餘時間_可讀'], new['剩餘時間_可讀'], check_dtype=False)
+    print(f"rows: {args.rows}  特徵一致: OK")
+
+    for name, t in [('legacy', legacy_t), ('vectorized', new_t)]:
+        print(f"{name:>10}: {t:8.3f} s  {t / args.rows * 1e6:8.2f} µs/row")
+    print(f"   speedup: {legacy_t / new_t:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
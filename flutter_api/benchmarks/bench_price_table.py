@@ -0,0 +1,94 @@
+"""
+折扣表效能測試：每次都跑模型 vs 預先計算的 小時 × 原價 網格內插
+
+用法（在 flutter_api/ 下執行）:
+    python benchmarks/bench_price_table.py --rows 20000 --contexts 6
+
+模擬 --contexts 組固定情境（人流量 / 天氣 / 停車狀況 / 溫度 / 庫存）× 各商品大類，
+小時 0~168、原價 20~800 隨機；先以 precompute() 建表（上線時由背景執行緒做），
+再比較整批查表延遲，以及四捨五入到小數兩位後與模型結果的差異。
+split_aligned 為對齊樹分割門檻的表（樹模型時），內插網格的結果另外列出（不套用誤差門檻）。
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml_model import one_hot_schema  # noqa: E402
+from model_server import ModelRegistry  # noqa: E402
+from price_table import PriceTable, _grid  # noqa: E402
+
+
+def make_features(feature_cols, n, n_contexts, seed=0):
+    rng = np.random.default_rng(seed)
+    schema = one_hot_schema(feature_cols)
+    contexts = []
+    for _ in range(n_contexts):
+        ctx = {'當下溫度': int(rng.integers(20, 33)), '貨架上庫存量': int(rng.integers(5, 20))}
+        for prefix, (names, _) in schema.items():
+            if prefix != '商品大類':
+                ctx[prefix] = names[rng.integers(0, len(names))]
+        contexts.append(ctx)
+
+    X = pd.DataFrame(0.0, index=range(n), columns=feature_cols)
+    X['剩餘保存期限_小時'] = rng.uniform(0, 168, n)
+    X['原價'] = rng.integers(20, 800, n).astype(float)
+    pick = rng.integers(0, n_contexts, n)
+    categories = schema['商品大類'][0]
+    category = rng.integers(0, len(categories), n)
+    for i, ctx in enumerate(contexts):
+        rows = pick == i
+        for col in ('當下溫度', '貨架上庫存量'):
+            if col in X.columns:
+                X.loc[rows, col] = ctx[col]
+        for prefix, (names, _) in schema.items():
+            if prefix != '商品大類':
+                X.loc[rows, ctx[prefix]] = 1.0
+    for i, name in enumerate(categories):
+        X.loc[category == i, name] = 1.0
+    return X
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--contexts', type=int, default=6)
+    parser.add_argument('--hours-steps', default='0.5,1,2')
+    parser.add_argument('--price-step', type=float, default=10)
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    handle = ModelRegistry(model_dir='__none__').reload()
+    X = make_features(handle.feature_cols, args.rows, args.contexts)
+
+    live_t, expected = timed(lambda: handle.predict(X))
+    expected = np.round(expected, 2)
+    print(f"模型 {handle.version}，{args.rows} 筆")
+    print(f"{'live':>14}: {live_t * 1000:8.1f} ms  {live_t / args.rows * 1e6:6.2f} µs/row")
+
+    tables = [('split_aligned', PriceTable(min_hits=1))]
+    for step in [float(s) for s in args.hours_steps.split(',')]:
+        tables.append((f"table h={step:g}", PriceTable(hours_grid=_grid(step, 168), price_grid=_grid(args.price_step, 1000),
+                                                       min_hits=1, max_error=1.0, align=False)))
+    for label, table in tables:
+        build_t, built = timed(lambda: table.precompute(handle, X))
+        warm_t, actual = timed(lambda: table.predict(handle, X))
+        diff = np.abs(np.round(actual, 2) - expected)
+        print(f"{label:>14}: {warm_t * 1000:8.1f} ms  {warm_t / args.rows * 1e6:6.2f} µs/row"
+              f"  建表 {build_t * 1000:7.0f} ms / {built} keys（網格 {table.stats()['grid']}）"
+              f"  一致 {np.mean(diff == 0) * 100:5.1f}%  平均差 {diff.mean():.4f}  最大差 {diff.max():.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+定價引擎比較：forest / gbm / linear / rules 在田野調查資料上的準確度、推論延遲與記憶體
+
+用法（在 flutter_api/ 下執行）:
+    python benchmarks/bench_pricing_engines.py --data 畢業專題田野調查.csv
+
+資料切分與 ML.py train 相同（test_size=0.2, random_state=42）。
+延遲分成單筆（逐筆呼叫取平均，對應單一商品定價）與整批（測試集一次推論）。
+記憶體為 artifact 序列化後的大小，以及整批推論時 tracemalloc 記錄的配置峰值。
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+import joblib
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ML  # noqa: E402
+from pricing_engines import ENGINES, RuleEngine, build_estimator  # noqa: E402
+from sklearn.metrics import mean_absolute_error, mean_squared_error  # noqa: E402
+from sklearn.model_selection import train_test_split  # noqa: E402
+
+
+def artifact_kb(model):
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer)
+    return buffer.tell() / 1024
+
+
+def single_row_us(model, X, samples):
+    rows = [X.iloc[[i]] for i in range(min(samples, len(X)))]
+    start = time.perf_counter()
+    for row in rows:
+        model.predict(row)
+    return (time.perf_counter() - start) / len(rows) * 1e6
+
+
+def batch(model, X):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    y_pred = model.predict(X)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return y_pred, elapsed / len(X) * 1e6, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default=ML.DATA_PATH)
+    parser.add_argument('--single', type=int, default=50, help="單筆延遲取樣筆數")
+    args = parser.parse_args()
+
+    df, feature_cols = ML.build_features(ML.load_dataset(args.data))
+    X_train, X_test, y_train, y_test = train_test_split(
+        df[feature_cols], df['折扣實際'], test_size=0.2, random_state=42
+    )
+    print(f"訓練 {len(X_train)} 筆 / 測試 {len(X_test)} 筆，特徵 {len(feature_cols)} 個\n")
+
+    models = {}
+    fit_s = {}
+    for engine in ENGINES:
+        model = build_estimator(engine)
+        start = time.perf_counter()
+        model.fit(X_train, y_train)
+        fit_s[engine] = time.perf_counter() - start
+        models[engine] = model
+    models['rules'] = RuleEngine()
+    fit_s['rules'] = 0.0
+
+    header = f"{'engine':>8}{'MSE':>10}{'MAE':>8}{'fit(s)':>8}{'單筆µs':>10}{'整批µs/row':>12}{'峰值KB':>9}{'大小KB':>9}"
+    print(header)
+    for name, model in models.items():
+        y_pred, batch_us, peak_kb = batch(model, X_test)
+        print(
+            f"{name:>8}{mean_squared_error(y_test, y_pred):>10.5f}{mean_absolute_error(y_test, y_pred):>8.4f}"
+            f"{fit_s[name]:>8.2f}{single_row_us(model, X_test, args.single):>10.0f}{batch_us:>12.2f}"
+            f"{peak_kb:>9.0f}{artifact_kb(model):>9.0f}"
+        )
+    baseline = mean_squared_error(y_test, np.full(len(y_test), y_train.mean()))
+    print(f"\n（對照：全部預測平均折扣的 MSE = {baseline:.5f}）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+推薦索引效能測試：記憶體內 bisect 查詢 vs 逐筆掃描同賣場商品（沒有索引時 SQL 的做法）
+
+用法（在 flutter_api/ 下執行，不需要 MySQL）:
+    python benchmarks/bench_recommend_index.py --products 200000 --markets 6 --lookups 5000
+
+以隨機商品資料建立索引（模擬 DB 載入），量測完整載入、每次推薦查詢、
+以及重新定價後 upsert 一批商品的耗時；並抽查結果與逐筆掃描一致。
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recommend_index import RecommendIndex  # noqa: E402
+
+TYPES = ['肉類', '魚類', '蔬果類', '麵包甜點類', '豆製品類', '熟食/其他', '其他']
+COLUMNS = ['ProductID', 'ProName', 'ProPrice', 'ExpireDate', 'ImagePath', 'Market', '商品大類', 'Reason', 'Status']
+
+
+class RowsDB:
+    """只提供 cursor() 的假資料庫，INDEX_SELECT 回傳所有未過期商品"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @contextmanager
+    def cursor(self):
+        rows = self.rows
+
+        class Cursor:
+            def execute(self, sql, params):
+                self.result = [r for r in rows if r[8] == params[0]]
+
+            def fetchall(self):
+                return self.result
+
+        yield Cursor()
+
+
+def make_rows(n, n_markets, today, seed=0):
+    rng = random.Random(seed)
+    markets = [f"賣場{i}" for i in range(n_markets)]
+    return [
+        (pid, f"商品{pid}", rng.randint(20, 500), today + datetime.timedelta(days=rng.randint(-2, 10)),
+         f"/uploads/{pid}.jpg", rng.choice(markets), rng.choice(TYPES), rng.choice(['合理', '合理', '不合理']),
+         '未過期')
+        for pid in range(1, n + 1)
+    ]
+
+
+def scan(rows, market, ptype, exp, same_type, today):
+    """逐筆掃描，等同 db.RECOMMEND_*_SQL（加上略過日期已過的商品）"""
+    hits = [r for r in rows if r[5] == market and r[7] == '合理' and r[8] == '未過期'
+            and today <= r[3] <= exp and ((r[6] == ptype) if same_type else (r[6] != ptype))]
+    if same_type:
+        hits.sort(key=lambda r: (-r[3].toordinal(), r[2], r[0]))
+    else:
+        hits.sort(key=lambda r: (r[3], r[2], r[0]))
+    return [r[0] for r in hits[:6]]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=200_000)
+    parser.add_argument('--markets', type=int, default=6)
+    parser.add_argument('--lookups', type=int, default=5000)
+    parser.add_argument('--scan-lookups', type=int, default=50)
+    parser.add_argument('--upsert', type=int, default=2000)
+    args = parser.parse_args()
+
+    today = datetime.date.today()
+    rows = make_rows(args.products, args.markets, today)
+    index = RecommendIndex(RowsDB(rows))
+
+    start = time.perf_counter()
+    index.load()
+    print(f"完整載入 {args.products} 筆：{time.perf_counter() - start:.2f}s  {index.stats()}")
+
+    rng = random.Random(1)
+    queries = [
+        (f"賣場{rng.randrange(args.markets)}", rng.choice(TYPES),
+         today + datetime.timedelta(days=rng.randint(0, 10)), rng.random() < 0.5)
+        for _ in range(args.lookups)
+    ]
+
+    start = time.perf_counter()
+    for q in queries:
+        index.recommend(*q, today=today)
+    per_index = (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    for q in queries[:args.scan_lookups]:
+        scan(rows, *q, today=today)
+    per_scan = (time.perf_counter() - start) / args.scan_lookups
+    print(f"每次查詢：索引 {per_index * 1e6:.1f} µs，逐筆掃描 {per_scan * 1e3:.2f} ms（{per_scan / per_index:.0f}x）")
+
+    mismatched = sum(
+        [p['ProductID'] for p in index.recommend(*q, today=today)] != scan(rows, *q, today=today)
+        for q in queries[:args.scan_lookups]
+    )
+    print(f"抽查 {args.scan_lookups} 筆與逐筆掃描不一致：{mismatched}")
+
+    # 重新定價一批：Reason 翻轉
+    changed = [list(r) for r in rng.sample(rows, args.upsert)]
+    for r in changed:
+        r[7] = '不合理' if r[7] == '合理' else '合理'
+    frame = pd.DataFrame(changed, columns=COLUMNS)
+    start = time.perf_counter()
+    index.upsert_frame(frame)
+    print(f"upsert {args.upsert} 筆：{(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# ----------------- 精簡森林格式 -----------------
+# 把 sklearn 的隨機森林攤平成幾個 NumPy 陣列，所有樹的節點接在一起：
+#   feature / threshold / left / right / value，第 t 棵樹的根節點在 roots[t]
+# 葉節點的 left / right 指向自己、threshold 為 +inf，走到葉子後停在原地，
+# 推論時所有 (樣本, 樹) 同時往下走一層，不需要逐棵樹的 Python 迴圈；走到葉子的就移出
+#
+# 存成一個目錄（<版本>.forest/），每個陣列一個 .npy，另有 meta.json 記錄特徵欄位
+# 以 mmap_mode='r' 載入：不需要反序列化，多個 worker process 直接共用 OS page cache
+# 小批次（單一商品 / 增量重新定價）比 sklearn 快；約 500 筆以上的整批推論 sklearn 的 C 迴圈較快，
+# 所以 .forest 與 .pkl 並存時 model_server 只把小批次交給這裡（見 COMPACT_MAX_ROWS、benchmarks/bench_compact_forest.py）
+
+FOREST_EXT = ".forest"
+ARRAYS = ("feature", "threshold", "left", "right", "value", "roots")
+META_FILE = "meta.json"
+FORMAT_VERSION = 1
+BATCH_ROWS = int(os.environ.get("FOREST_BATCH_ROWS", 4096))
+
+
+class CompactForest:
+    def __init__(self, feature, threshold, left, right, value, roots, feature_names, max_depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+        self.n_features_in_ = len(feature_names)
+        self.max_depth = int(max_depth)
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    # ---------- 轉換 ----------
+    @classmethod
+    def from_sklearn(cls, forest):
+        """由訓練好的 RandomForestRegressor（單一輸出）建立"""
+        if getattr(forest, "n_outputs_", 1) != 1:
+            raise ValueError("只支援單一輸出的迴歸森林")
+        parts = {name: [] for name in ARRAYS if name != "roots"}
+        roots = []
+        offset = 0
+        max_depth = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n = tree.node_count
+            is_leaf = tree.children_left == -1
+            own = np.arange(offset, offset + n, dtype=np.int32)
+            parts["feature"].append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            parts["threshold"].append(np.where(is_leaf, np.inf, tree.threshold))
+            parts["left"].append(np.where(is_leaf, own, tree.children_left + offset).astype(np.int32))
+            parts["right"].append(np.where(is_leaf, own, tree.children_right + offset).astype(np.int32))
+            parts["value"].append(tree.value[:, 0, 0].astype(np.float64))
+            roots.append(offset)
+            offset += n
+            max_depth = max(max_depth, tree.max_depth)
+
+        arrays = {name: np.ascontiguousarray(np.concatenate(values)) for name, values in parts.items()}
+        return cls(
+            roots=np.asarray(roots, dtype=np.int32),
+            feature_names=list(forest.feature_names_in_),
+            max_depth=max_depth,
+            **arrays,
+        )
+
+    # ---------- 存取 ----------
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(path, name + ".npy"), np.asarray(getattr(self, name)))
+        meta = {
+            "format": FORMAT_VERSION,
+            "feature_names": [str(c) for c in self.feature_names_in_],
+            "max_depth": self.max_depth,
+            "n_estimators": self.n_estimators,
+            "n_nodes": self.n_nodes,
+        }
+        with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return path
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"不支援的森林格式版本: {meta.get('format')}")
+        arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode) for name in ARRAYS}
+        return cls(feature_names=meta["feature_names"], max_depth=meta["max_depth"], **arrays)
+
+    # ---------- 推論 ----------
+    def _as_matrix(self, X):
+        if isinstance(X, pd.DataFrame):
+            X = X[list(self.feature_names_in_)]
+        # 與 sklearn 相同：特徵先轉 float32，再與 float64 門檻比較
+        return np.asarray(X, dtype=np.float32)
+
+    def predict(self, X):
+        X = self._as_matrix(X)
+        out = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), BATCH_ROWS):
+            out[start:start + BATCH_ROWS] = self._predict_batch(X[start:start + BATCH_ROWS])
+        return out
+
+    def _predict_batch(self, X):
+        n_rows, n_features = X.shape
+        n_trees = len(self.roots)
+        x_flat = X.ravel()
+        # 每個 (樣本, 樹) 一格，記錄目前所在的節點
+        node = np.tile(np.asarray(self.roots, dtype=np.int32), n_rows)
+        # 只處理還沒走到葉子的格子，越往下需要處理的越少
+        active = np.arange(len(node), dtype=np.int32)
+        current = node.copy()
+        offset = np.repeat(np.arange(n_rows, dtype=np.int32) * n_features, n_trees)
+        for _ in range(self.max_depth):
+            if not len(active):
+                break
+            go_left = x_flat.take(offset + self.feature.take(current)) <= self.threshold.take(current)
+            nxt = np.where(go_left, self.left.take(current), self.right.take(current))
+            node[active] = nxt
+            # 葉節點指向自己，沒有移動的就是已到葉子
+            moved = nxt != current
+            active, current, offset = active[moved], nxt[moved], offset[moved]
+        return self.value.take(node).reshape(n_rows, n_trees).mean(axis=1)
+
+
+def export_forest(forest, path):
+    """sklearn 森林轉成精簡格式並存檔，回傳 CompactForest"""
+    compact = CompactForest.from_sklearn(forest)
+    compact.save(path)
+    return compact
+
+
+def is_compact_forest(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_FILE))
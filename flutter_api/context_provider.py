@@ -0,0 +1,188 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+import diagnostics
+
+# ----------------- 賣場情境 -----------------
+# 模型的情境特徵（人流量 / 天氣 / 停車狀況 / 當下溫度 / 貨架上庫存量）以賣場為單位提供，
+# 不再每列隨機模擬：同樣的商品在同一個情境下一定得到同樣的折扣，預測結果也才能快取
+#
+# 來源：
+#   file  : JSON 檔（CONTEXT_FILE，預設 flutter_api/market_context.json）
+#           {"*": {...所有賣場的預設...}, "<Market>": {"人流量": "多", "當下溫度": 31, ...}}
+#           可用 python context_provider.py set <Market> 人流量=多 天氣=雨天 ... 寫入
+#   table : MySQL market_context 表（CONTEXT_SOURCE=table，由 schema.py 建立），由外部服務定期更新
+# 每個賣場的快照快取 CONTEXT_TTL 秒；一批定價每個賣場只取一次
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONTEXT_SOURCE = os.environ.get("CONTEXT_SOURCE", "file")
+CONTEXT_FILE = os.environ.get("CONTEXT_FILE", os.path.join(BASE_DIR, "market_context.json"))
+CONTEXT_TTL = float(os.environ.get("CONTEXT_TTL", 300))
+
+# 情境欄位可能的值（類別型）
+CONTEXT_VALUES = {
+    '人流量': ['少', '一般', '多'],
+    '天氣': ['晴天', '陰天', '雨天'],
+    '停車狀況': ['少', '一般', '多'],
+}
+# 沒有任何資料時的情境（數值取田野調查資料的平均）
+DEFAULT_CONTEXT = {
+    '人流量': '一般',
+    '天氣': '晴天',
+    '停車狀況': '一般',
+    '當下溫度': 28,
+    '貨架上庫存量': 3,
+}
+CONTEXT_COLUMNS = list(DEFAULT_CONTEXT)
+DEFAULT_KEY = "*"
+
+# market_context 表欄位 -> 特徵名稱
+TABLE_COLUMNS = {
+    'Traffic': '人流量',
+    'Weather': '天氣',
+    'Parking': '停車狀況',
+    'Temperature': '當下溫度',
+    'ShelfStock': '貨架上庫存量',
+}
+CONTEXT_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS market_context (
+        Market VARCHAR(100) NOT NULL PRIMARY KEY,
+        Traffic VARCHAR(10) NULL,
+        Weather VARCHAR(10) NULL,
+        Parking VARCHAR(10) NULL,
+        Temperature DECIMAL(4,1) NULL,
+        ShelfStock INT NULL,
+        UpdatedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+"""
+
+
+def clean_context(values):
+    """只保留認得的欄位與合法的值"""
+    out = {}
+    for col, value in (values or {}).items():
+        if col not in DEFAULT_CONTEXT or value is None:
+            continue
+        if col in CONTEXT_VALUES:
+            if value not in CONTEXT_VALUES[col]:
+                diagnostics.warning("情境欄位 %s 的值 %s 不合法，忽略", col, value)
+                continue
+            out[col] = value
+        else:
+            try:
+                out[col] = float(value)
+            except (TypeError, ValueError):
+                diagnostics.warning("情境欄位 %s 的值 %s 不是數字，忽略", col, value)
+    return out
+
+
+class FileSource:
+    def __init__(self, path=CONTEXT_FILE):
+        self.path = path
+
+    def load(self, markets):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        return {m: data[m] for m in list(markets) + [DEFAULT_KEY] if m in data}
+
+
+class TableSource:
+    def __init__(self, db):
+        self.db = db
+
+    def load(self, markets):
+        keys = list(markets) + [DEFAULT_KEY]
+        with self.db.cursor() as cur:
+            cur.execute(
+                f"SELECT Market, {', '.join(TABLE_COLUMNS)} FROM market_context "
+                f"WHERE Market IN ({', '.join(['%s'] * len(keys))})",
+                tuple(keys),
+            )
+            rows = cur.fetchall()
+        return {row[0]: dict(zip(TABLE_COLUMNS.values(), row[1:])) for row in rows}
+
+
+class ContextProvider:
+    def __init__(self, source=None, ttl=CONTEXT_TTL):
+        self.source = source or FileSource()
+        self.ttl = ttl
+        self._cache = {}  # market -> (取得時間, 情境 dict)
+        self._lock = threading.Lock()
+
+    def set_source(self, source):
+        with self._lock:
+            self.source = source
+            self._cache.clear()
+
+    def snapshot(self, markets):
+        """
+        回傳 {market: 情境 dict}；過期或沒快取的賣場一次向來源取回
+        來源失敗時沿用舊快照，再不行就用預設情境
+        """
+        markets = list(dict.fromkeys(markets))
+        now = time.monotonic()
+        with self._lock:
+            stale = [m for m in markets if m not in self._cache or now - self._cache[m][0] > self.ttl]
+        if stale:
+            try:
+                loaded = self.source.load(stale)
+                diagnostics.incr('context.fetch')
+            except Exception as e:
+                diagnostics.error("讀取賣場情境失敗: %s", e)
+                loaded = None
+            if loaded is not None:
+                base = {**DEFAULT_CONTEXT, **clean_context(loaded.get(DEFAULT_KEY))}
+                with self._lock:
+                    for m in stale:
+                        self._cache[m] = (now, {**base, **clean_context(loaded.get(m))})
+        with self._lock:
+            return {m: dict(self._cache[m][1]) if m in self._cache else dict(DEFAULT_CONTEXT) for m in markets}
+
+    def frame(self, markets):
+        """
+        markets: 每列的賣場（Series，可為 None）
+        回傳與 markets 同 index、欄位為 CONTEXT_COLUMNS 的 DataFrame
+        """
+        keys = markets.fillna(DEFAULT_KEY).astype(str)
+        snapshots = self.snapshot(keys.unique())
+        table = pd.DataFrame.from_dict(snapshots, orient='index')[CONTEXT_COLUMNS]
+        out = table.reindex(keys.to_numpy())
+        out.index = markets.index
+        return out
+
+    def invalidate(self, market=None):
+        with self._lock:
+            if market is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(market, None)
+
+
+def write_snapshot(path, market, values):
+    """寫入（合併）一個賣場的情境到 JSON 檔；給本機模擬或排程使用"""
+    data = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    data[market] = {**data.get(market, {}), **clean_context(values)}
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return data[market]
+
+
+if __name__ == "__main__":
+    # python context_provider.py set <Market|*> 人流量=多 天氣=雨天 當下溫度=31
+    if len(sys.argv) < 4 or sys.argv[1] != "set":
+        print("用法: python context_provider.py set <Market|*> 欄位=值 ...")
+        sys.exit(1)
+    pairs = dict(arg.split("=", 1) for arg in sys.argv[3:])
+    print(write_snapshot(CONTEXT_FILE, sys.argv[2], pairs))
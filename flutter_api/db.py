@@ -0,0 +1,440 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+import MySQLdb
+
+import diagnostics
+from db_config import db_config
+
+# ----------------- 資料庫存取層 -----------------
+# 所有 route / 背景工作都從這裡拿連線，不再各自 mysql.connection.cursor()
+# 連線池有上限（DB_POOL_SIZE），借不到連線時最多等 DB_POOL_TIMEOUT 秒，逾時丟 PoolTimeout
+# 閒置超過 DB_POOL_RECYCLE 秒的連線借出前先 ping，斷線就換一條新的
+# 連線歸還時一律 rollback：沒提交的寫入不會漏到下一個使用者，
+# 也結束 REPEATABLE READ 的讀取快照，下一次借出看得到別人剛寫入的資料
+#
+# 用法：
+#   with db.cursor() as cur:        # 只讀；結束時關閉 cursor、歸還連線
+#   with db.transaction() as cur:   # 正常結束 commit，例外 rollback
+#   with db.connection() as conn:   # 需要自己控制交易（write_prices、migrate、GET_LOCK）
+#
+# 指標（diagnostics）：db.pool_wait（借連線等待時間）、db.query（每個 execute 的延遲）、
+#                      db.connect / db.reconnect / db.pool_timeout 次數
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 5))
+DB_POOL_RECYCLE = float(os.environ.get("DB_POOL_RECYCLE", 300))
+DB_SLOW_QUERY = float(os.environ.get("DB_SLOW_QUERY", 0.5))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class TimedCursor:
+    """包一層 cursor，記錄每次 execute 的延遲；其餘屬性（fetchall、lastrowid ...）直接轉給原 cursor"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _timed(self, method, sql, params):
+        start = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            diagnostics.record_timing('db.query', elapsed)
+            if elapsed > DB_SLOW_QUERY:
+                diagnostics.warning("慢查詢 %.3fs: %s", elapsed, " ".join(sql.split())[:120])
+
+    def execute(self, sql, params=None):
+        return self._timed(self._cursor.execute, sql, params)
+
+    def executemany(self, sql, rows):
+        return self._timed(self._cursor.executemany, sql, rows)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class Database:
+    def __init__(self, config=None, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, recycle=DB_POOL_RECYCLE):
+        self.config = config or db_config
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        # LIFO：最近用過的連線先借出，最不容易是已被 server 斷掉的閒置連線
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._open = 0
+        self._in_use = 0
+
+    def _connect(self):
+        conn = MySQLdb.connect(
+            host=self.config['host'], user=self.config['user'], password=self.config['password'],
+            database=self.config['database'], charset="utf8mb4", autocommit=False,
+        )
+        with self._lock:
+            self._open += 1
+        diagnostics.incr('db.connect')
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._open -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            diagnostics.incr('db.pool_timeout')
+            raise PoolTimeout(f"等待資料庫連線逾時（{self.timeout}s，連線池上限 {self.size}）")
+        diagnostics.record_timing('db.pool_wait', time.perf_counter() - start)
+        try:
+            conn = None
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if conn is not None and time.monotonic() - last_used > self.recycle:
+                try:
+                    conn.ping()
+                except MySQLdb.Error:
+                    diagnostics.incr('db.reconnect')
+                    self._discard(conn)
+                    conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+        return conn
+
+    def _checkin(self, conn, broken):
+        try:
+            if broken:
+                self._discard(conn)
+            else:
+                try:
+                    conn.rollback()
+                    self._idle.put((conn, time.monotonic()))
+                except MySQLdb.Error:
+                    self._discard(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """借一條連線，結束時 rollback 未提交的內容後歸還；連線層錯誤則直接丟棄"""
+        conn = self._checkout()
+        broken = False
+        try:
+            yield conn
+        except MySQLdb.OperationalError:
+            broken = True
+            raise
+        finally:
+            self._checkin(conn, broken)
+
+    @contextmanager
+    def cursor(self):
+        with self.connection() as conn:
+            cur = TimedCursor(conn.cursor())
+            try:
+                yield cur
+            finally:
+                cur.close()
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            cur = TimedCursor(conn.cursor())
+            try:
+                yield cur
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+            }
+
+    def close(self):
+        """關閉所有閒置連線（借出中的歸還後仍會留在池裡）"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+
+# ----------------- 商品 -----------------
+# 修改商品內容時 Rev +1（見 repricing.py），/get_products 的 ETag 依此判斷
+# INSERT 的 VALUES 必須全部是 %s：mysqlclient 的 executemany 只有這樣才會合併成單一多列語句，
+# 夾雜常數（1、NOW()）時會退回逐筆送出
+PRODUCT_INSERT_SQL = """
+    INSERT INTO product (ProName, ExpireDate, Price, ProPrice, Market, Status, ProductType, ImagePath, PriceDirty)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+PRODUCT_UPDATE_FIELDS = ["ProName", "ExpireDate", "Price", "ProPrice", "Market", "Status", "ProductType", "ImagePath"]
+PRODUCT_DELETE_SQL = "DELETE FROM product WHERE ProductID=%s"
+PRODUCT_BRIEF_SQL = "SELECT Market, ProductType, ExpireDate, Reason FROM product WHERE ProductID=%s"
+
+# 推薦：合理價的商品推薦其他類別，不合理的推薦同類別中合理的
+# 只取前端（adviceproduct.dart）會用到的欄位
+RECOMMEND_COLUMNS = ["ProductID", "ProName", "ProPrice", "ExpireDate", "ImagePath"]
+RECOMMEND_OTHER_TYPE_SQL = f"""
+    SELECT {", ".join(RECOMMEND_COLUMNS)}
+    FROM product
+    WHERE Market=%s
+    AND ExpireDate <= %s
+    AND Reason='合理'
+    AND Status='未過期'
+    AND ProductType != %s
+    ORDER BY ExpireDate ASC, ProPrice ASC
+    LIMIT 6
+"""
+RECOMMEND_SAME_TYPE_SQL = f"""
+    SELECT {", ".join(RECOMMEND_COLUMNS)}
+    FROM product
+    WHERE Market=%s
+    AND ExpireDate <= %s
+    AND ProductType=%s
+    AND Reason='合理'
+    AND Status='未過期'
+    ORDER BY ExpireDate DESC, ProPrice ASC
+    LIMIT 6
+"""
+
+
+def product_params(record):
+    return (
+        record["ProName"],
+        record["ExpireDate"],
+        record["Price"],
+        record["ProPrice"],
+        record["Market"],
+        record["Status"],
+        record["ProductType"],
+        record["ImagePath"],
+        1,  # PriceDirty：新商品待定價
+    )
+
+
+def insert_product(cur, record):
+    """新增一筆商品（標記為待定價），回傳 ProductID"""
+    cur.execute(PRODUCT_INSERT_SQL, product_params(record))
+    return cur.lastrowid
+
+
+def insert_products(cur, records):
+    """
+    多筆商品以一個多列 INSERT 寫入，回傳各筆的 ProductID（與 records 同順序）
+    executemany 會把 INSERT 合併成單一多列語句（見 PRODUCT_INSERT_SQL 的說明，tests/test_db.py 檢查）；一個語句配置到的 AUTO_INCREMENT
+    依 @@auto_increment_increment 間隔遞增，但 innodb_autoinc_lock_mode=2（8.0 預設）下
+    MySQL 不保證一定連續，所以算出 id 後在同一個交易內讀回確認是這批寫入的列；
+    對不上時退回 savepoint 改成逐筆 INSERT（各自的 lastrowid 一定正確）
+    """
+    if not records:
+        return []
+    params = [product_params(r) for r in records]
+    cur.execute("SAVEPOINT insert_products")
+    cur.executemany(PRODUCT_INSERT_SQL, params)
+    first_id = cur.lastrowid
+    cur.execute("SELECT @@auto_increment_increment")
+    step = cur.fetchone()[0]
+    ids = [first_id + offset * step for offset in range(len(records))]
+
+    cur.execute(
+        f"SELECT ProductID, ProName, ImagePath FROM product WHERE ProductID IN ({', '.join(['%s'] * len(ids))})",
+        tuple(ids),
+    )
+    found = {row[0]: tuple(row[1:]) for row in cur.fetchall()}
+    if any(found.get(pid) != (r["ProName"], r["ImagePath"]) for pid, r in zip(ids, records)):
+        diagnostics.warning("多列 INSERT 的 ProductID 不連續，改為逐筆寫入")
+        cur.execute("ROLLBACK TO SAVEPOINT insert_products")
+        ids = []
+        for p in params:
+            cur.execute(PRODUCT_INSERT_SQL, p)
+            ids.append(cur.lastrowid)
+    cur.execute("RELEASE SAVEPOINT insert_products")
+    return ids
+
+
+def update_product(cur, product_id, fields):
+    """只更新 PRODUCT_UPDATE_FIELDS 中的欄位、Rev +1 並標記為需要重新定價，回傳影響筆數"""
+    fields = {k: v for k, v in fields.items() if k in PRODUCT_UPDATE_FIELDS}
+    set_clause = ", ".join(f"{k}=%s" for k in fields)
+    cur.execute(f"UPDATE product SET {set_clause}, PriceDirty=1, Rev=Rev+1 WHERE ProductID=%s",
+                list(fields.values()) + [product_id])
+    return cur.rowcount
+
+
+def delete_product(cur, product_id):
+    """回傳刪除筆數（0 = 商品不存在）"""
+    cur.execute(PRODUCT_DELETE_SQL, (product_id,))
+    return cur.rowcount
+
+
+def product_brief(cur, product_id):
+    """(Market, ProductType, ExpireDate, Reason)，找不到時為 None"""
+    cur.execute(PRODUCT_BRIEF_SQL, (product_id,))
+    return cur.fetchone()
+
+
+def recommend_products(cur, market, product_type, expire_date, same_type):
+    """回傳 list of dict（欄位為 RECOMMEND_COLUMNS）"""
+    cur.execute(RECOMMEND_SAME_TYPE_SQL if same_type else RECOMMEND_OTHER_TYPE_SQL,
+                (market, expire_date, product_type))
+    return [dict(zip(RECOMMEND_COLUMNS, row)) for row in cur.fetchall()]
+
+
+# ----------------- 歷史紀錄 -----------------
+HISTORY_INSERT_SQL = "INSERT INTO history (userID, productID, created_at) VALUES (%s, %s, NOW())"
+# 批次版：created_at 也用參數（同一批取一次資料庫的 NOW()），executemany 才會合併成單一語句
+HISTORY_BATCH_INSERT_SQL = "INSERT INTO history (userID, productID, created_at) VALUES (%s, %s, %s)"
+HISTORY_FIND_SQL = "SELECT id FROM history WHERE userID=%s AND productID=%s"
+HISTORY_DELETE_SQL = "DELETE FROM history WHERE id=%s"
+# /get_products 回傳欄位 -> SQL 運算式；fields= 只選其中一部分時，SELECT 也只取那些欄位
+HISTORY_FIELDS = {
+    'ProductID': 'p.ProductID',
+    'ProductType': 'p.ProductType',
+    'ProName': 'p.ProName',
+    'ProPrice': 'p.ProPrice',
+    'ScanDate': 'h.created_at',
+    'ExpireDate': 'p.ExpireDate',
+    'Status': 'p.Status',
+    'Market': 'p.Market',
+    'ImagePath': 'p.ImagePath',
+    'HistoryID': 'h.id',
+    'AiPrice': 'p.AiPrice',
+}
+HISTORY_DATE_FIELDS = ('ScanDate', 'ExpireDate')
+
+
+def add_history(cur, user_id, product_id):
+    cur.execute(HISTORY_INSERT_SQL, (user_id, product_id))
+    return cur.lastrowid
+
+
+def add_histories(cur, user_id, product_ids):
+    if not product_ids:
+        return
+    cur.execute("SELECT NOW()")
+    now = cur.fetchone()[0]
+    cur.executemany(HISTORY_BATCH_INSERT_SQL, [(user_id, pid, now) for pid in product_ids])
+
+
+def find_history(cur, user_id, product_id):
+    """同一使用者對同一商品的紀錄 id，沒有時為 None"""
+    cur.execute(HISTORY_FIND_SQL, (user_id, product_id))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def delete_history(cur, history_id):
+    """回傳刪除筆數（0 = 紀錄不存在）"""
+    cur.execute(HISTORY_DELETE_SQL, (history_id,))
+    return cur.rowcount
+
+
+def user_history(cur, user_id, fields=None, name_clause=None, day=None, after=None, limit=None):
+    """
+    使用者的歷史紀錄（新到舊，同一時間依 id 由大到小）
+    fields: HISTORY_FIELDS 的子集合，預設全部
+    name_clause: (SQL 片段, 參數)，見 schema.name_search_clause
+    day: datetime，只取當天；以區間比較，才能用到 (userID, created_at) 索引
+    after: (created_at, id) 上一頁最後一筆，keyset 分頁從它之後開始
+    limit: 這頁筆數，None = 全部
+    回傳 (list of dict, 最後一筆的 (created_at, id)；沒有資料時為 None, 這頁的版本)
+    版本為這頁每一筆的 (history id, 商品 Rev)：這頁的紀錄增減、其中商品被修改 / 刪除 / 重新定價後價格有變
+    都會改變；只由這頁本身的列算出，不另外掃描使用者全部的歷史紀錄
+    """
+    fields = list(fields or HISTORY_FIELDS)
+    # 前三欄固定是分頁 key 與商品修訂號
+    query = (
+        f"SELECT h.created_at, h.id, p.Rev, {', '.join(HISTORY_FIELDS[f] for f in fields)} "
+        "FROM history h JOIN product p ON h.productID = p.ProductID WHERE h.userID = %s"
+    )
+    params = [user_id]
+    if name_clause:
+        clause, value = name_clause
+        query += f" AND {clause}"
+        params.append(value)
+    if day is not None:
+        query += " AND h.created_at >= %s AND h.created_at < %s"
+        params.extend([day, day + timedelta(days=1)])
+    if after is not None:
+        query += " AND (h.created_at < %s OR (h.created_at = %s AND h.id < %s))"
+        params.extend([after[0], after[0], after[1]])
+    query += " ORDER BY h.created_at DESC, h.id DESC"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    cur.execute(query, tuple(params))
+    rows = cur.fetchall()
+
+    records = []
+    for row in rows:
+        record = dict(zip(fields, row[3:]))
+        for f in HISTORY_DATE_FIELDS:
+            if f in record:
+                record[f] = record[f].strftime('%Y-%m-%d') if record[f] else None
+        records.append(record)
+    version = tuple((row[1], row[2]) for row in rows)
+    return records, (tuple(rows[-1][:2]) if rows else None), version
+
+
+# ----------------- 會員 -----------------
+USER_COLUMNS = ["id", "name", "phone", "email"]
+USER_UPDATE_FIELDS = ["name", "email", "phone", "password"]
+USER_INSERT_SQL = "INSERT INTO users (name, phone, email, password) VALUES (%s, %s, %s, %s)"
+USER_LOGIN_SQL = "SELECT id, name, phone, email FROM users WHERE email=%s AND password=%s"
+USER_SELECT_SQL = "SELECT id, name, phone, email FROM users WHERE id=%s"
+
+
+def user_dict(row):
+    return dict(zip(USER_COLUMNS, row)) if row else None
+
+
+def create_user(cur, name, phone, email, password):
+    cur.execute(USER_INSERT_SQL, (name, phone, email, password))
+    return cur.lastrowid
+
+
+def find_user_by_login(cur, email, password):
+    cur.execute(USER_LOGIN_SQL, (email, password))
+    return user_dict(cur.fetchone())
+
+
+def get_user(cur, user_id):
+    cur.execute(USER_SELECT_SQL, (user_id,))
+    return user_dict(cur.fetchone())
+
+
+def update_user(cur, user_id, fields):
+    fields = {k: v for k, v in fields.items() if k in USER_UPDATE_FIELDS}
+    set_clause = ", ".join(f"{k}=%s" for k in fields)
+    cur.execute(f"UPDATE users SET {set_clause} WHERE id=%s", list(fields.values()) + [user_id])
+    return cur.rowcount
@@ -0,0 +1,159 @@
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# ----------------- 診斷輸出與效能指標 -----------------
+# DIAG_LEVEL       : DEBUG / INFO / WARNING / ERROR / OFF（預設 INFO）
+# DIAG_SAMPLE_RATE : DEBUG 層級的大型摘要（DataFrame 內容、describe 等）取樣比例，0~1（預設 1）
+# dump() 只接受 callable，關閉或沒被取樣時完全不會計算摘要
+
+LEVELS = {
+    'DEBUG': logging.DEBUG,
+    'INFO': logging.INFO,
+    'WARNING': logging.WARNING,
+    'ERROR': logging.ERROR,
+    'OFF': logging.CRITICAL + 10,
+}
+
+logger = logging.getLogger("dynamic_pricing")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    logger.addHandler(_handler)
+    logger.propagate = False
+
+_sample_rate = 1.0
+_local = threading.local()
+_metrics_lock = threading.Lock()
+_timings = {}
+_counters = {}
+
+
+def configure(level=None, sample_rate=None):
+    """設定診斷層級與取樣比例"""
+    global _sample_rate
+    if level is not None:
+        logger.setLevel(LEVELS.get(str(level).upper(), logging.INFO))
+    if sample_rate is not None:
+        _sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+
+
+configure(os.environ.get("DIAG_LEVEL", "INFO"), os.environ.get("DIAG_SAMPLE_RATE", 1.0))
+
+
+def enabled(level):
+    return logger.isEnabledFor(LEVELS[level])
+
+
+def log(level, msg, *args):
+    if enabled(level):
+        logger.log(LEVELS[level], msg, *args)
+
+
+def info(msg, *args):
+    log('INFO', msg, *args)
+
+
+def warning(msg, *args):
+    log('WARNING', msg, *args)
+
+
+def error(msg, *args):
+    log('ERROR', msg, *args)
+
+
+@contextmanager
+def sampling(value=None):
+    """
+    一次呼叫（例如一次定價）只決定一次是否取樣，期間所有 dump() 結果一致
+    value: 沿用已經決定好的結果（例如主 process 決定後傳給 worker process）
+    """
+    prev = getattr(_local, 'sampled', None)
+    _local.sampled = (enabled('DEBUG') and random.random() < _sample_rate) if value is None else value
+    try:
+        yield _local.sampled
+    finally:
+        _local.sampled = prev
+
+
+def sampled():
+    value = getattr(_local, 'sampled', None)
+    if value is None:
+        return enabled('DEBUG') and random.random() < _sample_rate
+    return value
+
+
+def dump(label, compute):
+    """
+    DEBUG 摘要：compute 為 callable，只有在 DEBUG 開啟且被取樣時才會執行
+    """
+    if not sampled():
+        return
+    try:
+        value = compute()
+    except Exception as e:
+        value = f"<摘要計算失敗: {e}>"
+    logger.debug("%s\n%s", label, value)
+
+
+# ----------------- 指標 -----------------
+def record_timing(name, seconds):
+    with _metrics_lock:
+        m = _timings.get(name)
+        if m is None:
+            m = _timings[name] = {'count': 0, 'total_s': 0.0, 'max_s': 0.0, 'last_s': 0.0}
+        m['count'] += 1
+        m['total_s'] += seconds
+        m['max_s'] = max(m['max_s'], seconds)
+        m['last_s'] = seconds
+
+
+def incr(name, n=1):
+    with _metrics_lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+@contextmanager
+def stage(name):
+    """計時一個處理階段（feature_prep / inference / reason / db_write ...）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        record_timing(name, elapsed)
+        log('DEBUG', "stage %s: %.4fs", name, elapsed)
+
+
+def snapshot():
+    """目前的指標快照（給 /metrics 使用）"""
+    with _metrics_lock:
+        timings = {
+            name: {**m, 'avg_s': m['total_s'] / m['count'] if m['count'] else 0.0}
+            for name, m in _timings.items()
+        }
+        return {'timings': timings, 'counters': dict(_counters)}
+
+
+def merge(other):
+    """併入另一個 process 的 snapshot()（例如重新定價 worker 回傳的指標）"""
+    with _metrics_lock:
+        for name, t in other['timings'].items():
+            m = _timings.get(name)
+            if m is None:
+                m = _timings[name] = {'count': 0, 'total_s': 0.0, 'max_s': 0.0, 'last_s': 0.0}
+            m['count'] += t['count']
+            m['total_s'] += t['total_s']
+            m['max_s'] = max(m['max_s'], t['max_s'])
+            m['last_s'] = t['last_s']
+        for name, n in other['counters'].items():
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def reset():
+    with _metrics_lock:
+        _timings.clear()
+        _counters.clear()
@@ -0,0 +1,115 @@
+import os
+
+import cv2
+import numpy as np
+
+# ----------------- OCR 前處理 -----------------
+# 手機原圖（約 12MP）直接送進 PaddleOCR，大部分時間花在整張圖的文字偵測上
+# 前處理全部在記憶體中完成，不需先把原圖寫到磁碟：
+#   OCR_LONG_EDGE : 長邊縮到多少像素（0 = 不縮放）
+#   OCR_GRAYSCALE : 1 = 轉灰階
+#   OCR_CROP      : none / auto（自動找價格貼紙區域）/ x0,y0,x1,y1（相對座標 0~1）
+# 預設全部關閉，OCR 輸入與原本相同；benchmarks/bench_ocr_preprocess.py 確認
+# extract_product_info 準確率不變後，再依結果設定環境變數開啟
+
+OCR_LONG_EDGE = int(os.environ.get("OCR_LONG_EDGE", 0))
+OCR_GRAYSCALE = os.environ.get("OCR_GRAYSCALE", "0") == "1"
+OCR_CROP = os.environ.get("OCR_CROP", "none")
+
+# 自動裁切：在縮圖上找貼紙，貼紙面積需佔畫面一定比例才採用
+_DETECT_EDGE = 512
+_MIN_REGION_RATIO = 0.02
+_REGION_PADDING = 0.05
+
+
+def decode(data):
+    """bytes -> BGR 影像"""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("無法解析圖片")
+    return image
+
+
+def resize_long_edge(image, long_edge):
+    h, w = image.shape[:2]
+    scale = long_edge / max(h, w)
+    if not long_edge or scale >= 1:
+        return image
+    return cv2.resize(image, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+
+
+def parse_crop(crop):
+    """'x0,y0,x1,y1' -> tuple；none / auto 原樣回傳"""
+    if crop in (None, "", "none", "auto"):
+        return crop or "none"
+    x0, y0, x1, y1 = (float(v) for v in crop.split(","))
+    if not (0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1):
+        raise ValueError(f"OCR_CROP 範圍錯誤: {crop}")
+    return x0, y0, x1, y1
+
+
+def enabled():
+    """是否有任何前處理步驟開啟"""
+    return bool(OCR_LONG_EDGE) or OCR_GRAYSCALE or parse_crop(OCR_CROP) != "none"
+
+
+def find_sticker_region(image):
+    """
+    找出最大的明亮矩形區域（白 / 黃底價格貼紙），回傳相對座標 (x0, y0, x1, y1)
+    找不到時回傳 None
+    """
+    small = resize_long_edge(image, _DETECT_EDGE)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, mask = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # 把貼紙上的文字補起來，讓貼紙成為一整塊
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    sh, sw = small.shape[:2]
+    if w * h < _MIN_REGION_RATIO * sw * sh or (w >= sw * 0.98 and h >= sh * 0.98):
+        return None
+
+    pad_x, pad_y = w * _REGION_PADDING, h * _REGION_PADDING
+    return (
+        max(0.0, (x - pad_x) / sw),
+        max(0.0, (y - pad_y) / sh),
+        min(1.0, (x + w + pad_x) / sw),
+        min(1.0, (y + h + pad_y) / sh),
+    )
+
+
+def crop_relative(image, box):
+    h, w = image.shape[:2]
+    x0, y0, x1, y1 = box
+    return image[int(y0 * h):int(np.ceil(y1 * h)), int(x0 * w):int(np.ceil(x1 * w))]
+
+
+def preprocess(data, long_edge=None, grayscale=None, crop=None):
+    """
+    圖片 bytes（或已解碼的 BGR 影像）-> 給 PaddleOCR 的 3 通道影像
+    參數未指定時使用環境變數設定
+    """
+    long_edge = OCR_LONG_EDGE if long_edge is None else long_edge
+    grayscale = OCR_GRAYSCALE if grayscale is None else grayscale
+    crop = parse_crop(OCR_CROP if crop is None else crop)
+
+    image = decode(data) if isinstance(data, (bytes, bytearray, memoryview)) else data
+
+    if crop == "auto":
+        box = find_sticker_region(image)
+        if box is not None:
+            image = crop_relative(image, box)
+    elif crop != "none":
+        image = crop_relative(image, crop)
+
+    image = resize_long_edge(image, long_edge)
+
+    if grayscale:
+        # PaddleOCR 需要 3 通道輸入
+        image = cv2.cvtColor(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)
+    return image
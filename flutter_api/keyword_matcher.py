@@ -0,0 +1,87 @@
+from collections import deque
+
+# ----------------- 多關鍵字比對（Aho-Corasick） -----------------
+# 所有分類的關鍵字建成一個自動機，每行文字只掃一次就知道命中哪些分類
+# 分類依傳入順序決定優先權（第 0 個最優先），與原本依序 any(k in line ...) 的結果相同
+# 會找出所有重疊的命中（例如「水果盤」同時命中「果」與「水果盤」）
+
+
+class KeywordMatcher:
+    def __init__(self, categories):
+        """
+        categories: [(分類名稱, [關鍵字, ...]), ...]，順序即優先權
+        """
+        self.labels = [label for label, _ in categories]
+        # 每個節點：子節點 dict、fail link、命中的分類 bitmask
+        self._children = [{}]
+        self._fail = [0]
+        self._output = [0]
+
+        for index, (_, keywords) in enumerate(categories):
+            for keyword in keywords:
+                if keyword:
+                    self._add(keyword, 1 << index)
+        self._build_links()
+
+    def _add(self, keyword, bit):
+        node = 0
+        for ch in keyword:
+            nxt = self._children[node].get(ch)
+            if nxt is None:
+                nxt = len(self._children)
+                self._children[node][ch] = nxt
+                self._children.append({})
+                self._fail.append(0)
+                self._output.append(0)
+            node = nxt
+        self._output[node] |= bit
+
+    def _build_links(self):
+        queue = deque(self._children[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._children[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._children[fail]:
+                    fail = self._fail[fail]
+                target = self._children[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                # 後綴命中的分類也算進來
+                self._output[child] |= self._output[self._fail[child]]
+
+    def _scan(self, text, stop_mask):
+        children, fail, output = self._children, self._fail, self._output
+        node = 0
+        mask = 0
+        for ch in text:
+            while node and ch not in children[node]:
+                node = fail[node]
+            node = children[node].get(ch, 0)
+            if output[node]:
+                mask |= output[node]
+                if mask & stop_mask:
+                    break
+        return mask
+
+    def match_mask(self, text):
+        """命中分類的 bitmask（第 i 個分類對應 1 << i）"""
+        if not text:
+            return 0
+        return self._scan(text, 0)
+
+    def matches_any(self, text):
+        """是否命中任一關鍵字"""
+        if not text:
+            return False
+        return self._scan(text, -1) != 0
+
+    def classify(self, text, default=None):
+        """回傳優先權最高的命中分類，沒有命中則回傳 default"""
+        if not text:
+            return default
+        # 最優先的分類一命中就可以停止
+        mask = self._scan(text, 1)
+        if not mask:
+            return default
+        return self.labels[(mask & -mask).bit_length() - 1]
@@ -1,192 +1,277 @@
+import os
 import pandas as pd
-import joblib
 import numpy as np
 import pytz
-import random
+from repricing import reprice_after
+import diagnostics
+from model_server import ModelRegistry, ModelHandle
+from pricing_engines import RuleEngine
+from price_table import PriceTable, PRICE_TABLE_ENABLED
+from context_provider import ContextProvider, CONTEXT_COLUMNS
 
 # ----------------- 模型載入 -----------------
-try:
-    model = joblib.load("random_forest_model.pkl")
-    feature_cols = model.feature_names_in_  # ⚡ 全域
-    print("已載入真實模型")
-except Exception as e:
-    print("無法載入模型，改用 FakeModel:", e)
-    feature_cols = ['剩餘保存期限_小時','原價',
-                    '人流量_少', '人流量_一般', '人流量_多',
-                    '天氣_晴天', '天氣_陰天', '天氣_雨天',
-                    '停車狀況_少', '停車狀況_一般', '停車狀況_多',
-                    '商品大類_肉類','商品大類_魚類','商品大類_蔬果類','商品大類_其他']
-    class FakeModel:
-        def predict(self, X):
-            values = np.random.rand(len(X)) * 0.5
-            print("🔍 FakeModel 輸出:", values)
-            return values
-    model = FakeModel()
+# 模型由 model_server 管理（版本化、熱更新）；沒有模型可載入時改用規則引擎定價
+# PRICING_ENGINE=model（預設）使用 MODEL_DIR 上線的 artifact（forest / gbm / linear 皆可）
+# PRICING_ENGINE=rules 固定使用規則引擎，不載入模型
+PRICING_ENGINE = os.environ.get("PRICING_ENGINE", "model")
+FALLBACK_FEATURE_COLS = ['剩餘保存期限_小時','原價',
+                         '人流量_少', '人流量_一般', '人流量_多',
+                         '天氣_晴天', '天氣_陰天', '天氣_雨天',
+                         '停車狀況_少', '停車狀況_一般', '停車狀況_多',
+                         '商品大類_肉類','商品大類_魚類','商品大類_蔬果類','商品大類_麵包甜點類',
+                         '商品大類_豆製品類','商品大類_熟食/其他','商品大類_其他']
 
-def clean_column_names(df):
-    df = df.copy()
-    df.columns = df.columns.str.replace(r'\s+', '', regex=True)
-    return df
 
-def prepare_features(df):
-    df = df.copy()
-    
-    
-    df['ProName'] = df.get('ProName', '未知商品')
-    df['price'] = pd.to_numeric(df.get('price', 0), errors='coerce').fillna(0).astype(float)
-    df['ProPrice'] = pd.to_numeric(df.get('ProPrice', 0), errors='coerce').fillna(0).astype(float)
+RULES_VERSION = "rules"
 
-    df['原價'] = df['price']  
 
-    local_tz = 'Asia/Taipei'
+def rules_handle():
+    return ModelHandle(RULES_VERSION, RuleEngine(), FALLBACK_FEATURE_COLS)
 
-    # 當下時間
-    now_utc = pd.Timestamp.now(tz='UTC')
-    expire = pd.to_datetime(df.get('ExpireDate'), errors='coerce')
-    expire = expire.apply(
-        lambda x: x + pd.Timedelta(hours=23, minutes=59, seconds=59)
-        if pd.notna(x) and x.hour == 0 and x.minute == 0 and x.second == 0
-        else x
-    )
 
-    def localize_to_taipei(ts):
-        if pd.isna(ts):
-            return pd.NaT
-        try:
-            if ts.tzinfo is None:
-                return ts.tz_localize(local_tz, ambiguous='NaT', nonexistent='NaT')
-            return ts.tz_convert(local_tz)
-        except Exception:
-            return pd.NaT
+registry = ModelRegistry(fallback=rules_handle)
+_rules = rules_handle() if PRICING_ENGINE == "rules" else None
+_fallback_rules = None
 
-    expire = expire.apply(localize_to_taipei)
 
-    mask_nat = expire.isna()
-    if mask_nat.any():
-        fallback = pd.to_datetime(df.loc[mask_nat, 'ExpireDate'], errors='coerce')
-        fallback = fallback.dt.tz_localize(local_tz, ambiguous='NaT', nonexistent='NaT')
-        expire = expire.combine_first(fallback)
+# 各賣場的情境快照（來源見 context_provider）
+contexts = ContextProvider()
 
-    expire = expire.dt.tz_convert('UTC')
+# 熱門 (類別, 情境) 的折扣表（PRICE_TABLE=1 開啟），由背景執行緒建表，模型版本改變時自動清空
+price_table = PriceTable() if PRICE_TABLE_ENABLED else None
 
-    delta_hours = (expire - now_utc).dt.total_seconds() / 3600
-    df['剩餘保存期限_小時'] = delta_hours.clip(lower=0).fillna(0)
 
-    def format_remaining_time(expire_ts, now_ts):
-        if pd.isna(expire_ts):
-            return "未知"
-        delta = expire_ts - now_ts
-        if delta.total_seconds() <= 0:
-            return "已過期"
-        days = delta.days
-        hours, remainder = divmod(delta.seconds, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        return f"{days}天 {hours}小時 {minutes}分 {seconds}秒"
+def start_price_table():
+    """啟動折扣表的背景建表（沒有開啟時不做事）；app 與重新定價的 worker process 各自呼叫"""
+    if price_table is not None:
+        price_table.start()
 
-    df['剩餘時間_可讀'] = expire.apply(lambda x: format_remaining_time(x, now_utc))
 
-    print("剩餘時間檢查（台北時區）:")
-    print(df[['ProName', 'ExpireDate', '剩餘保存期限_小時', '剩餘時間_可讀']])
+def current_engine():
+    """目前用來定價的 ModelHandle"""
+    if _rules is not None:
+        return _rules
+    return registry.current()
 
 
+def engine_for(version):
+    """
+    指定版本的 ModelHandle：重新定價的 worker process 用主 process 鎖定的版本定價，
+    不自己跟著 CURRENT 走（POST /model/reload 指定的版本只會改到主 process）
+    """
+    global _fallback_rules
+    if _rules is not None:
+        return _rules
+    if version == RULES_VERSION:
+        # 主 process 沒有模型可載入，退回規則引擎
+        if _fallback_rules is None:
+            _fallback_rules = rules_handle()
+        return _fallback_rules
+    return registry.get(version)
+
+
+def engine_stats():
+    """各模型版本的推論統計（給 /model）"""
+    if _rules is not None:
+        return {"engine": PRICING_ENGINE, "current": _rules.version, "versions": [_rules.stats()]}
+    stats = {"engine": PRICING_ENGINE, **registry.stats()}
+    if price_table is not None:
+        stats["price_table"] = price_table.stats()
+    return stats
+
+
+def get_feature_cols():
+    """目前上線模型的特徵欄位"""
+    return current_engine().feature_cols
 
+def clean_column_names(df):
+    df = df.copy()
+    df.columns = df.columns.str.replace(r'\s+', '', regex=True)
+    return df
+
+ONE_HOT_PREFIXES = ['人流量', '天氣', '停車狀況', '商品大類']
+LOCAL_TZ = 'Asia/Taipei'
+
+
+def one_hot_schema(cols):
+    """依 feature_cols 建立 {類別欄位: ([one-hot 欄名], [對應值])} 對照表"""
+    schema = {}
+    for col in cols:
+        for prefix in ONE_HOT_PREFIXES:
+            if col.startswith(prefix + '_'):
+                names, values = schema.setdefault(prefix, ([], []))
+                names.append(col)
+                values.append(col[len(prefix) + 1:])
+                break
+    return schema
+
+
+def one_hot_encode(series, names, values):
+    """將類別欄位對應到固定 schema 的 one-hot 欄位（不在 schema 中的值全為 0）"""
+    # 與 get_dummies 後移除欄名空白的行為一致
+    cleaned = series.astype('string').str.replace(r'\s+', '', regex=True)
+    codes = pd.Categorical(cleaned, categories=values).codes
+    matrix = (codes[:, None] == np.arange(len(values))).astype(int)
+    return pd.DataFrame(matrix, columns=names, index=series.index)
+
+
+def to_taipei(expire):
+    """到期時間轉為台北時區（naive 視為台北時間）"""
+    if not pd.api.types.is_datetime64_any_dtype(expire):
+        # 混合時區等無法向量化的情況
+        expire = pd.to_datetime(expire, errors='coerce', utc=True)
+    if expire.dt.tz is None:
+        return expire.dt.tz_localize(LOCAL_TZ, ambiguous='NaT', nonexistent='NaT')
+    return expire.dt.tz_convert(LOCAL_TZ)
+
+
+def format_remaining(delta):
+    """剩餘時間（Timedelta Series）轉為「X天 X小時 X分 X秒」"""
+    seconds = delta.dt.seconds
+    text = (
+        delta.dt.days.astype('Int64').astype(str) + "天 "
+        + (seconds // 3600).astype('Int64').astype(str) + "小時 "
+        + (seconds % 3600 // 60).astype('Int64').astype(str) + "分 "
+        + (seconds % 60).astype('Int64').astype(str) + "秒"
+    )
+    text = text.where(delta > pd.Timedelta(0), "已過期")
+    return text.where(delta.notna(), "未知").astype(object)
+
+
+def prepare_features(df, now=None, feature_cols=None):
+    """
+    建立模型特徵，全部以向量化運算完成
+    now: 計算剩餘保存期限的基準時間（UTC），預設為現在
+    feature_cols: 模型特徵欄位，預設為目前上線模型的欄位
+    輸入已有 人流量 / 天氣 / 停車狀況 / 當下溫度 / 貨架上庫存量 欄位時沿用，否則取該賣場的情境快照
+    """
+    df = df.copy(deep=False)
+    if feature_cols is None:
+        feature_cols = get_feature_cols()
+
+    if 'ProName' not in df.columns:
+        df['ProName'] = '未知商品'
+    df['price'] = pd.to_numeric(df['price'], errors='coerce').fillna(0).astype(float)
+    df['ProPrice'] = pd.to_numeric(df['ProPrice'], errors='coerce').fillna(0).astype(float)
 
-    # 模擬不同人流、天氣、停車狀況
-    df['人流量'] = [random.choice(['少', '一般', '多']) for _ in range(len(df))]
-    df['天氣'] = [random.choice(['晴天', '陰天', '雨天']) for _ in range(len(df))]
-    df['停車狀況'] = [random.choice(['少', '一般', '多']) for _ in range(len(df))]
-    df['當下溫度'] = np.random.randint(20, 33, size=len(df)) 
-    df['貨架上庫存量'] = np.random.randint(5, 20, size=len(df))
+    df['原價'] = df['price']
+
+    # 當下時間
+    now_utc = pd.Timestamp.now(tz='UTC') if now is None else now
+    expire = pd.to_datetime(df['ExpireDate'], errors='coerce')
+    # 只有日期（00:00:00）的視為當天 23:59:59 到期
+    if pd.api.types.is_datetime64_any_dtype(expire):
+        midnight = (expire.dt.hour == 0) & (expire.dt.minute == 0) & (expire.dt.second == 0)
+        expire = expire.mask(midnight, expire + pd.Timedelta(hours=23, minutes=59, seconds=59))
+    expire = to_taipei(expire).dt.tz_convert('UTC')
+
+    delta = expire - now_utc
+    delta_hours = delta.dt.total_seconds() / 3600
+    df['剩餘保存期限_小時'] = delta_hours.clip(lower=0).fillna(0)
+    df['剩餘時間_可讀'] = format_remaining(delta)
+
+    diagnostics.dump("剩餘時間檢查（台北時區）:",
+                     lambda: df[['ProName', 'ExpireDate', '剩餘保存期限_小時', '剩餘時間_可讀']])
+
+    # 人流、天氣、停車狀況等情境：依賣場取一次快照，整批共用
+    fill_context(df)
 
-    
     if '商品大類' not in df.columns:
         if 'ProductType' in df.columns:
             df['商品大類'] = df['ProductType']
         else:
             df['商品大類'] = '其他'
-    
-    # one-hot encode
-    df = pd.get_dummies(df, columns=['人流量','天氣','停車狀況','商品大類'], dtype=int)
+
+    # one-hot encode：直接對應到 feature_cols 的固定 schema
+    schema = one_hot_schema(feature_cols)
+    encoded = [one_hot_encode(df[prefix], names, values) for prefix, (names, values) in schema.items()]
+    df = df.drop(columns=ONE_HOT_PREFIXES)
     df.columns = df.columns.str.replace(r'\s+', '', regex=True)
+    df = pd.concat([df] + encoded, axis=1)
 
-    for col in feature_cols:
-        if col not in df.columns:
-            df[col] = 0
+    missing = [col for col in feature_cols if col not in df.columns]
+    if missing:
+        df = pd.concat([df, pd.DataFrame(0, index=df.index, columns=missing)], axis=1)
+
+    bool_cols = df.select_dtypes(include='bool').columns
+    if len(bool_cols):
+        df[bool_cols] = df[bool_cols].astype(int)
 
-    df = df.copy()
-    for c in df.columns:
-        if df[c].dtype == 'bool':
-            df[c] = df[c].astype(int)
-            
     return df
 
-def predict_price(df, update_db=True, mysql=None):
-    print("price 與 ProPrice 對照檢查：")
-    print(df[['ProductID','ProName','price','ProPrice']])
 
-    """
-    df: pandas DataFrame, 至少需包含 ProPrice
-    update_db: 是否直接更新 MySQL product 表的 AiPrice 與 Reason
-    mysql: 若 update_db=True，需傳入 mysql 連線物件
-    """
-    df = df.copy()
-    df_full = prepare_features(df)
-    X = df_full[feature_cols]
-
-    print("model type:", type(model))
-    try:
-        print("model.feature_names_in_ length:", len(model.feature_names_in_))
-    except Exception:
-        print("model has no feature_names_in_")
-
-    print("==== DEBUG X summary ====")
-    print("X shape:", X.shape)
-    print("nonzero counts:\n", (X != 0).sum().sort_values(ascending=False).head(30))
-    if '剩餘保存期限_小時' in X.columns:
-        print("剩餘保存期限 describe:\n", X['剩餘保存期限_小時'].describe())
-    print("missing features:", [c for c in feature_cols if c not in X.columns])
+def _summarize_features(X, handle):
+    """DEBUG 用的特徵摘要（只在取樣時計算）"""
+    feature_cols = handle.feature_cols
+    lines = [f"X shape: {X.shape}", f"model: {handle.version} ({type(handle.model).__name__})"]
     nz = (X != 0).sum().sort_values(ascending=False)
-    print("🧩 非零欄位計數 (top 20):")
-    print(nz.head(20).to_string())
-
+    lines.append("🧩 非零欄位計數 (top 20):\n" + nz.head(20).to_string())
     if '剩餘保存期限_小時' in X.columns:
-        print("剩餘保存期限_小時 describe:")
-        print(X['剩餘保存期限_小時'].describe())
-        print("剩餘保存期限_小時 unique count:", X['剩餘保存期限_小時'].nunique())
-
+        hours = X['剩餘保存期限_小時']
+        lines.append("剩餘保存期限_小時 describe:\n" + hours.describe().to_string())
+        lines.append(f"剩餘保存期限_小時 unique count: {hours.nunique()}")
+    lines.append(f"missing features: {[c for c in feature_cols if c not in X.columns]}")
+    lines.append("前幾筆輸入數據：\n" + X.head().to_string())
+    return "\n".join(lines)
 
-    print("輸入給模型的欄位：", list(X.columns))
-    print("前幾筆輸入數據：")
-    print(X.head())
 
-    df['AI折扣'] = model.predict(X).round(2)
-    
-    df['ProPrice'] = pd.to_numeric(df['ProPrice'], errors='coerce').fillna(0).astype(float)
-    df['price'] = pd.to_numeric(df['price'], errors='coerce').fillna(0).astype(float)
-    df['AiPrice'] = (df['price'] * (1 - df['AI折扣'])).round(0).astype(float)
+RESULT_COLUMNS = ['ProductID', 'ProName', 'ProPrice', 'AI折扣', 'AiPrice', 'Reason']
 
-    df['差異'] = df['AiPrice'] - df['ProPrice']
-    print("🛠 AiPrice 與 ProPrice 差異檢查：")
-    print(df[['ProductID','ProName','AiPrice','ProPrice','差異', 'AI折扣']])
 
-    df['Reason'] = df.apply(
-        lambda r: "合理" if np.isclose(r['AiPrice'], r['ProPrice'], atol=1) or r['AiPrice'] >= r['ProPrice']
-        else "不合理",
-        axis=1
-    )
+def fill_context(df):
+    """補上缺少的情境欄位（依賣場取快照）；直接修改 df"""
+    missing_context = [col for col in CONTEXT_COLUMNS if col not in df.columns]
+    if missing_context:
+        markets = df['Market'] if 'Market' in df.columns else pd.Series(None, index=df.index, dtype=object)
+        context = contexts.frame(markets)
+        for col in missing_context:
+            df[col] = context[col]
+    return df
 
-    if update_db and mysql is not None:
-        try:
-            cur = mysql.connection.cursor()
-            for _, row in df.iterrows():
-                cur.execute(
-                    "UPDATE product SET AiPrice=%s, Reason=%s WHERE ProductID=%s",
-                    (row['AiPrice'], row['Reason'], row['ProductID'])
-                )
-            mysql.connection.commit()
-            cur.close()
-        except Exception as e:
-            print("更新 AiPrice 失敗:", e)
-    
-    return df[['ProductID','ProName','ProPrice','AI折扣','AiPrice','Reason']]
 
+def price_frame(df, handle=None):
+    """
+    特徵、推論、Reason 與下次重新定價時間，不寫 DB
+    回傳 df 的淺複本（不修改輸入），加上 AI折扣 / AiPrice / Reason / RepriceAfter
+    ProPrice / price 以 prepare_features 轉好的數值取代，只轉換一次
+    """
+    diagnostics.dump("price 與 ProPrice 對照檢查：", lambda: df[['ProductID', 'ProName', 'price', 'ProPrice']])
+
+    # 整批使用同一個模型版本，即使中途熱更新也不會混用
+    if handle is None:
+        handle = current_engine()
+    feature_cols = handle.feature_cols
+
+    # 只新增 / 整欄取代欄位，淺複本就不會動到呼叫端的 DataFrame
+    df = df.copy(deep=False)
+    with diagnostics.stage('feature_prep'):
+        df_full = prepare_features(df, feature_cols=feature_cols)
+        X = df_full[feature_cols]
+    diagnostics.dump("==== DEBUG X summary ====", lambda: _summarize_features(X, handle))
+
+    with diagnostics.stage('inference'):
+        # 規則引擎比查表還便宜，不走折扣表
+        if price_table is not None and handle.version != RULES_VERSION:
+            discounts = price_table.predict(handle, X)
+        else:
+            discounts = handle.predict(X)
+        df['AI折扣'] = np.round(discounts, 2)
+
+    with diagnostics.stage('reason'):
+        # prepare_features 已轉成 float（缺值補 0）
+        df['ProPrice'] = df_full['ProPrice']
+        df['price'] = df_full['price']
+        pro_price = df_full['ProPrice'].to_numpy()
+        ai_price = np.round(df_full['price'].to_numpy() * (1 - df['AI折扣'].to_numpy()), 0)
+        df['AiPrice'] = ai_price
+
+        # AiPrice 與 ProPrice 相差 1 元內，或 AI 價不低於標價，都算合理
+        reasonable = np.isclose(ai_price, pro_price, atol=1) | (ai_price >= pro_price)
+        df['Reason'] = np.where(reasonable, "合理", "不合理").astype(object)
+
+        # 下次需要重新定價的時間（剩餘保存期限跨 bucket）
+        df['RepriceAfter'] = reprice_after(df_full['剩餘保存期限_小時'])
+
+    diagnostics.dump("🛠 AiPrice 與 ProPrice 差異檢查：", lambda: df[['ProductID', 'ProName', 'AiPrice', 'ProPrice', 'AI折扣']]
+                     .assign(差異=df['AiPrice'] - df['ProPrice']))
+    return df
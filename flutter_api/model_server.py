@@ -0,0 +1,277 @@
+import os
+import threading
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import diagnostics
+from compact_forest import CompactForest, FOREST_EXT, is_compact_forest
+
+# ----------------- 模型註冊與服務 -----------------
+# MODEL_DIR 下每個版本一個檔案：<版本>.pkl / <版本>.joblib，或精簡格式目錄 <版本>.forest（見 compact_forest）
+# MODEL_DIR/CURRENT 寫入要上線的版本名稱；沒有 CURRENT 時使用名稱排序最後的版本
+# 都沒有時退回舊的 random_forest_model.pkl / random_forest_model.forest（版本名稱 legacy）
+# 同一版本同時有 .forest 與 .pkl / .joblib 時兩者並用：
+#   COMPACT_MAX_ROWS 筆以內的批次（單一商品、增量重新定價）用 .forest，載入快、推論延遲低；
+#   更大的批次（全量 / 分片重新定價）用 sklearn，上千筆以上 C 迴圈較快（見 benchmarks/bench_compact_forest.py）
+#   sklearn 檔在第一次遇到大批次時才載入，只處理小批次的 worker 不必付反序列化成本
+#
+# 熱更新：新版本在背景載入並完成暖機推論後，才以單一參照替換上線，
+# 正在推論的請求繼續使用舊版本，不會中斷
+# 共用記憶體：以 mmap_mode='r' 載入，artifact 中的 numpy 陣列直接對應到檔案，
+# 多個 worker process 共用 OS page cache；sklearn 樹在反序列化時會複製節點，
+# 要真正共用請用 ML.py export 匯出的 .forest 精簡格式（純 mmap 陣列）
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.environ.get("MODEL_DIR", os.path.join(BASE_DIR, "models"))
+LEGACY_MODEL_PATH = os.path.join(BASE_DIR, "random_forest_model.pkl")
+LEGACY_COMPACT_PATH = os.path.join(BASE_DIR, "random_forest_model" + FOREST_EXT)
+MODEL_RELOAD_INTERVAL = float(os.environ.get("MODEL_RELOAD_INTERVAL", 30))
+MODEL_EXTS = (".pkl", ".joblib", FOREST_EXT)
+COMPACT_MAX_ROWS = int(os.environ.get("COMPACT_MAX_ROWS", 500))
+
+
+class ModelUnavailable(Exception):
+    pass
+
+
+class ModelHandle:
+    """一個已載入的模型版本與它的統計"""
+
+    def __init__(self, version, model, feature_cols, path=None, batch_loader=None):
+        """
+        batch_loader: 大批次改用的模型（callable，第一次需要時才呼叫）；None = 一律用 model
+        """
+        self.version = version
+        self.model = model
+        self.feature_cols = list(feature_cols)
+        self.path = path
+        self.loaded_at = time.time()
+        self._lock = threading.Lock()
+        self._batch_loader = batch_loader
+        self._batch_model = None
+        self._batch_lock = threading.Lock()
+        self.calls = 0
+        self.predictions = 0
+        self.total_latency_s = 0.0
+        self.max_latency_s = 0.0
+
+    def _model_for(self, n_rows):
+        if self._batch_loader is None or n_rows <= COMPACT_MAX_ROWS:
+            return self.model
+        if self._batch_model is None:
+            with self._batch_lock:
+                if self._batch_model is None and self._batch_loader is not None:
+                    try:
+                        self._batch_model = self._batch_loader()
+                    except Exception as e:
+                        diagnostics.error("載入模型 %s 的批次推論版本失敗，改用精簡格式: %s", self.version, e)
+                        self._batch_loader = None
+                        return self.model
+        return self._batch_model
+
+    def predict(self, X):
+        start = time.perf_counter()
+        values = self._model_for(len(X)).predict(X)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.calls += 1
+            self.predictions += len(X)
+            self.total_latency_s += elapsed
+            self.max_latency_s = max(self.max_latency_s, elapsed)
+        diagnostics.record_timing(f"model.{self.version}.predict", elapsed)
+        return values
+
+    def usage(self):
+        """(calls, predictions, total_latency_s, max_latency_s)"""
+        with self._lock:
+            return self.calls, self.predictions, self.total_latency_s, self.max_latency_s
+
+    def add_usage(self, calls, predictions, total_latency_s, max_latency_s):
+        """併入其他 process 以同一版本推論的統計（重新定價的 worker）"""
+        with self._lock:
+            self.calls += calls
+            self.predictions += predictions
+            self.total_latency_s += total_latency_s
+            self.max_latency_s = max(self.max_latency_s, max_latency_s)
+
+    def warm_up(self):
+        """用一筆全 0 的資料跑一次推論，讓第一個真正的請求不必付初始化成本"""
+        X = pd.DataFrame(np.zeros((1, len(self.feature_cols))), columns=self.feature_cols)
+        self.model.predict(X)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "path": self.path,
+                "loaded_at": self.loaded_at,
+                "calls": self.calls,
+                "predictions": self.predictions,
+                "avg_latency_s": self.total_latency_s / self.calls if self.calls else 0.0,
+                "max_latency_s": self.max_latency_s,
+                "batch_model_loaded": self._batch_model is not None,
+            }
+
+
+class ModelRegistry:
+    def __init__(self, model_dir=MODEL_DIR, fallback=None, reload_interval=MODEL_RELOAD_INTERVAL):
+        """
+        fallback: 沒有任何模型可載入時使用的 ModelHandle 工廠（callable）
+        """
+        self.model_dir = model_dir
+        self.fallback = fallback
+        self.reload_interval = reload_interval
+        self._current = None
+        self._retired = {}  # 已下線版本的統計快照
+        self._swap_lock = threading.Lock()
+        self._last_check = 0.0
+        self._source_stamp = None
+
+    # ---------- 版本管理 ----------
+    def available_versions(self):
+        """版本 -> 主要 artifact；同時有 sklearn 檔與 .forest 時回傳 sklearn 檔（.forest 由 _load 一併載入）"""
+        if not os.path.isdir(self.model_dir):
+            return {}
+        versions = {}
+        for name in os.listdir(self.model_dir):
+            stem, ext = os.path.splitext(name)
+            if ext not in MODEL_EXTS or (ext == FOREST_EXT and stem in versions):
+                continue
+            versions[stem] = os.path.join(self.model_dir, name)
+        return versions
+
+    @staticmethod
+    def _legacy_path():
+        if os.path.exists(LEGACY_MODEL_PATH):
+            return LEGACY_MODEL_PATH
+        if is_compact_forest(LEGACY_COMPACT_PATH):
+            return LEGACY_COMPACT_PATH
+        return None
+
+    def _path(self, version):
+        path = self.available_versions().get(version)
+        if path is None and version == "legacy":
+            return self._legacy_path()
+        return path
+
+    def _wanted(self):
+        """目前應該上線的 (版本, 路徑)"""
+        versions = self.available_versions()
+        current_file = os.path.join(self.model_dir, "CURRENT")
+        if os.path.exists(current_file):
+            with open(current_file, encoding="utf-8") as f:
+                wanted = f.read().strip()
+            if wanted in versions:
+                return wanted, versions[wanted]
+            diagnostics.warning("CURRENT 指定的模型版本 %s 不存在", wanted)
+        if versions:
+            latest = sorted(versions)[-1]
+            return latest, versions[latest]
+        path = self._legacy_path()
+        return ("legacy", path) if path else (None, None)
+
+    def _stamp(self):
+        """CURRENT 與模型目錄的修改時間，用來便宜地判斷是否需要重新載入"""
+        stamp = []
+        for path in (self.model_dir, os.path.join(self.model_dir, "CURRENT")):
+            try:
+                stamp.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    # ---------- 載入 ----------
+    def _load(self, version, path):
+        start = time.perf_counter()
+        compact_path = os.path.splitext(path)[0] + FOREST_EXT
+        batch_loader = None
+        if is_compact_forest(path):
+            model = CompactForest.load(path, mmap_mode="r")
+        elif is_compact_forest(compact_path):
+            model = CompactForest.load(compact_path, mmap_mode="r")
+            batch_loader = lambda: joblib.load(path, mmap_mode="r")  # noqa: E731
+        else:
+            model = joblib.load(path, mmap_mode="r")
+        handle = ModelHandle(version, model, model.feature_names_in_, path, batch_loader)
+        handle.warm_up()
+        diagnostics.info("已載入模型 %s（%.2fs）", version, time.perf_counter() - start)
+        return handle
+
+    def reload(self, version=None):
+        """
+        載入指定版本（預設為目前應上線的版本）並原子替換；失敗時保留原本的版本
+        回傳上線中的 ModelHandle
+        """
+        with self._swap_lock:
+            self._source_stamp = self._stamp()
+            self._last_check = time.monotonic()
+            if version is None:
+                version, path = self._wanted()
+            else:
+                path = self._path(version)
+                if path is None:
+                    raise ModelUnavailable(f"找不到模型版本 {version}")
+
+            if self._current is not None and self._current.version == version:
+                return self._current
+
+            handle = None
+            if path is not None:
+                try:
+                    handle = self._load(version, path)
+                except Exception as e:
+                    diagnostics.error("載入模型 %s 失敗: %s", version, e)
+
+            if handle is None:
+                if self._current is not None:
+                    return self._current
+                if self.fallback is None:
+                    raise ModelUnavailable("沒有可用的模型")
+                handle = self.fallback()
+                diagnostics.warning("無法載入模型，改用 %s", handle.version)
+
+            old = self._current
+            self._current = handle
+            if old is not None:
+                # 舊版本的物件在進行中的請求結束後才會被回收
+                self._retired[old.version] = old.stats()
+            self._retired.pop(handle.version, None)
+            return handle
+
+    def maybe_reload(self):
+        """每 reload_interval 秒最多檢查一次 CURRENT / 模型目錄是否有變動"""
+        if time.monotonic() - self._last_check < self.reload_interval:
+            return
+        self._last_check = time.monotonic()
+        if self._stamp() != self._source_stamp:
+            threading.Thread(target=self.reload, daemon=True).start()
+
+    def current(self):
+        handle = self._current
+        if handle is None:
+            return self.reload()
+        self.maybe_reload()
+        return handle
+
+    def get(self, version):
+        """
+        指定版本的 ModelHandle，不是上線中的版本就載入並上線；不跟著 CURRENT 自動更新
+        載入失敗時丟出 ModelUnavailable（不退回其他版本）
+        """
+        handle = self._current
+        if handle is not None and handle.version == version:
+            return handle
+        handle = self.reload(version)
+        if handle.version != version:
+            raise ModelUnavailable(f"無法載入模型版本 {version}")
+        return handle
+
+    def stats(self):
+        handle = self._current
+        return {
+            "current": handle.version if handle else None,
+            "versions": ([handle.stats()] if handle else []) + list(self._retired.values()),
+        }
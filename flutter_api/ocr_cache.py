@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import diagnostics
+import image_preprocess
+
+# ----------------- OCR 結果快取 -----------------
+# 以圖片內容的 SHA-256 作為 key：
+#   uploads/ 內的檔名就是 hash（同一張圖只存一份，也不會再因同一秒上傳而互相覆蓋）
+#   辨識結果（rec_texts 與抽取後的商品資訊）存在 SQLite，超過上限時淘汰最久沒用到的（LRU）
+# OCR_CACHE_MAX_ENTRIES : 快取筆數上限（0 = 停用快取）
+
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get("OCR_CACHE_MAX_ENTRIES", 10000))
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def preprocess_signature():
+    """前處理設定不同，辨識結果就可能不同，要一起放進 key"""
+    return f"{image_preprocess.OCR_LONG_EDGE}|{int(image_preprocess.OCR_GRAYSCALE)}|{image_preprocess.OCR_CROP}"
+
+
+def move_cache_file(old_path, new_path):
+    """把舊位置的快取 DB（含 -wal / -shm）搬到新位置；新位置已有快取時直接刪掉舊的"""
+    keep = not os.path.exists(new_path)
+    for suffix in ("", "-wal", "-shm"):
+        old = old_path + suffix
+        if not os.path.exists(old):
+            continue
+        if keep:
+            os.replace(old, new_path + suffix)
+        else:
+            os.remove(old)
+
+
+class OcrResultCache:
+    def __init__(self, path, max_entries=OCR_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ocr_cache (
+                key TEXT PRIMARY KEY,
+                texts TEXT NOT NULL,
+                info TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used ON ocr_cache (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(digest):
+        return f"{digest}:{preprocess_signature()}"
+
+    def get(self, digest):
+        """命中時回傳 (texts, info) 並更新使用時間，否則回傳 None"""
+        if not self.max_entries:
+            return None
+        key = self.key(digest)
+        with self._lock:
+            row = self._conn.execute("SELECT texts, info FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                diagnostics.incr('ocr_cache.miss')
+                return None
+            self._conn.execute("UPDATE ocr_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        diagnostics.incr('ocr_cache.hit')
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put(self, digest, texts, info):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, texts, info, last_used) VALUES (?, ?, ?, ?)",
+                (self.key(digest), json.dumps(texts, ensure_ascii=False),
+                 json.dumps(info, ensure_ascii=False), time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM ocr_cache WHERE key IN "
+                "(SELECT key FROM ocr_cache ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            )
+            diagnostics.incr('ocr_cache.evicted', excess)
+
+
+def store_upload(upload_dir, data, digest=None, ext=".jpg"):
+    """以內容 hash 命名存檔（已存在就不重寫），回傳檔名"""
+    digest = digest or content_hash(data)
+    filename = f"{digest}{ext}"
+    filepath = os.path.join(upload_dir, filename)
+    if not os.path.exists(filepath):
+        # 先寫暫存檔再改名，避免同時上傳同一張圖時讀到寫一半的檔案
+        tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, filepath)
+    return filename
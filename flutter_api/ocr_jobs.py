@@ -0,0 +1,251 @@
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import diagnostics
+import ocr_service
+
+# ----------------- OCR 非同步工作佇列 -----------------
+# 上傳後立即回傳 job_id，由固定大小的 OCR worker process pool 處理辨識
+# 辨識結果回到主 process 後，交給 on_done callback（寫入 DB 等）產生最終結果
+# on_done 在另一組寫入執行緒執行，不佔用 process pool 收結果 / 派工作的管理執行緒，
+# 等 DB 連線時其他 OCR 結果仍會繼續收回、排隊的圖片繼續送進 worker
+# OCR_WORKERS     : worker process 數量（每個 process 各自載入一份 PaddleOCR）
+# OCR_MAX_PENDING : 排隊 + 執行中的 job 上限，超過就拒絕新的上傳
+# OCR_JOB_TTL     : 完成的 job 保留秒數，供查詢結果
+# OCR_BATCH_SIZE  : 批次上傳時每組送進一次 predict 的圖片數，各組分散到不同 worker
+# OCR_WRITERS     : 執行 on_done 的執行緒數（不要超過 DB 連線池大小）
+
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", 2))
+OCR_MAX_PENDING = int(os.environ.get("OCR_MAX_PENDING", 32))
+OCR_JOB_TTL = int(os.environ.get("OCR_JOB_TTL", 3600))
+OCR_BATCH_SIZE = int(os.environ.get("OCR_BATCH_SIZE", 8))
+OCR_WRITERS = int(os.environ.get("OCR_WRITERS", 4))
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _init_worker():
+    # 在 worker 啟動時就載入模型，第一個 job 不必等
+    ocr_service.get_ocr()
+
+
+def _run_ocr(source):
+    start = time.perf_counter()
+    texts, info = ocr_service.recognize(source)
+    return texts, info, time.perf_counter() - start
+
+
+def _run_ocr_batch(sources):
+    start = time.perf_counter()
+    outputs = ocr_service.recognize_batch(sources)
+    return outputs, time.perf_counter() - start
+
+
+class OcrJob:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.created_at = time.time()
+        self.finished_at = None
+        self.futures = []
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    @property
+    def status(self):
+        if self.done.is_set():
+            return "failed" if self.error else "done"
+        if any(f.running() or f.done() for f in self.futures):
+            return "running"
+        return "queued"
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def to_dict(self):
+        data = {"job_id": self.id, "status": self.status}
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+class OcrJobQueue:
+    def __init__(self, workers=OCR_WORKERS, max_pending=OCR_MAX_PENDING, ttl=OCR_JOB_TTL, writers=OCR_WRITERS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.writers = writers
+        self._executor = None
+        self._writer_pool = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _get_executor(self):
+        # 第一次使用時才建立，避免 reloader 的父 process 也啟動一組 worker
+        if self._executor is None:
+            ctx = multiprocessing.get_context("spawn")
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=ctx, initializer=_init_worker
+            )
+        return self._executor
+
+    def _get_writer_pool(self):
+        with self._lock:
+            if self._writer_pool is None:
+                self._writer_pool = ThreadPoolExecutor(max_workers=self.writers, thread_name_prefix="ocr-writer")
+            return self._writer_pool
+
+    def _hand_off(self, job, produce):
+        """在 future 的 done callback 裡呼叫：把 produce（會寫 DB）交給寫入執行緒"""
+        try:
+            self._get_writer_pool().submit(self._finish, job, produce)
+        except RuntimeError:
+            # 已 shutdown，直接在目前執行緒完成，job 不會卡住
+            self._finish(job, produce)
+
+    def _new_job(self):
+        if not self._slots.acquire(blocking=False):
+            diagnostics.incr('ocr_jobs.rejected')
+            raise QueueFull("OCR 佇列已滿，請稍後再試")
+
+        job = OcrJob(uuid.uuid4().hex)
+        with self._lock:
+            self._purge_expired()
+            self._jobs[job.id] = job
+        return job
+
+    def _finish(self, job, produce):
+        try:
+            job.result = produce()
+        except Exception as e:
+            diagnostics.error("OCR job %s 失敗: %s", job.id, e)
+            job.error = str(e) or type(e).__name__
+        finally:
+            job.finished_at = time.time()
+            diagnostics.record_timing('ocr_jobs.turnaround', job.finished_at - job.created_at)
+            self._slots.release()
+            job.done.set()
+
+    def _discard(self, job):
+        self._slots.release()
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+    def submit(self, source, on_done):
+        """
+        送出辨識工作（source 為圖片 bytes 或檔案路徑）
+        on_done(texts, info) 在主 process 的寫入執行緒中執行，回傳值即為 job 結果
+        佇列已滿時丟出 QueueFull
+        """
+        job = self._new_job()
+
+        def finish(future):
+            def produce():
+                texts, info, elapsed = future.result()
+                diagnostics.record_timing('ocr', elapsed)
+                return on_done(texts, info)
+            self._hand_off(job, produce)
+
+        try:
+            future = self._submit(_run_ocr, source)
+        except Exception:
+            self._discard(job)
+            raise
+        job.futures.append(future)
+        diagnostics.incr('ocr_jobs.submitted')
+        future.add_done_callback(finish)
+        return job
+
+    def completed(self, produce):
+        """
+        不需要 OCR 的 job（例如快取命中）：直接在目前執行緒執行 produce()，
+        回傳已完成的 job，讓呼叫端沿用同一套回應格式
+        """
+        job = self._new_job()
+        self._finish(job, produce)
+        return job
+
+    def submit_batch(self, sources, on_done, batch_size=OCR_BATCH_SIZE):
+        """
+        送出多張圖片的辨識工作，每 batch_size 張為一組呼叫一次 predict
+        全部完成後 on_done(outputs) 在主 process 的寫入執行緒中執行，
+        outputs 與 sources 對應：[(texts, info, error)]
+        """
+        if not sources:
+            raise ValueError("沒有圖片")
+        job = self._new_job()
+        groups = [sources[i:i + batch_size] for i in range(0, len(sources), batch_size)]
+        remaining = [len(groups)]
+        remaining_lock = threading.Lock()
+
+        def finish(_):
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+
+            def produce():
+                outputs = []
+                for group, future in zip(groups, job.futures):
+                    try:
+                        group_outputs, elapsed = future.result()
+                        diagnostics.record_timing('ocr_batch', elapsed)
+                    except Exception as e:
+                        group_outputs = [([], None, str(e) or type(e).__name__)] * len(group)
+                    outputs.extend(group_outputs)
+                return on_done(outputs)
+            self._hand_off(job, produce)
+
+        try:
+            for group in groups:
+                job.futures.append(self._submit(_run_ocr_batch, group))
+        except Exception:
+            for future in job.futures:
+                future.cancel()
+            self._discard(job)
+            raise
+        diagnostics.incr('ocr_jobs.submitted')
+        diagnostics.incr('ocr_jobs.batch_images', len(sources))
+        for future in job.futures:
+            future.add_done_callback(finish)
+        return job
+
+    def _submit(self, fn, arg):
+        with self._lock:
+            executor = self._get_executor()
+        try:
+            return executor.submit(fn, arg)
+        except BrokenProcessPool:
+            # worker 異常結束後 pool 無法再用，重建一次
+            diagnostics.warning("OCR worker pool 已損壞，重新建立")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+                executor = self._get_executor()
+            return executor.submit(fn, arg)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.ttl
+        expired = [jid for jid, j in self._jobs.items() if j.finished_at and j.finished_at < cutoff]
+        for jid in expired:
+            del self._jobs[jid]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._writer_pool is not None:
+            self._writer_pool.shutdown(wait=False)
@@ -0,0 +1,161 @@
+import re
+from datetime import datetime, date
+from opencc import OpenCC
+import image_preprocess
+from keyword_matcher import KeywordMatcher
+
+# ----------------- OCR 辨識與商品資訊抽取 -----------------
+# 不依賴 Flask / MySQL，OCR worker process 只需 import 這個模組
+
+cc = OpenCC('s2t')
+# 關鍵字分類
+MEAT_KEYWORDS = ["豬", "牛", "雞", "羊", "腿", "排", "骨", "燒烤片", "火烤片", "肉片", "火鍋片", "絞肉"]
+SEAFOOD_KEYWORDS = ["魚", "蝦", "魷", "鮭", "花枝", "章魚", "鯛", "干貝", "蛤", "牡蠣", "螺", "白管", "海帶"]
+VEG_KEYWORDS = ["菜", "瓜", "果", "蔬", "蘋果", "香蕉", "橘子", "葡萄", "山藥", "豆芽", "筍", "菇", "椒", "番茄", "洋蔥", "芭樂", "蔥", "櫻桃", "秋葵", "梨", "柑", "柚"]
+BAKERY_KEYWORDS = ["吐司", "麵包", "蛋糕", "可頌", "甜甜圈", "佛卡夏", "貝果", "鬆餅", "德國結", "蛋塔", "法式", "餅"]
+BEAN_KEYWORDS = ["豆腐", "豆干", "豆皮", "百頁", "豆包", "素"]
+READY_TO_EAT_KEYWORDS = ["三明治", "便當", "沙拉", "餃子皮", "火鍋料", "水果盤"]
+
+# 啟動時建好一次；順序即分類優先權
+PRODUCT_TYPE_MATCHER = KeywordMatcher([
+    ("肉類", MEAT_KEYWORDS),
+    ("魚類", SEAFOOD_KEYWORDS),
+    ("蔬果類", VEG_KEYWORDS),
+    ("麵包甜點類", BAKERY_KEYWORDS),
+    ("豆製品類", BEAN_KEYWORDS),
+    ("熟食/其他", READY_TO_EAT_KEYWORDS),
+])
+
+
+
+def extract_prices(texts):
+    normal_candidates = []
+
+    for line in texts:
+        
+        matches = re.findall(r"(\d+(?:\.\d+)?)\s*元", line)
+
+        for m in matches:
+            if "元/" in line:
+                continue
+
+            normal_candidates.append(int(float(m)))
+
+    price = max(normal_candidates) if normal_candidates else None
+    pro_price = min(normal_candidates) if normal_candidates else None
+
+    return price, pro_price
+
+
+
+def extract_product_info(texts):
+    info = {"ProName": None, "ExpireDate": None, "Price": None, "ProPrice": None}
+    max_length = 0 
+    full_text = "\n".join(texts)
+    # 商品名稱
+    for line in texts:
+        if PRODUCT_TYPE_MATCHER.matches_any(line):
+            if len(line) > max_length:
+                info["ProName"] = line
+                max_length = len(line)
+
+    # 有效日期
+    date_match = re.search(r"(\d{4}\.\d{1,2}\.\d{1,2})", full_text)
+    if date_match:
+        info["ExpireDate"] = date_match.group(1)
+
+    # 原價 / 即期價
+    price, pro_price = extract_prices(texts)
+    info["Price"] = price
+    info["ProPrice"] = pro_price
+
+    return info
+
+
+def detect_product_type(name: str) -> str:
+    if not name:
+        return "未知"
+    return PRODUCT_TYPE_MATCHER.classify(name, "其他")
+
+
+def normalize_date(expire_str):
+    """轉換日期字串為 YYYY-MM-DD, 並判斷狀態"""
+    if not expire_str:
+        return None, "未知"
+    try:
+        clean_str = expire_str.replace(".", "-")
+        exp = datetime.strptime(clean_str, "%Y-%m-%d").date()
+        status = "未過期" if exp >= date.today() else "已過期"
+        return exp.strftime("%Y-%m-%d"), status
+    except Exception as e:
+        print("日期解析失敗:", expire_str, e)
+        return None, "未知"
+
+
+# ---------------------- OCR 引擎 ----------------------
+_ocr = None
+
+
+def get_ocr():
+    """PaddleOCR 延遲初始化（每個 process 一個）"""
+    global _ocr
+    if _ocr is None:
+        from paddleocr import PaddleOCR
+        _ocr = PaddleOCR(lang='ch', use_textline_orientation=False, ocr_version='PP-OCRv4')
+    return _ocr
+
+
+def _to_texts(item):
+    # 轉繁體
+    return [cc.convert(t) for t in item['rec_texts']]
+
+
+def to_ocr_input(source):
+    """
+    圖片 bytes 先經過前處理（縮放 / 灰階 / 裁切）再送進 OCR
+    檔案路徑則讀進記憶體後同樣處理；前處理全部關閉時檔案路徑原樣交給 OCR
+    """
+    if isinstance(source, str):
+        if not image_preprocess.enabled():
+            return source
+        with open(source, "rb") as f:
+            source = f.read()
+    return image_preprocess.preprocess(source)
+
+
+def recognize(source):
+    """OCR 辨識並轉為繁體，回傳 (texts, info)；source 為圖片 bytes 或檔案路徑"""
+    result = get_ocr().predict(to_ocr_input(source))
+    texts = []
+    for item in result:
+        texts.extend(_to_texts(item))
+
+    info = extract_product_info(texts)
+    return texts, info
+
+
+def recognize_batch(sources):
+    """
+    一次 predict 辨識多張圖片，回傳與 sources 對應的 [(texts, info, error)]
+    整批失敗時改為逐張辨識，讓錯誤只影響該張圖片
+    """
+    sources = list(sources)
+    try:
+        results = get_ocr().predict([to_ocr_input(s) for s in sources])
+        outputs = []
+        for item in results:
+            texts = _to_texts(item)
+            outputs.append((texts, extract_product_info(texts), None))
+        if len(outputs) == len(sources):
+            return outputs
+    except Exception:
+        pass
+
+    outputs = []
+    for source in sources:
+        try:
+            texts, info = recognize(source)
+            outputs.append((texts, info, None))
+        except Exception as e:
+            outputs.append(([], None, str(e) or type(e).__name__))
+    return outputs
@@ -0,0 +1,321 @@
+import os
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import diagnostics
+from compact_forest import CompactForest
+
+# ----------------- 預先計算的折扣表 -----------------
+# 除了 剩餘保存期限_小時 與 原價 之外，其餘特徵（商品大類 / 情境 one-hot、溫度、庫存）
+# 組成一個 key；同一個 key 的折扣只隨 (小時, 原價) 變化，
+# 因此對常出現的 key 預先在 小時 × 原價 網格上跑一次模型，之後查表
+#
+# 樹模型（sklearn 森林 / 決策樹、CompactForest）：網格對齊到所有樹在該特徵上的分割門檻，
+#   相鄰兩個門檻之間模型輸出不變，查表（取所在區間）與模型推論完全相同，也沒有網格範圍限制；
+#   其他 key 特徵也換成所在的門檻區間，沒被任何樹用到的特徵不會讓 key 變多
+# 其他模型（gbm / linear）：固定間距網格 + 雙線性內插，有誤差，網格外的列直接用模型推論
+# 每張表建好後抽樣與模型推論比對，四捨五入到小數兩位後的最大差超過 PRICE_TABLE_MAX_ERROR（預設 0，
+# 即必須完全一致）就不採用；內插網格通常達不到，要接受誤差需自行調高
+#
+# 建表不在請求裡做：predict() 只查表並記錄沒有表的 key 出現次數，
+# 出現 PRICE_TABLE_MIN_HITS 次以上的 key 由背景執行緒（start()）每 PRICE_TABLE_BUILD_INTERVAL 秒建一批；
+# 也可以呼叫 precompute() 對指定的情境直接建表
+# 表在每個 process 各自一份（重新定價的 worker process 也各自建）；上線模型版本改變時整張表清空
+# 預設關閉（PRICE_TABLE=1 開啟）
+
+HOURS_COL = '剩餘保存期限_小時'
+PRICE_COL = '原價'
+# 非樹模型時，連續特徵先取整再當 key，避免小數造成 key 爆量
+SNAP = {'當下溫度': 1, '貨架上庫存量': 1}
+
+PRICE_TABLE_ENABLED = os.environ.get("PRICE_TABLE", "0") != "0"
+HOURS_STEP = float(os.environ.get("PRICE_TABLE_HOURS_STEP", 1))
+MAX_HOURS = float(os.environ.get("PRICE_TABLE_MAX_HOURS", 168))
+PRICE_STEP = float(os.environ.get("PRICE_TABLE_PRICE_STEP", 10))
+MAX_PRICE = float(os.environ.get("PRICE_TABLE_MAX_PRICE", 1000))
+MIN_HITS = int(os.environ.get("PRICE_TABLE_MIN_HITS", 2))  # key 出現幾次後才建表
+MAX_KEYS = int(os.environ.get("PRICE_TABLE_MAX_KEYS", 64))
+MAX_ERROR = float(os.environ.get("PRICE_TABLE_MAX_ERROR", 0))
+BUILD_INTERVAL = float(os.environ.get("PRICE_TABLE_BUILD_INTERVAL", 30))
+CHECK_ROWS = 512  # 建表後抽樣比對的筆數
+
+
+def _grid(step, maximum):
+    return np.arange(0.0, maximum + step / 2, step)
+
+
+def split_thresholds(model):
+    """
+    樹模型各特徵的分割門檻 {特徵名稱: 排序去重後的門檻}；不是樹模型時回傳 None
+    沒被任何樹用到的特徵為空陣列
+    """
+    if isinstance(model, CompactForest):
+        splits = [(model.feature, model.threshold)]
+    elif hasattr(model, "tree_") or (hasattr(model, "estimators_")
+                                     and all(hasattr(t, "tree_") for t in np.ravel(model.estimators_))):
+        trees = [model] if hasattr(model, "tree_") else np.ravel(model.estimators_)
+        splits = [(t.tree_.feature, t.tree_.threshold) for t in trees]
+    else:
+        return None
+    names = list(model.feature_names_in_)
+    feature = np.concatenate([np.asarray(f) for f, _ in splits])
+    threshold = np.concatenate([np.asarray(t) for _, t in splits])
+    # 葉節點：sklearn 為 feature < 0，CompactForest 為 threshold = inf
+    split = (feature >= 0) & np.isfinite(threshold)
+    return {name: np.unique(threshold[split & (feature == i)]) for i, name in enumerate(names)}
+
+
+def _cells(thresholds, values):
+    """值落在第幾個門檻區間；與樹的比較方式相同（先轉 float32，<= 門檻往左）"""
+    values = np.asarray(values, dtype=np.float32).astype(np.float64)
+    return np.searchsorted(thresholds, values, side='left')
+
+
+def _cell_values(thresholds):
+    """每個門檻區間內的一個代表值（長度為門檻數 + 1）：門檻本身（轉 float32 後不超過門檻）與最後一個門檻 + 1"""
+    if not len(thresholds):
+        return np.zeros(1)
+    below = thresholds.astype(np.float32)
+    below = np.where(below.astype(np.float64) > thresholds, np.nextafter(below, np.float32(-np.inf)), below)
+    return np.append(below.astype(np.float64), thresholds[-1] + 1.0)
+
+
+class PriceTable:
+    def __init__(self, hours_grid=None, price_grid=None, min_hits=MIN_HITS, max_keys=MAX_KEYS,
+                 max_error=MAX_ERROR, align=True, interval=BUILD_INTERVAL):
+        """align=False 時即使是樹模型也用固定間距網格內插（比較用）"""
+        self.hours_grid = _grid(HOURS_STEP, MAX_HOURS) if hours_grid is None else np.asarray(hours_grid, float)
+        self.price_grid = _grid(PRICE_STEP, MAX_PRICE) if price_grid is None else np.asarray(price_grid, float)
+        self.min_hits = min_hits
+        self.max_keys = max_keys
+        self.max_error = max_error
+        self.align = align
+        self.interval = interval
+        self.version = None
+        self._handle = None
+        self._thresholds = None  # 樹模型的分割門檻；None = 內插網格
+        self._tables = OrderedDict()  # key -> 折扣矩陣 (小時格數, 價格格數)
+        self._seen = Counter()
+        self._rejected = set()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    # ---------- key ----------
+    @staticmethod
+    def key_columns(feature_cols):
+        return [c for c in feature_cols if c not in (HOURS_COL, PRICE_COL)]
+
+    def _key_frame(self, X, key_cols, thresholds):
+        keys = X[key_cols]
+        if thresholds is not None:
+            return pd.DataFrame({col: _cells(thresholds[col], pd.to_numeric(keys[col], errors='coerce'))
+                                 for col in key_cols}, index=X.index)
+        snap_cols = [c for c in key_cols if c in SNAP]
+        if snap_cols:
+            keys = keys.copy()
+            for col in snap_cols:
+                step = SNAP[col]
+                keys[col] = (pd.to_numeric(keys[col], errors='coerce').fillna(0) / step).round() * step
+        return keys
+
+    def _key_values(self, key_cols, key, thresholds):
+        """key -> 建表時使用的特徵值"""
+        if thresholds is None:
+            return dict(zip(key_cols, key))
+        return {col: _cell_values(thresholds[col])[cell] for col, cell in zip(key_cols, key)}
+
+    def _axes(self, thresholds):
+        if thresholds is None:
+            return self.hours_grid, self.price_grid
+        return _cell_values(thresholds[HOURS_COL]), _cell_values(thresholds[PRICE_COL])
+
+    # ---------- 版本 ----------
+    def _check_version(self, handle):
+        if self.version != handle.version:
+            thresholds = split_thresholds(handle.model) if self.align else None
+            with self._lock:
+                if self.version != handle.version:
+                    self._tables.clear()
+                    self._seen.clear()
+                    self._rejected.clear()
+                    self._thresholds = thresholds
+                    self._handle = handle
+                    self.version = handle.version
+                    diagnostics.incr('price_table.invalidated')
+
+    # ---------- 建表 ----------
+    def _lookup(self, table, hours, price, thresholds):
+        if thresholds is None:
+            return self._interpolate(table, hours, price)
+        return table[_cells(thresholds[HOURS_COL], hours), _cells(thresholds[PRICE_COL], price)]
+
+    def _check(self, handle, key_values, table, thresholds):
+        """隨機抽樣與模型推論比對，回傳四捨五入到小數兩位後的最大差"""
+        rng = np.random.default_rng(0)
+        hours_axis, price_axis = self._axes(thresholds)
+        hours = rng.uniform(0, hours_axis[-1] * 1.1 if thresholds is not None else hours_axis[-1], CHECK_ROWS)
+        price = rng.uniform(0, price_axis[-1] * 1.1 if thresholds is not None else price_axis[-1], CHECK_ROWS)
+        sample = pd.DataFrame(key_values, index=range(CHECK_ROWS))
+        sample[HOURS_COL] = hours
+        sample[PRICE_COL] = price
+        expected = np.round(np.asarray(handle.predict(sample[handle.feature_cols]), dtype=float), 2)
+        actual = np.round(self._lookup(table, hours, price, thresholds), 2)
+        return float(np.abs(actual - expected).max())
+
+    def _build(self, handle, key_cols, key, thresholds):
+        """建一張表並抽樣比對；超過 max_error 時不採用，回傳是否建好"""
+        key_values = self._key_values(key_cols, key, thresholds)
+        hours_axis, price_axis = self._axes(thresholds)
+        hours, price = np.meshgrid(hours_axis, price_axis, indexing='ij')
+        grid = pd.DataFrame(key_values, index=range(hours.size))
+        grid[HOURS_COL] = hours.ravel()
+        grid[PRICE_COL] = price.ravel()
+        values = np.asarray(handle.predict(grid[handle.feature_cols]), dtype=float).reshape(hours.shape)
+
+        error = self._check(handle, key_values, values, thresholds)
+        with self._lock:
+            if self.version != handle.version:
+                return False
+            if error > self.max_error:
+                self._rejected.add(key)
+                diagnostics.incr('price_table.rejected')
+                diagnostics.warning("折扣表誤差 %.2f 超過 PRICE_TABLE_MAX_ERROR=%.2f，不採用", error, self.max_error)
+                return False
+            self._tables[key] = values
+            while len(self._tables) > self.max_keys:
+                self._tables.popitem(last=False)
+        diagnostics.incr('price_table.built')
+        return True
+
+    def _build_keys(self, handle, keys):
+        key_cols = self.key_columns(handle.feature_cols)
+        thresholds = self._thresholds
+        built = 0
+        with self._build_lock:
+            for key in keys:
+                if self.version != handle.version:
+                    break
+                if key in self._tables or key in self._rejected:
+                    continue
+                with diagnostics.stage('price_table.build'):
+                    built += self._build(handle, key_cols, key, thresholds)
+        return built
+
+    def precompute(self, handle, contexts):
+        """
+        對指定的情境建表：contexts 為包含特徵欄位的 DataFrame（小時 / 原價 欄位會被忽略）
+        回傳建立的 key 數
+        """
+        self._check_version(handle)
+        key_cols = self.key_columns(handle.feature_cols)
+        keys = self._key_frame(contexts.reindex(columns=handle.feature_cols, fill_value=0), key_cols, self._thresholds)
+        return self._build_keys(handle, list(keys.drop_duplicates().itertuples(index=False, name=None)))
+
+    def pending(self):
+        """出現 min_hits 次以上、還沒有表的 key（出現越多次越前面）"""
+        with self._lock:
+            keys = [key for key, hits in self._seen.most_common()
+                    if hits >= self.min_hits and key not in self._tables and key not in self._rejected]
+        return keys[:self.max_keys]
+
+    def build_pending(self):
+        """為 pending() 的 key 建表（背景執行緒呼叫），回傳建立的 key 數"""
+        handle = self._handle
+        if handle is None:
+            return 0
+        return self._build_keys(handle, self.pending())
+
+    # ---------- 背景建表 ----------
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.build_pending()
+            except Exception as e:
+                diagnostics.error("折扣表建表失敗: %s", e)
+
+    def start(self):
+        """啟動背景建表執行緒（重複呼叫無效）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="price-table", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # ---------- 查表 ----------
+    def _interpolate(self, table, hours, price):
+        hg, pg = self.hours_grid, self.price_grid
+        i = np.clip(np.searchsorted(hg, hours, side='right') - 1, 0, len(hg) - 2)
+        j = np.clip(np.searchsorted(pg, price, side='right') - 1, 0, len(pg) - 2)
+        t = (hours - hg[i]) / (hg[i + 1] - hg[i])
+        u = (price - pg[j]) / (pg[j + 1] - pg[j])
+        return ((1 - t) * (1 - u) * table[i, j] + t * (1 - u) * table[i + 1, j]
+                + (1 - t) * u * table[i, j + 1] + t * u * table[i + 1, j + 1])
+
+    def predict(self, handle, X):
+        """
+        以查表回傳折扣；沒有表或超出網格的列改用 handle.predict（不在這裡建表）
+        X 的欄位需為 handle.feature_cols
+        """
+        self._check_version(handle)
+        thresholds = self._thresholds
+        n = len(X)
+        out = np.empty(n, dtype=float)
+        miss = np.ones(n, dtype=bool)
+
+        hours = pd.to_numeric(X[HOURS_COL], errors='coerce').to_numpy(dtype=float)
+        price = pd.to_numeric(X[PRICE_COL], errors='coerce').to_numpy(dtype=float)
+        if thresholds is None:
+            in_grid = (hours >= 0) & (hours <= self.hours_grid[-1]) & (price >= 0) & (price <= self.price_grid[-1])
+        else:
+            in_grid = ~(np.isnan(hours) | np.isnan(price))
+
+        key_cols = self.key_columns(handle.feature_cols)
+        keys = self._key_frame(X, key_cols, thresholds)
+        groups = keys.groupby(key_cols, sort=False, dropna=False).indices if key_cols else {(): np.arange(n)}
+        for key, positions in groups.items():
+            key = key if isinstance(key, tuple) else (key,)
+            with self._lock:
+                table = self._tables.get(key)
+                if table is not None:
+                    self._tables.move_to_end(key)
+                else:
+                    self._seen[key] += 1
+            if table is None:
+                continue
+            rows = positions[in_grid[positions]]
+            out[rows] = self._lookup(table, hours[rows], price[rows], thresholds)
+            miss[rows] = False
+
+        # 計數器不無限成長
+        with self._lock:
+            if len(self._seen) > self.max_keys * 10:
+                self._seen = Counter(dict(self._seen.most_common(self.max_keys)))
+
+        hits = n - int(miss.sum())
+        diagnostics.incr('price_table.hit', hits)
+        diagnostics.incr('price_table.miss', n - hits)
+        if hits < n:
+            out[miss] = handle.predict(X[miss])
+        return out
+
+    def stats(self):
+        with self._lock:
+            pending = sum(1 for key, hits in self._seen.items()
+                          if hits >= self.min_hits and key not in self._tables and key not in self._rejected)
+            return {
+                "version": self.version,
+                "mode": "interpolated" if self._thresholds is None else "split_aligned",
+                "keys": len(self._tables),
+                "pending": pending,
+                "rejected": len(self._rejected),
+                "grid": [len(axis) for axis in self._axes(self._thresholds)],
+            }
@@ -0,0 +1,134 @@
+import os
+
+import diagnostics
+
+# ----------------- AiPrice / Reason 批次寫回 -----------------
+# staging     : 每個 chunk 以一個多列 INSERT 載入暫存表，再用一個 UPDATE ... JOIN 合併回 product
+# executemany : 直接以 cursor.executemany 送出 UPDATE（不需要建暫存表的權限）
+#               注意：mysqlclient 只會把 INSERT 合併成多列語句，UPDATE 仍是逐筆送出
+# chunk 大小與 commit 頻率可用環境變數調整
+# 只有 Rev 與定價時讀到的相同才寫回（見 repricing.py）；期間被修改的商品保持 PriceDirty，下次定價重算
+# AiPrice 或 Reason 真的改變的商品 Rev +1（讓 /get_products 的 ETag 失效），沒變的只更新定價時間
+
+WRITE_METHOD = os.environ.get("PRICE_WRITE_METHOD", "staging")
+CHUNK_SIZE = int(os.environ.get("PRICE_WRITE_CHUNK_SIZE", 5000))
+COMMIT_EVERY = int(os.environ.get("PRICE_WRITE_COMMIT_EVERY", 1))  # 幾個 chunk commit 一次，0 = 全部寫完才 commit
+
+STAGE_TABLE = "price_stage"
+
+CREATE_STAGE_SQL = f"""
+    CREATE TEMPORARY TABLE IF NOT EXISTS {STAGE_TABLE} (
+        ProductID INT PRIMARY KEY,
+        AiPrice DECIMAL(10,2),
+        AiDiscount DECIMAL(4,2),
+        Reason VARCHAR(16),
+        RepriceAfter DATETIME,
+        Rev INT UNSIGNED NOT NULL,
+        Changed TINYINT(1) NOT NULL DEFAULT 0
+    )
+"""
+
+INSERT_STAGE_SQL = f"""
+    INSERT INTO {STAGE_TABLE} (ProductID, AiPrice, AiDiscount, Reason, RepriceAfter, Rev)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+# 先在暫存表標記 AiPrice / Reason 有變的商品：多表 UPDATE 不保證 SET 的執行順序，
+# 不能在合併時拿 p.AiPrice 新舊值比較
+MARK_CHANGED_SQL = f"""
+    UPDATE {STAGE_TABLE} s
+    JOIN product p ON p.ProductID = s.ProductID
+    SET s.Changed = NOT (p.AiPrice <=> s.AiPrice AND p.Reason <=> s.Reason)
+"""
+
+MERGE_STAGE_SQL = f"""
+    UPDATE product p
+    JOIN {STAGE_TABLE} s ON p.ProductID = s.ProductID
+    SET p.AiPrice = s.AiPrice,
+        p.AiDiscount = s.AiDiscount,
+        p.Reason = s.Reason,
+        p.PriceDirty = 0,
+        p.PricedAt = NOW(),
+        p.RepriceAfter = s.RepriceAfter,
+        p.Rev = p.Rev + s.Changed
+    WHERE p.Rev = s.Rev
+"""
+
+# 單表 UPDATE 的 SET 由左到右執行，Rev 先以舊的 AiPrice / Reason 比較
+UPDATE_SQL = """
+    UPDATE product SET Rev = Rev + NOT (AiPrice <=> %s AND Reason <=> %s),
+        AiPrice=%s, AiDiscount=%s, Reason=%s,
+        PriceDirty=0, PricedAt=NOW(), RepriceAfter=%s
+    WHERE ProductID=%s AND Rev=%s
+"""
+
+
+def _to_records(df):
+    """DataFrame -> DB 參數 tuple（ProductID, AiPrice, AiDiscount, Reason, RepriceAfter, Rev）"""
+    reprice = df['RepriceAfter'].astype(object).where(df['RepriceAfter'].notna(), None)
+    reprice = [ts.to_pydatetime() if ts is not None else None for ts in reprice]
+    return list(zip(
+        df['ProductID'].astype(int).tolist(),
+        df['AiPrice'].astype(float).tolist(),
+        df['AI折扣'].astype(float).tolist(),
+        df['Reason'].astype(str).tolist(),
+        reprice,
+        df['Rev'].astype(int).tolist(),
+    ))
+
+
+def _chunks(records, size):
+    for start in range(0, len(records), size):
+        yield records[start:start + size]
+
+
+def write_prices(connection, df, method=None, chunk_size=None, commit_every=None):
+    """
+    將定價結果分批寫回 product 表
+    connection: MySQLdb 連線（db.Database.connection() 借出的連線）
+    df: 需包含 ProductID, AiPrice, AI折扣, Reason, RepriceAfter, Rev（repricing.fetch_products_to_price 讀出的）
+    回傳實際寫回筆數（Rev 已改變而略過的不算）
+    """
+    method = method or WRITE_METHOD
+    chunk_size = chunk_size or CHUNK_SIZE
+    commit_every = COMMIT_EVERY if commit_every is None else commit_every
+    if method not in ("staging", "executemany"):
+        raise ValueError(f"未知的寫回方式: {method}")
+
+    records = _to_records(df)
+    if not records:
+        return 0
+
+    written = 0
+    cur = connection.cursor()
+    try:
+        if method == "staging":
+            cur.execute(CREATE_STAGE_SQL)
+
+        for i, chunk in enumerate(_chunks(records, chunk_size), start=1):
+            if method == "staging":
+                cur.execute(f"DELETE FROM {STAGE_TABLE}")
+                cur.executemany(INSERT_STAGE_SQL, chunk)
+                cur.execute(MARK_CHANGED_SQL)
+                cur.execute(MERGE_STAGE_SQL)
+            else:
+                # UPDATE 參數順序：AiPrice, Reason（比較用）, AiPrice, AiDiscount, Reason, RepriceAfter, ProductID, Rev
+                cur.executemany(UPDATE_SQL, [(r[1], r[3]) + r[1:5] + r[:1] + r[5:] for r in chunk])
+            written += cur.rowcount
+
+            if commit_every and i % commit_every == 0:
+                connection.commit()
+
+        connection.commit()
+        if method == "staging":
+            cur.execute(f"DROP TEMPORARY TABLE IF EXISTS {STAGE_TABLE}")
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cur.close()
+
+    if written < len(records):
+        diagnostics.incr('price_write.stale', len(records) - written)
+        diagnostics.info("%d 筆商品在定價期間被修改，未寫回（保持待定價）", len(records) - written)
+    return written
@@ -0,0 +1,71 @@
+import numpy as np
+
+# ----------------- 定價引擎 -----------------
+# 每個引擎提供 predict(X) -> 折扣（0~1），X 為 prepare_features 產生的特徵欄位
+# 需要訓練的引擎（forest / gbm / linear）以 ML.py train --engine 訓練，
+# artifact 放進 MODEL_DIR 由 model_server 上線；規則引擎不需要訓練，作為無模型時的退路
+
+ENGINES = ("forest", "gbm", "linear")
+
+
+def build_estimator(engine, n_estimators=100, n_jobs=None, random_state=42):
+    """建立尚未訓練的 sklearn 模型"""
+    if engine == "forest":
+        from sklearn.ensemble import RandomForestRegressor
+        return RandomForestRegressor(n_estimators=n_estimators, random_state=random_state, n_jobs=n_jobs)
+    if engine == "gbm":
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        return HistGradientBoostingRegressor(max_iter=200, learning_rate=0.05, random_state=random_state)
+    if engine == "linear":
+        from sklearn.linear_model import Ridge
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import StandardScaler
+        return make_pipeline(StandardScaler(), Ridge(alpha=1.0))
+    raise ValueError(f"未知的定價引擎: {engine}（可用: {', '.join(ENGINES)}）")
+
+
+# ---------------------- 規則引擎 ----------------------
+# 依剩餘保存期限（小時）決定基本折扣，再依商品大類加減
+# 數值取自田野調查資料各時段 / 類別的平均折扣
+HOURS_SCHEDULE = [
+    (12, 0.35),
+    (24, 0.28),
+    (48, 0.23),
+    (72, 0.18),
+    (float("inf"), 0.15),
+]
+CATEGORY_ADJUST = {
+    "肉類": -0.04,
+    "魚類": 0.0,
+    "蔬果類": 0.04,
+    "麵包甜點類": -0.02,
+    "豆製品類": 0.0,
+    "熟食/其他": 0.05,
+    "其他": 0.02,
+}
+CATEGORY_PREFIX = "商品大類_"
+MAX_DISCOUNT = 0.7
+
+
+class RuleEngine:
+    """不需要模型檔、結果固定的規則定價"""
+
+    def __init__(self, schedule=None, category_adjust=None):
+        schedule = schedule or HOURS_SCHEDULE
+        self.bounds = np.array([b for b, _ in schedule], dtype=float)
+        self.discounts = np.array([d for _, d in schedule], dtype=float)
+        self.category_adjust = dict(CATEGORY_ADJUST if category_adjust is None else category_adjust)
+
+    def predict(self, X):
+        hours = np.asarray(X["剩餘保存期限_小時"], dtype=float)
+        # 第一個 >= 剩餘小時的區間
+        index = np.searchsorted(self.bounds, np.nan_to_num(hours, nan=0.0), side="left")
+        discount = self.discounts[np.minimum(index, len(self.discounts) - 1)]
+
+        adjust = np.zeros(len(hours))
+        for col in X.columns:
+            if col.startswith(CATEGORY_PREFIX):
+                delta = self.category_adjust.get(col[len(CATEGORY_PREFIX):], 0.0)
+                if delta:
+                    adjust += np.asarray(X[col], dtype=float) * delta
+        return np.clip(discount + adjust, 0.0, MAX_DISCOUNT)
@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import diagnostics
+
+# ----------------- 推薦結果快取 -----------------
+# /recommend_products 的結果只在商品、定價或過期狀態改變時才會變，放在 process 內快取：
+#   ("base", ProductID)                              -> (Market, ProductType, ExpireDate, Reason)
+#   ("list", Market, ProductType, ExpireDate, Reason) -> 推薦清單（已整理好的 list of dict）
+# 每筆有 TTL（RECOMMEND_CACHE_TTL 秒），總筆數超過 RECOMMEND_CACHE_MAX 時淘汰最久沒用到的（LRU）
+# 寫入事件（OCR 新增、商品修改 / 刪除、過期掃描、重新定價）呼叫 invalidate(market)，
+# 只清掉該賣場的項目；不知道賣場時（market=None）全部清掉
+# 每次失效都會讓 generation 加一，查詢前取得的 generation 已過期時 put 不會寫入，
+# 避免失效前讀到的舊資料在失效後才被放進快取
+# 快取在各 app worker 各自一份；其他 worker 的寫入（例如只有一個 worker 在跑的過期掃描）靠 TTL 收斂
+
+RECOMMEND_CACHE_TTL = float(os.environ.get("RECOMMEND_CACHE_TTL", 60))
+RECOMMEND_CACHE_MAX = int(os.environ.get("RECOMMEND_CACHE_MAX", 2048))
+
+
+class RecommendCache:
+    def __init__(self, ttl=RECOMMEND_CACHE_TTL, max_entries=RECOMMEND_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.generation = 0
+        self._entries = OrderedDict()  # key -> (到期時間, 賣場, 值)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """命中時回傳值，否則回傳 None"""
+        if not self.max_entries:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                diagnostics.incr('recommend_cache.miss')
+                return None
+            self._entries.move_to_end(key)
+        diagnostics.incr('recommend_cache.hit')
+        return entry[2]
+
+    def put(self, key, market, value, generation):
+        """generation 為查詢 DB 之前的 self.generation；期間有失效就不寫入"""
+        if not self.max_entries:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, market, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, market=None):
+        with self._lock:
+            self.generation += 1
+            if market is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [k for k, entry in self._entries.items() if entry[1] == market]
+                for k in keys:
+                    del self._entries[k]
+                dropped = len(keys)
+        diagnostics.incr('recommend_cache.invalidate')
+        diagnostics.incr('recommend_cache.dropped', dropped)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "ttl_s": self.ttl, "generation": self.generation}
@@ -0,0 +1,302 @@
+import datetime
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from heapq import merge
+
+import pandas as pd
+
+import diagnostics
+
+# ----------------- 推薦索引 -----------------
+# 重新定價本來就會算出每個商品的 Reason，順便維護一份記憶體內的推薦索引，
+# /recommend_products 不必每次到 SQL 依 ExpireDate 掃同賣場的商品：
+#   _items : ProductID -> (Market, ProductType, ExpireDate, Reason, 回傳給前端的 dict)，所有未過期商品
+#   _lists : Market -> ProductType -> [(ExpireDate, ProPrice, ProductID), ...]，只放 Reason='合理'，依 key 排序
+# 同類推薦（不合理的商品）：bisect 找到 ExpireDate <= 基準日的位置往回取，O(log n + k)
+# 異類推薦（合理的商品）：每個其他類別 bisect 到今天、各取前幾筆再合併，O(類別數 × log n)
+# 排序與 LIMIT 與 db.RECOMMEND_*_SQL 相同；另外略過日期已過、但過期掃描還沒更新 Status 的商品
+#
+# 更新方式：
+#   重新定價每片寫回後 upsert_frame（只動到這次有重算的商品）
+#   update_product 後 refresh 該商品、delete_product 後 remove
+#   過期掃描改了狀態、或距上次完整載入超過 RECOMMEND_INDEX_TTL 秒時，下次查詢在背景執行緒從 DB 重新載入，
+#   載入完成前繼續用目前的索引回應；只有第一次載入（還沒有任何索引）時查詢才會等待
+#   （其他 app worker 的重新定價不會通知這個 process，靠 TTL 收斂）
+
+RECOMMEND_INDEX_TTL = float(os.environ.get("RECOMMEND_INDEX_TTL", 600))
+RECOMMEND_LIMIT = 6
+REASONABLE = "合理"
+LIVE_STATUS = "未過期"
+
+INDEX_SELECT = (
+    "SELECT ProductID, ProName, ProPrice, ExpireDate, ImagePath, Market, ProductType, Reason, Status "
+    "FROM product WHERE Status = %s"
+)
+NO_PRICE = float("-inf")  # ProPrice 為 NULL 時排最前面，與 MySQL ORDER BY ... ASC 相同
+
+
+def _price_key(price):
+    return NO_PRICE if price is None else price
+
+
+def _as_date(value):
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        parsed = pd.to_datetime(value, errors='coerce')
+    except (TypeError, ValueError):
+        return None
+    return None if pd.isna(parsed) else parsed.date()
+
+
+def _as_price(value):
+    if value is None:
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if value != value:  # NaN
+        return None
+    return int(value) if value.is_integer() else value
+
+
+class RecommendIndex:
+    def __init__(self, db, ttl=RECOMMEND_INDEX_TTL):
+        self.db = db
+        self.ttl = ttl
+        self._items = {}
+        self._lists = {}
+        self._loaded_at = None
+        self._stale = False  # invalidate() 後、下一次載入開始前為 True
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        # 載入期間收到的更新，換上新索引後再套用一次
+        self._pending = None
+
+    # ---------------------- 建立 / 更新 ----------------------
+    @staticmethod
+    def _record(product_id, name, price, expire, image, market, ptype, reason, status):
+        return product_id, {
+            "ProName": name, "ProPrice": _as_price(price), "ExpireDate": _as_date(expire),
+            "ImagePath": image, "Market": market, "ProductType": ptype, "Reason": reason, "Status": status,
+        }
+
+    @staticmethod
+    def _insert(items, lists, product_id, r, keep_sorted=True):
+        if r["Status"] != LIVE_STATUS:
+            return
+        expire = r["ExpireDate"]
+        out = {
+            "ProductID": product_id, "ProName": r["ProName"], "ProPrice": r["ProPrice"],
+            "ExpireDate": expire.strftime("%Y-%m-%d") if expire else None, "ImagePath": r["ImagePath"],
+        }
+        items[product_id] = (r["Market"], r["ProductType"], expire, r["Reason"], out)
+        if r["Reason"] == REASONABLE and expire is not None:
+            lst = lists.setdefault(r["Market"], {}).setdefault(r["ProductType"], [])
+            key = (expire, _price_key(r["ProPrice"]), product_id)
+            if keep_sorted:
+                insort(lst, key)
+            else:
+                lst.append(key)
+
+    @staticmethod
+    def _remove(items, lists, product_id):
+        old = items.pop(product_id, None)
+        if old is None:
+            return
+        market, ptype, expire, reason, out = old
+        if reason != REASONABLE or expire is None:
+            return
+        lst = lists.get(market, {}).get(ptype)
+        if not lst:
+            return
+        key = (expire, _price_key(out["ProPrice"]), product_id)
+        i = bisect_left(lst, key)
+        if i < len(lst) and lst[i] == key:
+            del lst[i]
+
+    def _apply(self, records):
+        for product_id, r in records:
+            self._remove(self._items, self._lists, product_id)
+            if r is not None:
+                self._insert(self._items, self._lists, product_id, r)
+
+    def _update(self, records):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.extend(records)
+            if self._loaded_at is not None:
+                self._apply(records)
+        diagnostics.incr('recommend_index.update', len(records))
+
+    def _load(self):
+        # 在鎖外查詢與建立，最後一次換上；呼叫端需持有 _load_lock
+        start = time.perf_counter()
+        with self._lock:
+            self._pending = []
+            # 載入開始後才收到的 invalidate() 會讓這個旗標再變回 True，下次查詢再載入一次
+            self._stale = False
+        try:
+            with self.db.cursor() as cur:
+                cur.execute(INDEX_SELECT, (LIVE_STATUS,))
+                rows = cur.fetchall()
+            items, lists = {}, {}
+            for row in rows:
+                product_id, r = self._record(*row)
+                self._insert(items, lists, product_id, r, keep_sorted=False)
+            # 完整載入時先全部放進去再各排序一次，比逐筆 insort 快
+            for by_type in lists.values():
+                for lst in by_type.values():
+                    lst.sort()
+            with self._lock:
+                self._items, self._lists = items, lists
+                self._apply(self._pending)
+                self._loaded_at = time.monotonic()
+        except Exception:
+            self._stale = True
+            raise
+        finally:
+            with self._lock:
+                self._pending = None
+        diagnostics.record_timing('recommend_index.load', time.perf_counter() - start)
+        diagnostics.info("推薦索引載入：%d 筆未過期商品", len(items))
+
+    def load(self):
+        """從 DB 完整重建"""
+        with self._load_lock:
+            self._load()
+
+    def _fresh(self):
+        loaded_at = self._loaded_at
+        return loaded_at is not None and not self._stale and time.monotonic() - loaded_at <= self.ttl
+
+    def _try_load(self):
+        try:
+            self._load()
+        except Exception as e:
+            diagnostics.error("推薦索引載入失敗: %s", e)
+
+    def _reload_in_background(self):
+        # 已經有載入在進行時不重複啟動
+        if not self._load_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                if not self._fresh():
+                    self._try_load()
+            finally:
+                self._load_lock.release()
+
+        diagnostics.incr('recommend_index.background_reload')
+        threading.Thread(target=run, name="recommend-index-reload", daemon=True).start()
+
+    def ensure(self):
+        """
+        索引可用時回傳 True；第一次載入失敗時回傳 False（呼叫端改走 SQL）
+        還沒有索引時同步載入；已過期或被 invalidate() 時在背景重新載入，這次先用目前的索引
+        """
+        if self._fresh():
+            return True
+        if self._loaded_at is not None:
+            self._reload_in_background()
+            return True
+        with self._load_lock:
+            # 同時等待的請求只由第一個載入
+            if self._loaded_at is None:
+                self._try_load()
+        return self._loaded_at is not None
+
+    def invalidate(self):
+        """下次查詢時在背景完整重新載入（過期掃描等大量狀態改變時）"""
+        self._stale = True
+
+    def upsert_frame(self, df):
+        """重新定價的結果（含 ProductID / ProName / ProPrice / ExpireDate / Market / 商品大類 / Reason / Status）"""
+        if not len(df):
+            return
+        image = df['ImagePath'] if 'ImagePath' in df.columns else pd.Series(None, index=df.index)
+        columns = zip(df['ProductID'], df['ProName'], df['ProPrice'], df['ExpireDate'], image,
+                      df['Market'], df['商品大類'], df['Reason'], df['Status'])
+        self._update([self._record(int(pid), *rest) for pid, *rest in columns])
+
+    def refresh(self, product_ids):
+        """從 DB 重新讀取這些商品（商品被修改後）"""
+        if not product_ids:
+            return
+        with self.db.cursor() as cur:
+            cur.execute(
+                INDEX_SELECT.replace("Status = %s", f"ProductID IN ({', '.join(['%s'] * len(product_ids))})"),
+                tuple(product_ids),
+            )
+            found = dict(self._record(*row) for row in cur.fetchall())
+        self._update([(pid, found.get(pid)) for pid in product_ids])
+
+    def remove(self, product_id):
+        self._update([(product_id, None)])
+
+    # ---------------------- 查詢 ----------------------
+    def brief(self, product_id):
+        """(Market, ProductType, ExpireDate, Reason)；不在索引內（已過期或尚未載入）時回傳 None"""
+        if not self.ensure():
+            return None
+        with self._lock:
+            item = self._items.get(product_id)
+        return item[:4] if item is not None else None
+
+    def recommend(self, market, product_type, expire_date, same_type, limit=RECOMMEND_LIMIT, today=None):
+        """
+        same_type=True : 同類、ExpireDate <= 基準日，ExpireDate DESC, ProPrice ASC
+        same_type=False: 其他類別、ExpireDate <= 基準日，ExpireDate ASC, ProPrice ASC
+        回傳 list of dict（欄位同 db.RECOMMEND_COLUMNS）；索引不可用時回傳 None
+        """
+        if not self.ensure():
+            return None
+        expire_date = _as_date(expire_date)
+        if expire_date is None:
+            return []
+        today = today or datetime.date.today()
+        upper = (expire_date, float("inf"))
+        with self._lock:
+            by_type = self._lists.get(market, {})
+            if same_type:
+                lst = by_type.get(product_type, [])
+                keys = []
+                end = bisect_right(lst, upper)
+                # 由基準日往回，每個日期內維持 ProPrice 由小到大
+                while end > 0 and len(keys) < limit:
+                    day = lst[end - 1][0]
+                    if day < today:
+                        break
+                    start = bisect_left(lst, (day,), 0, end)
+                    keys.extend(lst[start:end])
+                    end = start
+            else:
+                heads = []
+                for ptype, lst in by_type.items():
+                    if ptype == product_type:
+                        continue
+                    start = bisect_left(lst, (today,))
+                    end = min(bisect_right(lst, upper, start), start + limit)
+                    heads.append(lst[start:end])
+                keys = list(merge(*heads))
+            products = [self._items[key[2]][4] for key in keys[:limit]]
+        diagnostics.incr('recommend_index.lookup')
+        return products
+
+    def stats(self):
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "reasonable": sum(len(lst) for by_type in self._lists.values() for lst in by_type.values()),
+                "markets": len(self._lists),
+                "age_s": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at is not None else None,
+                "reloading": self._load_lock.locked(),
+            }
@@ -0,0 +1,129 @@
+import pandas as pd
+
+# ----------------- 增量重新定價 -----------------
+# product 表上的定價標記：
+#   PriceDirty   : 1 = 商品新增或被修改過，需要重新定價（ocr_api / update_product 設定）
+#   PricedAt     : 上次定價時間
+#   RepriceAfter : 剩餘保存期限跨到下一個時段（bucket）的時間點，過了就要重新定價
+#   AiDiscount   : 上次模型輸出的折扣，增量模式回傳未重算商品時使用
+#   Rev          : 商品的修訂號，商品被修改（update_product）、過期狀態改變（過期掃描）、
+#                  或重新定價後 AiPrice / Reason 有變時 +1
+#                  定價時連同商品一起讀出，寫回時 Rev 沒變才會覆寫定價並清掉 PriceDirty（見 price_writer.py），
+#                  讀出後才被修改的商品不會被舊資料算出的價格蓋掉
+#                  /get_products 的 ETag 也以該頁商品的 Rev 算出（見 db.user_history）
+# 欄位由 schema.py 的 migration 加上
+# 時間一律以台北時間（naive）寫入，與 MySQL NOW() 的 session 時區一致
+
+LOCAL_TZ = 'Asia/Taipei'
+SHELF_LIFE_BUCKET_HOURS = 6
+
+PRICING_COLUMNS = {
+    'PriceDirty': "TINYINT(1) NOT NULL DEFAULT 1",
+    'PricedAt': "DATETIME NULL",
+    'RepriceAfter': "DATETIME NULL",
+    'AiDiscount': "DECIMAL(4,2) NULL",
+}
+REVISION_COLUMN = ('Rev', "INT UNSIGNED NOT NULL DEFAULT 0")
+
+# ImagePath 不是特徵，帶著是為了定價後直接更新推薦索引（recommend_index.py）
+PRODUCT_SELECT = (
+    "SELECT ProductID, ProName, ProPrice, Price, ExpireDate, Status, ProductType, Market, ImagePath, Rev FROM product"
+)
+PRODUCT_COLUMNS = ['ProductID', 'ProName', 'ProPrice', 'price', 'ExpireDate', 'Status', '商品大類', 'Market', 'ImagePath',
+                   'Rev']
+
+# 尚未過期（Status 為 NULL 的也要算，與原本 df['Status'] != '已過期' 一致）
+LIVE_FILTER = "(Status IS NULL OR Status <> '已過期')"
+# 新增 / 被修改 / 從未定價 / 保存期限跨 bucket 的商品
+STALE_FILTER = "(PriceDirty = 1 OR PricedAt IS NULL OR RepriceAfter IS NULL OR RepriceAfter <= NOW())"
+
+
+def market_filter(markets, params):
+    """markets 不為空時回傳 Market IN (...) 條件並把值加進 params"""
+    if not markets:
+        return ""
+    params.extend(markets)
+    return f" AND Market IN ({', '.join(['%s'] * len(markets))})"
+
+
+def id_range_filter(id_range, params):
+    """id_range=(after_id, upper_id) -> ProductID > after_id AND ProductID <= upper_id"""
+    if id_range is None:
+        return ""
+    params.extend(id_range)
+    return " AND ProductID > %s AND ProductID <= %s"
+
+
+def page_upper_bound(cur, after_id, limit, markets=None):
+    """
+    keyset 分頁：ProductID > after_id 的前 limit 筆未過期商品中最大的 ProductID
+    沒有下一頁時回傳 None
+    """
+    params = [after_id]
+    query = (
+        f"SELECT MAX(ProductID) FROM (SELECT ProductID FROM product WHERE {LIVE_FILTER} AND ProductID > %s"
+        + market_filter(markets, params)
+        + " ORDER BY ProductID LIMIT %s) page"
+    )
+    params.append(limit)
+    cur.execute(query, tuple(params))
+    row = cur.fetchone()
+    return row[0] if row and row[0] is not None else None
+
+
+def fetch_products_to_price(cur, full=False, product_id=None, markets=None, id_range=None):
+    """
+    取出需要重新定價的商品
+    full=True: 所有未過期商品（完整重算）
+    full=False: 只取新增 / 被修改 / 保存期限跨 bucket 的商品
+    product_id: 只取這個商品；增量模式下只有它需要重算時才會取出
+    markets: 只取這些賣場的商品
+    id_range: (after_id, upper_id) 只取這段 ProductID（分頁用）
+    """
+    params = []
+    query = f"{PRODUCT_SELECT} WHERE {LIVE_FILTER}" + market_filter(markets, params) + id_range_filter(id_range, params)
+    if product_id is not None:
+        query += " AND ProductID = %s"
+        params.append(product_id)
+    if not full:
+        query += f" AND {STALE_FILTER}"
+    query += " ORDER BY ProductID"
+    cur.execute(query, tuple(params))
+    rows = cur.fetchall()
+    return pd.DataFrame(list(rows), columns=PRODUCT_COLUMNS)
+
+
+def fetch_priced_products(cur, product_id=None, markets=None, id_range=None):
+    """直接從 DB 讀出目前的定價結果（不做推論）"""
+    params = []
+    query = (
+        "SELECT ProductID, ProName, ProPrice, AiDiscount, AiPrice, Reason "
+        f"FROM product WHERE {LIVE_FILTER}"
+    ) + market_filter(markets, params) + id_range_filter(id_range, params)
+    if product_id is not None:
+        query += " AND ProductID = %s"
+        params.append(product_id)
+    query += " ORDER BY ProductID"
+    cur.execute(query, tuple(params))
+    rows = cur.fetchall()
+    df = pd.DataFrame(list(rows), columns=['ProductID', 'ProName', 'ProPrice', 'AI折扣', 'AiPrice', 'Reason'])
+    for col in ['ProPrice', 'AI折扣', 'AiPrice']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def reprice_after(remaining_hours, now=None, bucket_hours=SHELF_LIFE_BUCKET_HOURS):
+    """
+    依剩餘保存期限（小時）算出下次需要重新定價的時間：
+    剩餘時間跌到目前 bucket 的下界時，bucket 就變了
+    已過期（<= 0）的商品每個 bucket 長度檢查一次
+    """
+    if now is None:
+        now = pd.Timestamp.now(tz=LOCAL_TZ).tz_localize(None).floor('s')
+    hours = pd.to_numeric(remaining_hours, errors='coerce').fillna(0).astype(float)
+    until_next = hours - (hours // bucket_hours) * bucket_hours
+    until_next = until_next.where(hours > 0, float(bucket_hours))
+    # 至少等一分鐘，避免剛好落在邊界時立刻又被選中
+    until_next = until_next.clip(lower=1 / 60)
+    return now + pd.to_timedelta(until_next, unit='h')
+
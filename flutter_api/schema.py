@@ -0,0 +1,180 @@
+import sys
+
+from context_provider import CONTEXT_TABLE_SQL
+from repricing import PRICING_COLUMNS, REVISION_COLUMN
+
+# ----------------- 資料表與版本化 migration -----------------
+# 依版本號依序套用，已套用的版本記在 schema_migrations 表
+# 每一步都可重複執行（CREATE TABLE IF NOT EXISTS / 先查 information_schema 再加欄位、索引），
+# 所以在手動建好表的既有資料庫上第一次執行也安全
+# 多個 worker 同時啟動時以 GET_LOCK 排隊，只會有一個真的執行
+#
+# 用法：
+#   app 啟動時以連線池借一條連線呼叫 migrate(conn)
+#   python schema.py migrate   # 以 db_config 連線套用
+#   python schema.py status    # 列出各版本是否已套用
+
+MIGRATE_LOCK = "schema_migrate"
+NGRAM_TOKEN_SIZE = 2  # MySQL ngram_token_size 預設值；比這短的關鍵字無法用全文索引
+
+USERS_SQL = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(100) NULL,
+        phone VARCHAR(20) NULL,
+        email VARCHAR(255) NOT NULL,
+        password VARCHAR(255) NOT NULL
+    ) DEFAULT CHARSET=utf8mb4
+"""
+PRODUCT_SQL = """
+    CREATE TABLE IF NOT EXISTS product (
+        ProductID INT AUTO_INCREMENT PRIMARY KEY,
+        ProName VARCHAR(255) NULL,
+        ExpireDate DATE NULL,
+        Price INT NULL,
+        ProPrice INT NULL,
+        Market VARCHAR(100) NULL,
+        Status VARCHAR(10) NULL,
+        ProductType VARCHAR(20) NULL,
+        ImagePath VARCHAR(255) NULL,
+        AiPrice INT NULL,
+        Reason VARCHAR(10) NULL
+    ) DEFAULT CHARSET=utf8mb4
+"""
+HISTORY_SQL = """
+    CREATE TABLE IF NOT EXISTS history (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        userID INT NOT NULL,
+        productID INT NOT NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) DEFAULT CHARSET=utf8mb4
+"""
+MIGRATIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def add_column(table, column, ddl):
+    def step(cur):
+        cur.execute(
+            "SELECT 1 FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+            (table, column),
+        )
+        if not cur.fetchone():
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+            print(f"{table} 新增欄位 {column}")
+    return step
+
+
+def add_index(table, name, definition):
+    """definition 例如 "INDEX (a, b)"、"FULLTEXT (c) WITH PARSER ngram" """
+    def step(cur):
+        cur.execute(
+            "SELECT 1 FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+            (table, name),
+        )
+        if not cur.fetchone():
+            kind, columns = definition.split(" ", 1)
+            cur.execute(f"ALTER TABLE {table} ADD {kind} {name} {columns}")
+            print(f"{table} 新增索引 {name}")
+    return step
+
+
+# (版本, 說明, [SQL 或 callable(cur), ...])
+MIGRATIONS = [
+    (1, "基本資料表", [USERS_SQL, PRODUCT_SQL, HISTORY_SQL]),
+    (2, "定價標記欄位", [add_column("product", col, ddl) for col, ddl in PRICING_COLUMNS.items()]),
+    (3, "查詢用索引", [
+        # get_products：WHERE userID = ? [AND created_at 區間] ORDER BY created_at DESC
+        add_index("history", "idx_history_user_created", "INDEX (userID, created_at)"),
+        # 掃描紀錄儲存前的重複檢查：WHERE userID = ? AND productID = ?
+        add_index("history", "idx_history_user_product", "INDEX (userID, productID)"),
+        add_index("history", "idx_history_product", "INDEX (productID)"),
+        # recommend_products：Market / Status / Reason 等值，ExpireDate 範圍 + 排序
+        add_index("product", "idx_product_recommend", "INDEX (Market, Status, Reason, ExpireDate)"),
+        add_index("product", "idx_product_recommend_type", "INDEX (Market, Status, Reason, ProductType, ExpireDate)"),
+        # 過期狀態掃描：ExpireDate < CURDATE() / >= CURDATE()
+        add_index("product", "idx_product_expire", "INDEX (ExpireDate)"),
+        add_index("users", "idx_users_email", "INDEX (email)"),
+    ]),
+    (4, "商品名稱全文檢索（ngram）", [
+        add_index("product", "ft_product_name", "FULLTEXT (ProName) WITH PARSER ngram"),
+    ]),
+    (5, "賣場情境表", [CONTEXT_TABLE_SQL]),
+    (6, "商品修訂號", [add_column("product", *REVISION_COLUMN)]),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def applied_versions(cur):
+    cur.execute(MIGRATIONS_TABLE_SQL)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def migrate(conn):
+    """套用所有尚未套用的 migration，回傳這次套用的版本"""
+    cur = conn.cursor()
+    done = []
+    try:
+        cur.execute("SELECT GET_LOCK(%s, 60)", (MIGRATE_LOCK,))
+        row = cur.fetchone()
+        if not row or row[0] != 1:
+            raise RuntimeError("等待 schema migration 鎖逾時")
+        try:
+            applied = applied_versions(cur)
+            for version, description, steps in MIGRATIONS:
+                if version in applied:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(cur)
+                    else:
+                        cur.execute(step)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description),
+                )
+                conn.commit()
+                done.append(version)
+                print(f"schema migration {version}：{description}")
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (MIGRATE_LOCK,))
+            cur.fetchall()
+    finally:
+        cur.close()
+    return done
+
+
+def name_search_clause(search, column="p.ProName"):
+    """
+    商品名稱搜尋條件：關鍵字長度夠時用 ngram 全文索引（詞組比對，等同連續子字串），
+    太短（單一中文字）時退回 LIKE
+    回傳 (SQL 片段, 參數)
+    """
+    search = search.strip()
+    if len(search) >= NGRAM_TOKEN_SIZE:
+        phrase = '"' + search.replace('"', ' ') + '"'
+        return f"MATCH({column}) AGAINST (%s IN BOOLEAN MODE)", phrase
+    return f"{column} LIKE %s", f"%{search}%"
+
+
+if __name__ == "__main__":
+    from db import Database
+
+    with Database(size=1).connection() as conn:
+        command = sys.argv[1] if len(sys.argv) > 1 else "status"
+        if command == "migrate":
+            print("已套用:", migrate(conn) or "（無，已是最新）")
+        else:
+            cur = conn.cursor()
+            applied = applied_versions(cur)
+            cur.close()
+            for version, description, _ in MIGRATIONS:
+                print(f"{'✔' if version in applied else ' '} {version:>3}  {description}")
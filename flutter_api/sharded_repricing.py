@@ -0,0 +1,193 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+import diagnostics
+import ml_model
+from price_writer import write_prices
+
+# ----------------- 依賣場分片重新定價 -----------------
+# 待定價商品依 Market 分片，每片在 worker process 裡做特徵與推論（ml_model.price_frame），
+# 結果回到主 process 後各片各自寫回 DB（各自從連線池借連線、各自的交易，一片失敗不影響其他片）
+# 先完成的片先寫，不用等最慢的賣場
+# 情境快照在主 process 取好再連同資料送出，worker 不需要連 DB
+# 模型版本由主 process 在每次執行開始時鎖定，worker 以同一版本定價（不自己跟著 CURRENT 走）
+# worker 裡記錄的階段耗時、計數與模型推論統計隨結果送回，併入主 process 的 /metrics 與 /model
+# REPRICE_WORKERS    : worker process 數量，0 = 全部在主 process 依序處理
+# REPRICE_INLINE_ROWS: 總筆數低於此值（或只有一片）時不走 process pool，省下傳輸成本
+#                      /predict_price 每頁各自呼叫 run()，頁大小（app.PREDICT_PAGE_SIZE）需大於此值才會用到 pool
+
+REPRICE_WORKERS = int(os.environ.get("REPRICE_WORKERS", min(4, os.cpu_count() or 1)))
+REPRICE_INLINE_ROWS = int(os.environ.get("REPRICE_INLINE_ROWS", 2000))
+NO_MARKET = ""
+
+
+def _init_worker():
+    # 先載入模型，第一片不必等
+    ml_model.current_engine()
+    ml_model.start_price_table()
+
+
+def _price_shard(market, df, handle):
+    start = time.perf_counter()
+    priced = ml_model.price_frame(df, handle=handle)
+    return market, priced, time.perf_counter() - start
+
+
+def _price_shard_remote(market, df, version, sampled):
+    """
+    在 worker process 裡定價一片
+    回傳 (market, 定價結果, 計算秒數, diagnostics 指標, 模型推論統計的增量)
+    """
+    # worker 一次只處理一片，清掉上一片的指標，回傳的就是這一片的
+    diagnostics.reset()
+    with diagnostics.sampling(sampled):
+        handle = ml_model.engine_for(version)
+        calls, predictions, latency_s, _ = handle.usage()
+        _, priced, compute_s = _price_shard(market, df, handle)
+    after = handle.usage()
+    usage = (after[0] - calls, after[1] - predictions, after[2] - latency_s, after[3])
+    return market, priced, compute_s, diagnostics.snapshot(), usage
+
+
+class ShardReport:
+    def __init__(self, market, rows):
+        self.market = market
+        self.rows = rows
+        self.submitted = time.perf_counter()
+        self.compute_s = None
+        self.write_s = None
+        self.written = 0
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "market": self.market,
+            "rows": self.rows,
+            "compute_s": round(self.compute_s, 4) if self.compute_s is not None else None,
+            "write_s": round(self.write_s, 4) if self.write_s is not None else None,
+            "written": self.written,
+            "error": self.error,
+        }
+
+
+class ShardedRepricer:
+    def __init__(self, workers=REPRICE_WORKERS, inline_rows=REPRICE_INLINE_ROWS, on_write=None):
+        self.workers = workers
+        self.inline_rows = inline_rows
+        # 每片寫回成功後呼叫 on_write(market, 定價結果)（例如更新推薦索引、讓推薦快取失效）
+        self.on_write = on_write
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # 第一次使用時才建立，避免 reloader 的父 process 也啟動一組 worker
+        with self._lock:
+            if self._executor is None:
+                ctx = multiprocessing.get_context("spawn")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=ctx, initializer=_init_worker
+                )
+            return self._executor
+
+    def _reset_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def split(df):
+        markets = df['Market'].fillna(NO_MARKET).astype(str) if 'Market' in df.columns \
+            else pd.Series(NO_MARKET, index=df.index)
+        return {market: shard for market, shard in df.groupby(markets, sort=False)}
+
+    def _write(self, report, priced, db):
+        start = time.perf_counter()
+        try:
+            with diagnostics.stage('db_write'), db.connection() as conn:
+                report.written = write_prices(conn, priced)
+            if self.on_write is not None and report.written:
+                self.on_write(report.market or None, priced)
+        except Exception as e:
+            report.error = f"寫回失敗: {e}"
+            diagnostics.error("賣場 %s 寫回 AiPrice 失敗: %s", report.market or "(未指定)", e)
+        report.write_s = time.perf_counter() - start
+
+    def _finish(self, report, priced, compute_s, db, update_db, results):
+        report.compute_s = compute_s
+        if update_db and db is not None:
+            self._write(report, priced, db)
+        results.append(priced)
+        label = report.market or "(未指定)"
+        diagnostics.record_timing(f"reprice.shard.{label}", time.perf_counter() - report.submitted)
+        diagnostics.info("賣場 %s：%d 筆，計算 %.3fs，寫回 %s 筆", label, report.rows, compute_s, report.written)
+
+    def run(self, df, db=None, update_db=True):
+        """
+        回傳 (定價結果 DataFrame（ml_model.RESULT_COLUMNS，原順序）, [ShardReport, ...])
+        """
+        if not len(df):
+            return pd.DataFrame(columns=ml_model.RESULT_COLUMNS), []
+        diagnostics.incr('predict_price.rows', len(df))
+        # 整批使用同一個模型版本，即使中途熱更新也不會混用
+        handle = ml_model.current_engine()
+
+        with diagnostics.stage('reprice.context'):
+            df = ml_model.fill_context(df.copy(deep=False))
+        shards = self.split(df)
+        reports = {market: ShardReport(market, len(shard)) for market, shard in shards.items()}
+        results = []
+
+        inline = self.workers <= 0 or len(shards) == 1 or len(df) < self.inline_rows
+        with diagnostics.stage('reprice.total'), diagnostics.sampling() as sampled:
+            if inline:
+                for market, shard in shards.items():
+                    try:
+                        _, priced, compute_s = _price_shard(market, shard, handle)
+                    except Exception as e:
+                        reports[market].error = str(e) or type(e).__name__
+                        diagnostics.error("賣場 %s 定價失敗: %s", market or "(未指定)", e)
+                        continue
+                    self._finish(reports[market], priced, compute_s, db, update_db, results)
+            else:
+                self._run_pool(shards, reports, handle, sampled, db, update_db, results)
+
+        priced = pd.concat(results).sort_index() if results else pd.DataFrame(columns=ml_model.RESULT_COLUMNS)
+        return priced[ml_model.RESULT_COLUMNS], list(reports.values())
+
+    def _run_pool(self, shards, reports, handle, sampled, db, update_db, results):
+        executor = self._get_executor()
+        futures = {}
+        try:
+            for market, shard in shards.items():
+                reports[market].submitted = time.perf_counter()
+                futures[executor.submit(_price_shard_remote, market, shard, handle.version, sampled)] = market
+        except BrokenProcessPool:
+            self._reset_executor(executor)
+            raise
+        broken = False
+        for future in as_completed(futures):
+            market = futures[future]
+            try:
+                _, priced, compute_s, metrics, usage = future.result()
+            except Exception as e:
+                broken = broken or isinstance(e, BrokenProcessPool)
+                reports[market].error = str(e) or type(e).__name__
+                diagnostics.error("賣場 %s 定價失敗: %s", market or "(未指定)", e)
+                continue
+            diagnostics.merge(metrics)
+            handle.add_usage(*usage)
+            self._finish(reports[market], priced, compute_s, db, update_db, results)
+        if broken:
+            diagnostics.warning("重新定價 worker pool 已損壞，下次重新建立")
+            self._reset_executor(executor)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
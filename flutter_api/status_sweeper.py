@@ -0,0 +1,110 @@
+import datetime
+import os
+import threading
+import time
+
+import diagnostics
+
+# ----------------- 過期狀態定時掃描 -----------------
+# 依 ExpireDate 更新 product.Status（已過期 / 未過期），只更新狀態真的改變的列
+# 每 STATUS_SWEEP_INTERVAL 秒一次，並在跨日（午夜）後立刻補跑一次
+# 多個 app worker 同時啟動時，以 MySQL GET_LOCK 確保同一時間只有一個在掃
+# 重新變成未過期的商品（例如日期被改）標記 PriceDirty 並 Rev +1，下次定價會重算
+
+STATUS_SWEEP_INTERVAL = float(os.environ.get("STATUS_SWEEP_INTERVAL", 300))
+STATUS_SWEEP_LOCK = "product_status_sweep"
+
+# ExpireDate 直接和 CURDATE() 比較（不包函式），可以用到 ExpireDate 索引
+EXPIRE_SQL = """
+    UPDATE product SET Status = '已過期', Rev = Rev + 1
+    WHERE ExpireDate < CURDATE() AND (Status IS NULL OR Status <> '已過期')
+"""
+REVIVE_SQL = """
+    UPDATE product SET Status = '未過期', PriceDirty = 1, Rev = Rev + 1
+    WHERE ExpireDate >= CURDATE() AND (Status IS NULL OR Status <> '未過期')
+"""
+
+
+def seconds_until_midnight(now=None):
+    now = now or datetime.datetime.now()
+    tomorrow = (now + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (tomorrow - now).total_seconds()
+
+
+class StatusSweeper:
+    def __init__(self, db, interval=STATUS_SWEEP_INTERVAL, lock_name=STATUS_SWEEP_LOCK, on_change=None):
+        self.db = db
+        # 有商品狀態改變時呼叫 on_change()（例如讓推薦快取失效）
+        self.on_change = on_change
+        self.interval = interval
+        self.lock_name = lock_name
+        self.last = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def sweep(self):
+        """
+        執行一次掃描（GET_LOCK、UPDATE 與 RELEASE_LOCK 用同一條借來的連線），回傳
+        {"expired": 變成已過期的筆數, "revived": 變回未過期的筆數, "duration_s": 秒, "skipped": 是否因其他 worker 正在掃而略過}
+        """
+        start = time.perf_counter()
+        result = {"expired": 0, "revived": 0, "skipped": False, "at": datetime.datetime.now().isoformat(timespec="seconds")}
+        try:
+            with self.db.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute("SELECT GET_LOCK(%s, 0)", (self.lock_name,))
+                    row = cur.fetchone()
+                    if not row or row[0] != 1:
+                        result["skipped"] = True
+                        diagnostics.incr('status_sweep.skipped')
+                        return result
+                    try:
+                        cur.execute(EXPIRE_SQL)
+                        result["expired"] = cur.rowcount
+                        cur.execute(REVIVE_SQL)
+                        result["revived"] = cur.rowcount
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    finally:
+                        cur.execute("SELECT RELEASE_LOCK(%s)", (self.lock_name,))
+                        cur.fetchall()
+                finally:
+                    cur.close()
+        finally:
+            result["duration_s"] = round(time.perf_counter() - start, 4)
+            self.last = result
+
+        if self.on_change is not None and (result["expired"] or result["revived"]):
+            self.on_change()
+        diagnostics.record_timing('status_sweep', result["duration_s"])
+        diagnostics.incr('status_sweep.expired', result["expired"])
+        diagnostics.incr('status_sweep.revived', result["revived"])
+        diagnostics.info("過期狀態掃描：%d 筆變為已過期、%d 筆變回未過期（%.3fs）",
+                         result["expired"], result["revived"], result["duration_s"])
+        return result
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                diagnostics.error("過期狀態掃描失敗: %s", e)
+            # 跨日後幾秒內補跑，不必等滿一個 interval
+            delay = min(self.interval, seconds_until_midnight() + 5)
+            self._stop.wait(delay)
+
+    def start(self):
+        """啟動背景執行緒（重複呼叫無效），啟動後立刻掃一次"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="status-sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
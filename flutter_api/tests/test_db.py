@@ -0,0 +1,106 @@
+"""
+db.py 批次寫入測試：executemany 必須合併成單一多列 INSERT
+
+用法（在 flutter_api/ 下執行，需要 mysqlclient，不需要 MySQL 伺服器）:
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+MySQLdb = pytest.importorskip("MySQLdb")
+from MySQLdb.cursors import RE_INSERT_VALUES, Cursor  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+class FakeConnection:
+    """只提供 mysqlclient Cursor 組 SQL 時需要的 encoding / literal"""
+    encoding = "utf8"
+
+    def literal(self, value):
+        return repr(value).encode()
+
+
+class RecordingCursor(Cursor):
+    """不連資料庫：記錄實際送出的每個語句，SELECT 依 responder 回傳結果"""
+
+    def __init__(self, responder, next_id=100, step=1):
+        super().__init__(FakeConnection())
+        self.statements = []
+        self.responder = responder
+        self.next_id = next_id
+        self.step = step
+        self._rows = []
+
+    def execute(self, query, args=None):
+        sql = query.decode() if isinstance(query, (bytes, bytearray)) else query
+        self.statements.append(sql)
+        if sql.lstrip().upper().startswith("INSERT"):
+            rows = max(1, sql.count("),("))
+            self.lastrowid = self.next_id
+            self.next_id += rows * self.step
+            return rows
+        self._rows = self.responder(sql, args)
+        return len(self._rows)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+
+def make_records(n):
+    return [
+        {"ProName": f"商品{i}", "ExpireDate": "2025-10-01", "Price": 100 + i, "ProPrice": 80 + i,
+         "Market": "全聯中正店", "Status": "未過期", "ProductType": "肉類", "ImagePath": f"uploads/{i}.jpg"}
+        for i in range(n)
+    ]
+
+
+def inserts(cur):
+    return [s for s in cur.statements if s.lstrip().upper().startswith("INSERT")]
+
+
+@pytest.mark.parametrize("sql", [db.PRODUCT_INSERT_SQL, db.HISTORY_BATCH_INSERT_SQL])
+def test_batch_insert_sql_is_rewritable(sql):
+    assert RE_INSERT_VALUES.match(sql)
+
+
+def test_insert_products_single_statement():
+    records = make_records(5)
+
+    def responder(sql, args):
+        if "@@auto_increment_increment" in sql:
+            return [(1,)]
+        if sql.lstrip().startswith("SELECT ProductID"):
+            return [(pid, r["ProName"], r["ImagePath"]) for pid, r in zip(args, records)]
+        return []
+
+    cur = RecordingCursor(responder)
+    ids = db.insert_products(cur, records)
+
+    assert ids == [100, 101, 102, 103, 104]
+    assert len(inserts(cur)) == 1
+    assert not any("ROLLBACK" in s for s in cur.statements)
+
+
+def test_insert_products_falls_back_when_ids_mismatch():
+    records = make_records(3)
+    cur = RecordingCursor(lambda sql, args: [(1,)] if "@@auto_increment_increment" in sql else [])
+    ids = db.insert_products(cur, records)
+
+    # 讀回對不上：退回 savepoint，逐筆各一個 INSERT
+    assert any("ROLLBACK TO SAVEPOINT" in s for s in cur.statements)
+    assert len(inserts(cur)) == 1 + len(records)
+    assert len(ids) == len(records)
+
+
+def test_add_histories_single_statement():
+    cur = RecordingCursor(lambda sql, args: [("2025-10-01 12:00:00",)] if "NOW()" in sql else [])
+    db.add_histories(cur, 7, [1, 2, 3])
+    assert len(inserts(cur)) == 1
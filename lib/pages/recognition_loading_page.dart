@@ -60,6 +60,9 @@ class _RecognitionLoadingPageState extends State<RecognitionLoadingPage> {
       // 2. market 欄位
       request.fields['market'] = widget.market ?? '未知賣場';
 
+      // 等待辨識完成後直接回傳結果（不使用非同步 job）
+      request.fields['sync'] = '1';
+
       // 3. 帶入 JWT Token
       if (widget.token != null) {
         request.headers['Authorization'] = 'Bearer ${widget.token}';